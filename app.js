@@ -8,10 +8,17 @@ const API_URL = 'https://freelance-tracker-api.onrender.com/api';
 
 let currentPage = 'home';
 let currentUser = null;
-let allClients = []; // Store all clients for search filtering
-let allInvoices = []; // Store all invoices for status filtering
 let currentFilter = 'all'; // Current invoice filter status
 
+// Lists render from the local store PAGE_SIZE rows at a time; each
+// "Load more" click shows another page
+const PAGE_SIZE = 50;
+let clientsShown = PAGE_SIZE;
+let invoicesShown = PAGE_SIZE;
+
+// Invoices shown in the dashboard's recent activity widget
+const RECENT_INVOICES = 5;
+
 // Initialize app on page load
 function init() {
     checkAuthStatus();
@@ -39,10 +46,7 @@ async function checkAuthStatus() {
             }
             
             showMainApp();
-            loadStats();
-            loadClients();
-            loadInvoices();
-            loadClientOptions();
+            syncStore();
         } else {
             showAuthPage('login');
         }
@@ -133,6 +137,8 @@ async function logout() {
         });
         
         currentUser = null;
+        responseCache.clear();
+        resetStore();
         showAuthPage('login');
         alert('Logged out successfully!');
     } catch (error) {
@@ -250,7 +256,7 @@ function updateSettingsPage() {
 }
 
 function loadSettingsStats() {
-    fetch(`${API_URL}/stats`, { credentials: 'include' })
+    cachedFetch(`${API_URL}/stats`)
         .then(response => response.json())
         .then(stats => {
             document.getElementById('settings-total-clients').textContent = stats.total_clients || 0;
@@ -264,98 +270,76 @@ function loadSettingsStats() {
 
 // ============ DASHBOARD ============
 
-async function loadStats() {
-    try {
-        const response = await fetch(`${API_URL}/stats`, {
-            credentials: 'include'
-        });
-        
-        if (!response.ok) {
-            if (response.status === 401) {
-                showAuthPage('login');
-                return;
-            }
-            throw new Error('Failed to load stats');
-        }
-        
-        const stats = await response.json();
-        
-        document.getElementById('home-total-clients').textContent = stats.total_clients;
-        document.getElementById('home-total-invoices').textContent = stats.total_invoices;
-        document.getElementById('home-paid-total').textContent = `KSh ${stats.paid_total.toFixed(2)}`;
-        document.getElementById('home-unpaid-total').textContent = `KSh ${stats.unpaid_total.toFixed(2)}`;
-        
-        document.getElementById('month-revenue').textContent = `KSh ${stats.paid_total.toFixed(2)}`;
-        if (stats.total_invoices > 0) {
-            const avg = (stats.paid_total + stats.unpaid_total) / stats.total_invoices;
-            document.getElementById('avg-invoice').textContent = `KSh ${avg.toFixed(2)}`;
-        }
-        
-        loadRecentInvoices();
-    } catch (error) {
-        console.error('Error loading stats:', error);
+// Stats, recent invoices and client options all render from the local store
+function renderDashboard() {
+    if (store.stats) {
+        renderStats(store.stats);
     }
+    
+    const invoices = [...store.invoices.values()].sort(newestFirst);
+    renderRecentInvoices(withClientNames(invoices.slice(0, RECENT_INVOICES)));
+    renderClientOptions([...store.clients.values()].sort(newestFirst));
 }
 
-async function loadRecentInvoices() {
-    try {
-        const response = await fetch(`${API_URL}/invoices`, {
-            credentials: 'include'
-        });
-        
-        if (!response.ok) return;
-        
-        const invoices = await response.json();
-        const recentList = document.getElementById('recent-invoices-list');
-        
-        if (invoices.length === 0) {
-            recentList.innerHTML = '<p class="empty-message">No invoices yet</p>';
-            return;
-        }
-        
-        const recent = invoices.slice(0, 5);
-        recentList.innerHTML = recent.map(invoice => `
-            <div class="activity-item">
-                <div>
-                    <strong>${invoice.client_name}</strong>
-                    <p style="font-size: 0.875rem; color: var(--text-secondary);">${invoice.description || 'No description'}</p>
-                </div>
-                <div style="text-align: right;">
-                    <strong>KSh ${parseFloat(invoice.amount).toFixed(2)}</strong>
-                    <p style="font-size: 0.875rem;">
-                        <span class="status-badge ${invoice.status}">${invoice.status.toUpperCase()}</span>
-                    </p>
-                </div>
-            </div>
-        `).join('');
-    } catch (error) {
-        console.error('Error loading recent invoices:', error);
+function renderStats(stats) {
+    document.getElementById('home-total-clients').textContent = stats.total_clients;
+    document.getElementById('home-total-invoices').textContent = stats.total_invoices;
+    document.getElementById('home-paid-total').textContent = `KSh ${stats.paid_total.toFixed(2)}`;
+    document.getElementById('home-unpaid-total').textContent = `KSh ${stats.unpaid_total.toFixed(2)}`;
+    
+    document.getElementById('month-revenue').textContent = `KSh ${stats.paid_total.toFixed(2)}`;
+    if (stats.total_invoices > 0) {
+        const avg = (stats.paid_total + stats.unpaid_total) / stats.total_invoices;
+        document.getElementById('avg-invoice').textContent = `KSh ${avg.toFixed(2)}`;
+    }
+}
+
+function renderRecentInvoices(recent) {
+    const recentList = document.getElementById('recent-invoices-list');
+    
+    if (recent.length === 0) {
+        recentList.innerHTML = '<p class="empty-message">No invoices yet</p>';
+        return;
     }
+    
+    recentList.innerHTML = recent.map(invoice => `
+        <div class="activity-item">
+            <div>
+                <strong>${invoice.client_name}</strong>
+                <p style="font-size: 0.875rem; color: var(--text-secondary);">${invoice.description || 'No description'}</p>
+            </div>
+            <div style="text-align: right;">
+                <strong>KSh ${parseFloat(invoice.amount).toFixed(2)}</strong>
+                <p style="font-size: 0.875rem;">
+                    <span class="status-badge ${invoice.status}">${invoice.status.toUpperCase()}</span>
+                </p>
+            </div>
+        </div>
+    `).join('');
 }
 
 
 // ============ CLIENTS (WITH SEARCH & EDIT) ============
 
-async function loadClients() {
-    try {
-        const response = await fetch(`${API_URL}/clients`, {
-            credentials: 'include'
-        });
-        
-        if (!response.ok) {
-            if (response.status === 401) {
-                showAuthPage('login');
-                return;
-            }
-            throw new Error('Failed to load clients');
-        }
-        
-        const clients = await response.json();
-        allClients = clients; // Store for filtering
-        renderClients(clients);
-    } catch (error) {
-        console.error('Error loading clients:', error);
+// Renders the clients matching the search box, newest first
+function showClients() {
+    const searchTerm = document.getElementById('client-search')?.value.trim().toLowerCase();
+    let clients = [...store.clients.values()];
+    if (searchTerm) {
+        clients = clients.filter(client =>
+            client.name.toLowerCase().includes(searchTerm) ||
+            client.email.toLowerCase().includes(searchTerm)
+        );
     }
+    
+    clients.sort(newestFirst);
+    toggleLoadMore('clients-load-more', clients.length > clientsShown);
+    renderClients(clients.slice(0, clientsShown));
+}
+
+function loadMoreClients() {
+    clientsShown += PAGE_SIZE;
+    showClients();
 }
 
 function renderClients(clients) {
@@ -380,16 +364,10 @@ function renderClients(clients) {
     `).join('');
 }
 
-// NEW: Search/Filter clients
+// Search the local store as the user types
 function filterClients() {
-    const searchTerm = document.getElementById('client-search').value.toLowerCase();
-    
-    const filtered = allClients.filter(client => 
-        client.name.toLowerCase().includes(searchTerm) ||
-        client.email.toLowerCase().includes(searchTerm)
-    );
-    
-    renderClients(filtered);
+    clientsShown = PAGE_SIZE;
+    showClients();
 }
 
 async function addClient(event) {
@@ -416,9 +394,7 @@ async function addClient(event) {
         }
         
         document.getElementById('client-form').reset();
-        loadClients();
-        loadClientOptions();
-        loadStats();
+        syncStore();
         alert('Client added successfully!');
     } catch (error) {
         console.error('Error adding client:', error);
@@ -464,8 +440,7 @@ async function updateClient(event) {
         }
         
         closeEditClientModal();
-        loadClients();
-        loadClientOptions();
+        syncStore();
         alert('Client updated successfully!');
     } catch (error) {
         console.error('Error updating client:', error);
@@ -492,10 +467,7 @@ async function deleteClient(clientId) {
             throw new Error('Failed to delete');
         }
         
-        loadClients();
-        loadInvoices();
-        loadClientOptions();
-        loadStats();
+        syncStore();
         alert('Client deleted!');
     } catch (error) {
         console.error('Error:', error);
@@ -503,50 +475,34 @@ async function deleteClient(clientId) {
     }
 }
 
-async function loadClientOptions() {
-    try {
-        const response = await fetch(`${API_URL}/clients`, {
-            credentials: 'include'
-        });
-        
-        if (!response.ok) return;
-        
-        const clients = await response.json();
-        const select = document.getElementById('invoice-client');
-        
-        select.innerHTML = '<option value="">Select Client</option>' + 
-            clients.map(client => `<option value="${client.id}">${client.name}</option>`).join('');
-    } catch (error) {
-        console.error('Error loading client options:', error);
-    }
+function renderClientOptions(clients) {
+    const select = document.getElementById('invoice-client');
+    
+    select.innerHTML = '<option value="">Select Client</option>' + 
+        clients.map(client => `<option value="${client.id}">${client.name}</option>`).join('');
 }
 
 
 // ============ INVOICES (WITH FILTER & EDIT) ============
 
-async function loadInvoices() {
-    try {
-        const response = await fetch(`${API_URL}/invoices`, {
-            credentials: 'include'
-        });
-        
-        if (!response.ok) {
-            if (response.status === 401) {
-                showAuthPage('login');
-                return;
-            }
-            throw new Error('Failed to load invoices');
-        }
-        
-        const invoices = await response.json();
-        allInvoices = invoices; // Store for filtering
-        filterInvoices(currentFilter);
-    } catch (error) {
-        console.error('Error loading invoices:', error);
+// Renders the invoices matching the status filter, newest first
+function showInvoices() {
+    let invoices = [...store.invoices.values()];
+    if (currentFilter !== 'all') {
+        invoices = invoices.filter(invoice => invoice.status === currentFilter);
     }
+    
+    invoices.sort(newestFirst);
+    toggleLoadMore('invoices-load-more', invoices.length > invoicesShown);
+    renderInvoices(withClientNames(invoices.slice(0, invoicesShown)));
+}
+
+function loadMoreInvoices() {
+    invoicesShown += PAGE_SIZE;
+    showInvoices();
 }
 
-// NEW: Filter invoices by status
+// Filter invoices by status
 function filterInvoices(status) {
     currentFilter = status;
     
@@ -556,13 +512,8 @@ function filterInvoices(status) {
     });
     event?.target?.classList.add('active');
     
-    // Filter invoices
-    let filtered = allInvoices;
-    if (status !== 'all') {
-        filtered = allInvoices.filter(inv => inv.status === status);
-    }
-    
-    renderInvoices(filtered);
+    invoicesShown = PAGE_SIZE;
+    showInvoices();
 }
 
 function renderInvoices(invoices) {
@@ -631,8 +582,7 @@ async function addInvoice(event) {
         
         document.getElementById('invoice-form').reset();
         document.getElementById('invoice-description-custom').style.display = 'none';
-        loadInvoices();
-        loadStats();
+        syncStore();
         alert('Invoice created!');
     } catch (error) {
         console.error('Error:', error);
@@ -678,8 +628,7 @@ async function updateInvoice(event) {
         }
         
         closeEditInvoiceModal();
-        loadInvoices();
-        loadStats();
+        syncStore();
         alert('Invoice updated successfully!');
     } catch (error) {
         console.error('Error updating invoice:', error);
@@ -712,8 +661,7 @@ async function updateInvoiceStatus(invoiceId, status) {
             throw new Error('Failed to update');
         }
         
-        loadInvoices();
-        loadStats();
+        syncStore();
         alert(`Invoice marked as ${status}!`);
     } catch (error) {
         console.error('Error:', error);
@@ -740,8 +688,7 @@ async function deleteInvoice(invoiceId) {
             throw new Error('Failed to delete');
         }
         
-        loadInvoices();
-        loadStats();
+        syncStore();
         alert('Invoice deleted!');
     } catch (error) {
         console.error('Error:', error);
@@ -750,6 +697,117 @@ async function deleteInvoice(invoiceId) {
 }
 
 
+// ============ LOCAL STORE & SYNC ============
+
+// Every client and invoice the user has, kept current by /api/sync: each
+// call sends the version the store is at and gets back only the rows
+// changed or deleted since, or everything (reset) on the first call
+const store = {
+    version: 0,
+    clients: new Map(),
+    invoices: new Map(),
+    stats: null
+};
+
+// Syncs run one after another, so each sends the version the last one left
+let syncQueue = Promise.resolve();
+
+function syncStore() {
+    syncQueue = syncQueue.then(applySync);
+    return syncQueue;
+}
+
+function resetStore() {
+    store.version = 0;
+    store.clients.clear();
+    store.invoices.clear();
+    store.stats = null;
+}
+
+async function applySync() {
+    try {
+        const response = await fetch(`${API_URL}/sync?since=${store.version}`, {
+            credentials: 'include',
+            cache: 'no-store'
+        });
+        
+        if (!response.ok) {
+            if (response.status === 401) {
+                showAuthPage('login');
+                return;
+            }
+            throw new Error('Failed to sync');
+        }
+        
+        const delta = await response.json();
+        if (delta.reset) {
+            store.clients.clear();
+            store.invoices.clear();
+        }
+        
+        // Deletes first: a row moved away and back has a tombstone too
+        delta.deleted.clients.forEach(id => store.clients.delete(id));
+        delta.deleted.invoices.forEach(id => store.invoices.delete(id));
+        delta.clients.forEach(client => store.clients.set(client.id, client));
+        delta.invoices.forEach(invoice => store.invoices.set(invoice.id, invoice));
+        store.version = delta.version;
+        store.stats = delta.stats;
+        
+        renderDashboard();
+        showClients();
+        showInvoices();
+    } catch (error) {
+        console.error('Error syncing:', error);
+    }
+}
+
+// Newest first, ties broken by id, matching the server's list order
+function newestFirst(a, b) {
+    if (a.created_at !== b.created_at) {
+        return a.created_at < b.created_at ? 1 : -1;
+    }
+    return b.id - a.id;
+}
+
+// Invoice rows carry client_id only; the name comes from the store
+function withClientNames(invoices) {
+    return invoices.map(invoice => ({
+        ...invoice,
+        client_name: store.clients.get(invoice.client_id)?.name || ''
+    }));
+}
+
+
+// ============ CONDITIONAL GET CACHE ============
+
+// Last ETag and body per URL. While the user's data version is unchanged
+// the server answers 304 and the cached body is reused.
+const responseCache = new Map();
+
+async function cachedFetch(url) {
+    const cached = responseCache.get(url);
+    const response = await fetch(url, {
+        credentials: 'include',
+        cache: 'no-store',
+        headers: cached ? { 'If-None-Match': cached.etag } : {}
+    });
+    
+    if (response.status === 304 && cached) {
+        return { ok: true, status: 200, json: async () => cached.data };
+    }
+    if (!response.ok) {
+        return response;
+    }
+    
+    const data = await response.json();
+    const etag = response.headers.get('ETag');
+    if (etag) {
+        responseCache.set(url, { etag, data });
+    }
+    return { ok: true, status: response.status, json: async () => data };
+}
+
+
 // ============ UTILITIES ============
 
 function formatDate(dateString) {
@@ -759,6 +817,14 @@ function formatDate(dateString) {
     return date.toLocaleDateString('en-US', options);
 }
 
+// Show a "Load more" button only while rows are left to show
+function toggleLoadMore(buttonId, more) {
+    const button = document.getElementById(buttonId);
+    if (button) {
+        button.style.display = more ? 'block' : 'none';
+    }
+}
+
 function escapeHtml(text) {
     const map = {
         '&': '&amp;',
@@ -1,40 +1,182 @@
-from flask import Flask, request, jsonify, session
+from flask import (
+    Blueprint, Flask, Response, current_app, g, has_request_context, request, jsonify,
+    make_response, session, stream_with_context
+)
 from flask_cors import CORS
-from models import get_db, init_db, create_user, get_user_by_email, get_user_by_id, verify_password
-from datetime import timedelta
+from models import (
+    get_read_db, close_db, get_pool, get_data_version, run_write, statement_hooks,
+    create_user, get_user_by_email, get_user_by_id, verify_password, user_cache,
+    insert_client, update_owned_client, delete_owned_client,
+    insert_owned_invoice, update_owned_invoice, set_owned_invoice_status, delete_owned_invoice
+)
+from metrics import MetricsRegistry
+import models
+from datetime import datetime, timedelta
+import base64
+import csv
+import functools
+import hmac
+import io
+import json
+import math
 import os
+import random
+import threading
+import time
 
-app = Flask(__name__)
+# Every route lives on this blueprint; create_app() (bottom) registers it
+api = Blueprint('api', __name__)
 
-# Session configuration - use environment variable in production
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-production')
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
 
-# CORS configuration - support both development and production
-allowed_origins = [
-    'http://localhost:8001',
-    'http://localhost:8000',
-    'http://127.0.0.1:8001',
-    'http://127.0.0.1:8000'
-]
+# ============ METRICS ============
 
-# Add production frontend URL if it exists
-frontend_url = os.environ.get('FRONTEND_URL')
-if frontend_url:
-    allowed_origins.append(frontend_url)
+# Per-route latency, status and SQL metrics, scraped from /metrics. Off
+# unless METRICS_ENABLED=True; when off, requests skip the bookkeeping and
+# the pool opens untimed connections.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False') == 'True'
 
-CORS(app, 
-     supports_credentials=True, 
-     origins=allowed_origins,
-     allow_headers=['Content-Type'],
-     methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
+metrics = MetricsRegistry()
+metrics.counter('http_requests_total', 'Requests by method, route and status code.')
+metrics.histogram('http_request_duration_seconds', 'Request latency by method and route.')
+metrics.histogram(
+    'db_statements_per_request', 'SQL statements run per request.',
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+)
+metrics.histogram('db_statement_seconds_per_request', 'Time spent executing SQL per request.')
+metrics.histogram('db_connection_acquire_seconds', 'Time waiting for a pooled connection.')
+metrics.gauge('db_pool_connections_open', 'Connections opened by the pool (writer and readers).',
+              lambda: get_pool().opened + get_pool().readers.opened)
+metrics.gauge('user_cache_size', 'Entries in the user lookup cache.', lambda: user_cache.stats()['size'])
+metrics.gauge('user_cache_hit_ratio', 'User lookup cache hit ratio.', lambda: user_cache.stats()['hit_ratio'])
 
-init_db()
+
+def record_statement(conn, sql, parameters, seconds, many):
+    """statement_hooks entry: add one statement to the request's SQL totals"""
+    if has_request_context() and 'metrics_start' in g:
+        g.metrics_statements += 1
+        g.metrics_sql_seconds += seconds
+
+
+def start_request_metrics():
+    """Start the request timer and SQL counters"""
+    if METRICS_ENABLED:
+        g.metrics_start = time.perf_counter()
+        g.metrics_statements = 0
+        g.metrics_sql_seconds = 0.0
+
+
+def capture_response_status(response):
+    """Remember the status code for finish_request_metrics()"""
+    if 'metrics_start' in g:
+        g.metrics_status = response.status_code
+    return response
+
+
+def finish_request_metrics(exception=None):
+    """Record the request when its context ends, after any streamed body"""
+    if 'metrics_start' not in g:
+        return
+    
+    elapsed = time.perf_counter() - g.metrics_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (('method', request.method), ('route', route))
+    
+    # Unhandled errors skip after_request, so no status means a 500
+    status = g.get('metrics_status', 500)
+    metrics.inc('http_requests_total', labels + (('status', status),))
+    metrics.observe('http_request_duration_seconds', elapsed, labels)
+    metrics.observe('db_statements_per_request', g.metrics_statements, labels)
+    metrics.observe('db_statement_seconds_per_request', g.metrics_sql_seconds, labels)
+    if 'db_acquire_seconds' in g:
+        metrics.observe('db_connection_acquire_seconds', g.db_acquire_seconds)
+
+
+# Registered at import, before any pool exists, so every connection is timed
+if METRICS_ENABLED:
+    statement_hooks.append(record_statement)
+
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of the metrics above"""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# ============ PROFILING ============
+
+# On-demand cProfile of single requests. A request is profiled when it is
+# sampled (PROFILE_SAMPLE_RATE, 0-1) or sends X-Profile with PROFILE_SECRET.
+# Each profile is written to PROFILE_DIR as <id>.prof plus a top-N <id>.txt.
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET')
+PROFILE_TOP_N = int(os.environ.get('PROFILE_TOP_N', 30))
+
+
+def should_profile():
+    """True if this request asked for (or was sampled for) profiling"""
+    token = request.headers.get('X-Profile')
+    if token and PROFILE_SECRET and hmac.compare_digest(token, PROFILE_SECRET):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+# cProfile hooks the whole interpreter (sys.monitoring on 3.12+), so one
+# request is profiled at a time; requests overlapping it run unprofiled
+profile_lock = threading.Lock()
+
+
+def start_profiling():
+    """Start a profiler for sampled requests only, unless one is already running"""
+    if not should_profile() or not profile_lock.acquire(blocking=False):
+        return
+    import cProfile  # only paid for by profiled requests
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except Exception:
+        # e.g. "Another profiling tool is already active"; serve the request anyway
+        profile_lock.release()
+        return
+    g.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unmatched'}-{os.urandom(4).hex()}"
+    g.profiler = profiler
+
+
+def add_profile_header(response):
+    """Tell the caller which files hold its profile"""
+    if 'profiler' in g:
+        response.headers['X-Profile-Id'] = g.profile_id
+    return response
+
+
+def finish_profiling(exception=None):
+    """Stop the profiler after any streamed body and write its reports"""
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    try:
+        profiler.disable()
+    finally:
+        profile_lock.release()
+    import pstats
+    
+    path = os.path.join(PROFILE_DIR, g.profile_id)
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(path + '.prof')
+        with open(path + '.txt', 'w') as f:
+            f.write(f'{request.method} {request.full_path}\n')
+            stats = pstats.Stats(profiler, stream=f)
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+    except OSError as e:
+        current_app.logger.warning('Could not write profile %s: %s', path, e)
 
 
 # ============ AUTHENTICATION ROUTES ============
 
-@app.route('/api/register', methods=['POST'])
+@api.route('/api/register', methods=['POST'])
 def register():
     """Create new user account"""
     data = request.get_json()
@@ -65,7 +207,7 @@ def register():
     }), 201
 
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     """Authenticate user and create session"""
     data = request.get_json()
@@ -93,14 +235,14 @@ def login():
     }), 200
 
 
-@app.route('/api/logout', methods=['POST'])
+@api.route('/api/logout', methods=['POST'])
 def logout():
     """Clear user session"""
     session.pop('user_id', None)
     return jsonify({'message': 'Logged out successfully'}), 200
 
 
-@app.route('/api/me', methods=['GET'])
+@api.route('/api/me', methods=['GET'])
 def get_current_user():
     """Get current logged-in user information"""
     user_id = session.get('user_id')
@@ -122,6 +264,14 @@ def get_current_user():
     }), 200
 
 
+@api.route('/api/cache/users', methods=['GET'])
+def get_user_cache_stats():
+    """Hit/miss counters for the in-process user cache (for sizing it)"""
+    if not get_current_user_id():
+        return jsonify({'error': 'Not authenticated'}), 401
+    return jsonify(user_cache.stats()), 200
+
+
 # ============ HELPER FUNCTION ============
 
 def get_current_user_id():
@@ -129,26 +279,398 @@ def get_current_user_id():
     return session.get('user_id')
 
 
+# ============ PAGINATION HELPERS ============
+
+# Page size used when only ?cursor= is given, and the largest ?limit= allowed
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# SQLite's INTEGER range; a larger Python int overflows the driver
+MAX_SQL_INT = 2 ** 63 - 1
+
+
+def encode_cursor(row, sort='created_at'):
+    """Build an opaque cursor from a row's (sort value, id) key"""
+    value = row[sort]
+    if value is None:
+        value = ''  # NULL due dates sort as '' (see INVOICE_SORTS)
+    raw = json.dumps([value, row['id']])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return the (sort value, id) key held in a cursor, or None if malformed"""
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+        return None
+    if not isinstance(row_id, int) or isinstance(row_id, bool):
+        return None
+    if not -MAX_SQL_INT <= row_id <= MAX_SQL_INT:
+        return None
+    if isinstance(value, int) and not -MAX_SQL_INT <= value <= MAX_SQL_INT:
+        return None
+    return value, row_id
+
+
+def get_page_args():
+    """
+    Read the optional ?limit= and ?cursor= keyset pagination parameters.
+    Returns (limit, after, error); limit is None when the caller did not
+    ask for pagination, after is the (sort value, id) key to resume from.
+    """
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    
+    if limit is None and cursor is None:
+        return None, None, None
+    
+    if limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return None, None, 'limit must be an integer'
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            return None, None, f'limit must be between 1 and {MAX_PAGE_SIZE}'
+    
+    after = None
+    if cursor:
+        after = decode_cursor(cursor)
+        if after is None:
+            return None, None, 'Invalid cursor'
+    
+    return limit, after, None
+
+
+def page_response(rows, limit, sort='created_at', fields=None):
+    """
+    Build a page body from up to limit + 1 rows fetched in sort order.
+    If fields is given, items keep only those columns; the cursor may
+    still read keyset columns the caller did not ask for.
+    """
+    if fields is None:
+        items = [dict(row) for row in rows[:limit]]
+    else:
+        items = [{name: row[name] for name in fields} for row in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1], sort) if len(rows) > limit else None
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+# ============ STREAMING HELPERS ============
+
+# Rows pulled from the cursor per fetchmany() call while streaming
+STREAM_BATCH_SIZE = 500
+
+
+def wants_ndjson():
+    """True if the client asked for newline-delimited JSON"""
+    if request.args.get('format') == 'ndjson':
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    return best == 'application/x-ndjson'
+
+
+def json_array_chunks(cursor, dumps):
+    """Yield a cursor's rows as the pieces of a JSON array, one batch at a time"""
+    yield '['
+    first = True
+    while True:
+        rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+        if not rows:
+            break
+        chunk = ','.join(dumps(dict(row)) for row in rows)
+        yield chunk if first else ',' + chunk
+        first = False
+    yield ']'
+
+
+def stream_rows(cursor, ndjson=None):
+    """
+    Stream a cursor's rows as a JSON array, or NDJSON if requested,
+    without materializing the full result list. stream_with_context keeps
+    the request's pooled connection checked out until the last chunk.
+    """
+    if ndjson is None:
+        ndjson = wants_ndjson()
+    dumps = current_app.json.dumps
+    
+    def generate():
+        if not ndjson:
+            yield from json_array_chunks(cursor, dumps)
+            return
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield ''.join(dumps(dict(row)) + '\n' for row in rows)
+    
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def stream_object(fields, arrays, done=None):
+    """
+    Stream a JSON object: the fields dict's members, then one array per
+    (name, cursor) in arrays, read batch by batch. done() runs once the
+    body is finished or abandoned, e.g. to end the read transaction.
+    """
+    dumps = current_app.json.dumps
+    
+    def generate():
+        try:
+            yield dumps(fields)[:-1]  # without the closing brace
+            for name, cursor in arrays:
+                yield f',{dumps(name)}:'
+                yield from json_array_chunks(cursor, dumps)
+            yield '}'
+        finally:
+            if done is not None:
+                done()
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def stream_csv(cursor):
+    """Stream a cursor's rows as CSV with a header row, one batch at a time"""
+    columns = [column[0] for column in cursor.description]
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Header-only export for an empty result
+        if buffer.tell():
+            yield buffer.getvalue()
+    
+    return Response(stream_with_context(generate()), mimetype='text/csv')
+
+
+# ============ CONDITIONAL GET ============
+
+def conditional_get(view):
+    """
+    Tag a GET route's response with the user's data version as its ETag,
+    and answer 304 Not Modified when If-None-Match still matches - without
+    reading anything beyond the version itself.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = get_current_user_id()
+        if not user_id:
+            return view(*args, **kwargs)
+        
+        version = get_data_version(get_read_db(user_id), user_id)
+        if version is None:
+            return view(*args, **kwargs)
+        
+        # One tag per user, version and representation
+        etag = f'{user_id}-{version}'
+        if wants_ndjson():
+            etag += '-ndjson'
+        
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.update(['Cookie', 'Accept'])
+        return response
+    
+    return wrapper
+
+
+# ============ FILTER & SORT HELPERS ============
+
+# Whitelisted ?sort= keys for invoices and the SQL expression each orders by
+INVOICE_SORTS = {
+    'created_at': 'invoices.created_at',
+    'due_date': "COALESCE(invoices.due_date, '')",
+    'amount': 'invoices.amount',
+}
+
+
+def get_sort_args(allowed):
+    """
+    Read ?sort= and ?order= (asc/desc, default desc).
+    Returns (sort, descending, error).
+    """
+    sort = request.args.get('sort', 'created_at')
+    order = request.args.get('order', 'desc')
+    
+    if sort not in allowed:
+        return None, None, f"sort must be one of: {', '.join(allowed)}"
+    if order not in ('asc', 'desc'):
+        return None, None, 'order must be asc or desc'
+    
+    return sort, order == 'desc', None
+
+
+def get_invoice_filters():
+    """
+    Translate the invoice list query parameters into SQL conditions.
+    Returns (conditions, params, error).
+    """
+    conditions = []
+    params = []
+    args = request.args
+    
+    status = args.get('status')
+    if status:
+        if status not in ['paid', 'unpaid']:
+            return None, None, 'Status must be paid or unpaid'
+        conditions.append('invoices.status = ?')
+        params.append(status)
+    
+    client_id = args.get('client_id')
+    if client_id:
+        try:
+            params.append(parse_id(client_id, 'client_id'))
+        except ValueError as e:
+            return None, None, str(e)
+        conditions.append('invoices.client_id = ?')
+    
+    for arg, condition in (('due_from', 'invoices.due_date >= ?'),
+                           ('due_to', 'invoices.due_date <= ?')):
+        value = args.get(arg)
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return None, None, f'{arg} must be a YYYY-MM-DD date'
+            conditions.append(condition)
+            params.append(value)
+    
+    for arg, condition in (('min_amount', 'invoices.amount >= ?'),
+                           ('max_amount', 'invoices.amount <= ?')):
+        value = args.get(arg)
+        if value:
+            try:
+                params.append(float(value))
+            except ValueError:
+                return None, None, f'{arg} must be a number'
+            conditions.append(condition)
+    
+    return conditions, params, None
+
+
+def escape_like(text):
+    """Escape LIKE wildcards so user input matches literally"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+# ============ FIELD PROJECTION ============
+
+# Whitelisted ?fields= names and the SQL column each one selects
+CLIENT_FIELDS = {
+    'id': 'id',
+    'user_id': 'user_id',
+    'name': 'name',
+    'email': 'email',
+    'phone': 'phone',
+    'created_at': 'created_at',
+}
+
+INVOICE_FIELDS = {
+    'id': 'invoices.id',
+    'client_id': 'invoices.client_id',
+    'amount': 'invoices.amount',
+    'description': 'invoices.description',
+    'status': 'invoices.status',
+    'due_date': 'invoices.due_date',
+    'created_at': 'invoices.created_at',
+    'client_name': 'clients.name',
+}
+
+
+def get_fields_arg(allowed):
+    """
+    Read ?fields= as a comma-separated list of column names.
+    Returns (fields, error); fields is every allowed name when not given.
+    """
+    value = request.args.get('fields')
+    if value is None:
+        return list(allowed), None
+    
+    fields = []
+    for name in value.split(','):
+        name = name.strip()
+        if name not in allowed:
+            return None, f"fields must be drawn from: {', '.join(allowed)}"
+        if name not in fields:
+            fields.append(name)
+    
+    return fields, None
+
+
+def select_list(allowed, fields, keys=()):
+    """SQL column list for fields, plus any keyset columns paging needs"""
+    names = fields + [key for key in keys if key not in fields]
+    return ', '.join(f'{allowed[name]} AS {name}' for name in names)
+
+
 # ============ CLIENT ROUTES ============
 
-@app.route('/api/clients', methods=['GET'])
+@api.route('/api/clients', methods=['GET'])
+@conditional_get
 def get_clients():
     """Get all clients for current user"""
     user_id = get_current_user_id()
     if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = get_db()
-    clients = conn.execute(
-        'SELECT * FROM clients WHERE user_id = ? ORDER BY created_at DESC',
-        (user_id,)
-    ).fetchall()
-    conn.close()
+    limit, after, error = get_page_args()
+    if error:
+        return jsonify({'error': error}), 400
     
-    return jsonify([dict(client) for client in clients])
+    fields, error = get_fields_arg(CLIENT_FIELDS)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    # Pages also select the keyset columns so the cursor can be built
+    keys = ('created_at', 'id') if limit is not None else ()
+    query = f'SELECT {select_list(CLIENT_FIELDS, fields, keys)} FROM clients WHERE user_id = ?'
+    params = [user_id]
+    
+    # Optional ?search= on name or email (case-insensitive substring)
+    search = request.args.get('search', '').strip()
+    if search:
+        pattern = f'%{escape_like(search)}%'
+        query += " AND (name LIKE ? ESCAPE '\\' OR email LIKE ? ESCAPE '\\')"
+        params.extend([pattern, pattern])
+    
+    # Keyset pagination: resume strictly below the last (created_at, id) seen
+    if after:
+        query += ' AND (created_at, id) < (?, ?)'
+        params.extend(after)
+    query += ' ORDER BY created_at DESC, id DESC'
+    
+    conn = get_read_db(user_id)
+    
+    if limit is None:
+        return stream_rows(conn.execute(query, params))
+    
+    # Fetch one extra row to know whether another page exists
+    clients = conn.execute(query + ' LIMIT ?', params + [limit + 1]).fetchall()
+    return jsonify(page_response(clients, limit, fields=fields))
 
 
-@app.route('/api/clients', methods=['POST'])
+@api.route('/api/clients', methods=['POST'])
 def create_client():
     """Create new client for current user"""
     user_id = get_current_user_id()
@@ -163,19 +685,12 @@ def create_client():
     if not name or not email:
         return jsonify({'error': 'Name and email are required'}), 400
     
-    conn = get_db()
-    cursor = conn.execute(
-        'INSERT INTO clients (user_id, name, email, phone) VALUES (?, ?, ?, ?)',
-        (user_id, name, email, phone)
-    )
-    conn.commit()
-    client_id = cursor.lastrowid
-    conn.close()
+    client_id = insert_client(user_id, name, email, phone)
     
     return jsonify({'id': client_id, 'message': 'Client created successfully'}), 201
 
 
-@app.route('/api/clients/<int:client_id>', methods=['PUT'])
+@api.route('/api/clients/<int:client_id>', methods=['PUT'])
 def update_client(client_id):
     """Update client information"""
     user_id = get_current_user_id()
@@ -190,85 +705,84 @@ def update_client(client_id):
     if not name or not email:
         return jsonify({'error': 'Name and email are required'}), 400
     
-    conn = get_db()
-    
-    # Verify client belongs to user
-    client = conn.execute(
-        'SELECT * FROM clients WHERE id = ? AND user_id = ?',
-        (client_id, user_id)
-    ).fetchone()
-    
-    if not client:
-        conn.close()
+    # Ownership is checked by the UPDATE itself
+    if not update_owned_client(user_id, client_id, name, email, phone):
         return jsonify({'error': 'Client not found or unauthorized'}), 404
     
-    # Update client
-    conn.execute(
-        'UPDATE clients SET name = ?, email = ?, phone = ? WHERE id = ?',
-        (name, email, phone, client_id)
-    )
-    conn.commit()
-    conn.close()
-    
     return jsonify({'message': 'Client updated successfully'})
 
 
-@app.route('/api/clients/<int:client_id>', methods=['DELETE'])
+@api.route('/api/clients/<int:client_id>', methods=['DELETE'])
 def delete_client(client_id):
     """Delete client (authorization check)"""
     user_id = get_current_user_id()
     if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = get_db()
-    
-    # Verify client belongs to user
-    client = conn.execute(
-        'SELECT * FROM clients WHERE id = ? AND user_id = ?',
-        (client_id, user_id)
-    ).fetchone()
-    
-    if not client:
-        conn.close()
+    # Deletes the client and its invoices, if the user owns it
+    if not delete_owned_client(user_id, client_id):
         return jsonify({'error': 'Client not found or unauthorized'}), 404
     
-    # Delete client and associated invoices
-    conn.execute('DELETE FROM clients WHERE id = ?', (client_id,))
-    conn.execute('DELETE FROM invoices WHERE client_id = ?', (client_id,))
-    conn.commit()
-    conn.close()
-    
     return jsonify({'message': 'Client deleted successfully'})
 
 
 # ============ INVOICE ROUTES ============
 
-@app.route('/api/invoices', methods=['GET'])
+@api.route('/api/invoices', methods=['GET'])
+@conditional_get
 def get_invoices():
     """Get all invoices for current user's clients"""
     user_id = get_current_user_id()
     if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = get_db()
-    
-    # Join to ensure only user's invoices are returned
-    invoices = conn.execute('''
-        SELECT 
-            invoices.*,
-            clients.name as client_name
-        FROM invoices
-        JOIN clients ON invoices.client_id = clients.id
-        WHERE clients.user_id = ?
-        ORDER BY invoices.created_at DESC
-    ''', (user_id,)).fetchall()
-    
-    conn.close()
-    
-    return jsonify([dict(invoice) for invoice in invoices])
+    limit, after, error = get_page_args()
+    if error:
+        return jsonify({'error': error}), 400
+    
+    sort, descending, error = get_sort_args(INVOICE_SORTS)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    conditions, filter_params, error = get_invoice_filters()
+    if error:
+        return jsonify({'error': error}), 400
+    
+    fields, error = get_fields_arg(INVOICE_FIELDS)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    # invoices.user_id scopes the query to the user; clients is joined only
+    # when client_name is asked for. Pages also select the keyset columns
+    # so the cursor can be built
+    keys = (sort, 'id') if limit is not None else ()
+    query = f'SELECT {select_list(INVOICE_FIELDS, fields, keys)} FROM invoices'
+    if 'client_name' in fields:
+        query += ' JOIN clients ON invoices.client_id = clients.id'
+    query += ' WHERE invoices.user_id = ?'
+    params = [user_id] + filter_params
+    for condition in conditions:
+        query += ' AND ' + condition
+    
+    # Keyset pagination: resume past the last (sort value, id) seen
+    sort_expr = INVOICE_SORTS[sort]
+    direction = 'DESC' if descending else 'ASC'
+    if after:
+        query += f" AND ({sort_expr}, invoices.id) {'<' if descending else '>'} (?, ?)"
+        params.extend(after)
+    query += f' ORDER BY {sort_expr} {direction}, invoices.id {direction}'
+    
+    conn = get_read_db(user_id)
+    
+    if limit is None:
+        return stream_rows(conn.execute(query, params))
+    
+    # Fetch one extra row to know whether another page exists
+    invoices = conn.execute(query + ' LIMIT ?', params + [limit + 1]).fetchall()
+    return jsonify(page_response(invoices, limit, sort, fields))
 
 
-@app.route('/api/invoices', methods=['POST'])
+@api.route('/api/invoices', methods=['POST'])
 def create_invoice():
     """Create new invoice (with authorization check)"""
     user_id = get_current_user_id()
@@ -284,30 +798,16 @@ def create_invoice():
     if not client_id or not amount:
         return jsonify({'error': 'Client ID and amount are required'}), 400
     
-    conn = get_db()
+    # INSERT ... SELECT only inserts if the client belongs to the user
+    invoice_id = insert_owned_invoice(user_id, client_id, amount, description, due_date)
     
-    # Verify client belongs to user
-    client = conn.execute(
-        'SELECT * FROM clients WHERE id = ? AND user_id = ?',
-        (client_id, user_id)
-    ).fetchone()
-    
-    if not client:
-        conn.close()
+    if invoice_id is None:
         return jsonify({'error': 'Client not found or unauthorized'}), 404
     
-    cursor = conn.execute(
-        'INSERT INTO invoices (client_id, amount, description, due_date) VALUES (?, ?, ?, ?)',
-        (client_id, amount, description, due_date)
-    )
-    conn.commit()
-    invoice_id = cursor.lastrowid
-    conn.close()
-    
     return jsonify({'id': invoice_id, 'message': 'Invoice created successfully'}), 201
 
 
-@app.route('/api/invoices/<int:invoice_id>', methods=['PUT'])
+@api.route('/api/invoices/<int:invoice_id>', methods=['PUT'])
 def update_invoice(invoice_id):
     """Update invoice information"""
     user_id = get_current_user_id()
@@ -322,31 +822,14 @@ def update_invoice(invoice_id):
     if not amount:
         return jsonify({'error': 'Amount is required'}), 400
     
-    conn = get_db()
-    
-    # Verify invoice belongs to user's client
-    invoice = conn.execute('''
-        SELECT invoices.* FROM invoices
-        JOIN clients ON invoices.client_id = clients.id
-        WHERE invoices.id = ? AND clients.user_id = ?
-    ''', (invoice_id, user_id)).fetchone()
-    
-    if not invoice:
-        conn.close()
+    # Ownership is checked by the UPDATE itself
+    if not update_owned_invoice(user_id, invoice_id, amount, description, due_date):
         return jsonify({'error': 'Invoice not found or unauthorized'}), 404
     
-    # Update invoice
-    conn.execute(
-        'UPDATE invoices SET amount = ?, description = ?, due_date = ? WHERE id = ?',
-        (amount, description, due_date, invoice_id)
-    )
-    conn.commit()
-    conn.close()
-    
     return jsonify({'message': 'Invoice updated successfully'})
 
 
-@app.route('/api/invoices/<int:invoice_id>/status', methods=['PUT'])
+@api.route('/api/invoices/<int:invoice_id>/status', methods=['PUT'])
 def update_invoice_status(invoice_id):
     """Update invoice status (with authorization check)"""
     user_id = get_current_user_id()
@@ -359,98 +842,740 @@ def update_invoice_status(invoice_id):
     if status not in ['paid', 'unpaid']:
         return jsonify({'error': 'Status must be paid or unpaid'}), 400
     
-    conn = get_db()
-    
-    # Verify invoice belongs to user's client
-    invoice = conn.execute('''
-        SELECT invoices.* FROM invoices
-        JOIN clients ON invoices.client_id = clients.id
-        WHERE invoices.id = ? AND clients.user_id = ?
-    ''', (invoice_id, user_id)).fetchone()
-    
-    if not invoice:
-        conn.close()
+    # Ownership is checked by the UPDATE itself
+    if not set_owned_invoice_status(user_id, invoice_id, status):
         return jsonify({'error': 'Invoice not found or unauthorized'}), 404
     
-    conn.execute('UPDATE invoices SET status = ? WHERE id = ?', (status, invoice_id))
-    conn.commit()
-    conn.close()
-    
     return jsonify({'message': 'Invoice status updated successfully'})
 
 
-@app.route('/api/invoices/<int:invoice_id>', methods=['DELETE'])
+@api.route('/api/invoices/<int:invoice_id>', methods=['DELETE'])
 def delete_invoice(invoice_id):
     """Delete invoice (with authorization check)"""
     user_id = get_current_user_id()
     if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = get_db()
+    # Ownership is checked by the DELETE itself
+    if not delete_owned_invoice(user_id, invoice_id):
+        return jsonify({'error': 'Invoice not found or unauthorized'}), 404
+    
+    return jsonify({'message': 'Invoice deleted successfully'})
+
+
+# ============ BATCH INVOICE ROUTES ============
+
+# Largest number of items accepted by one batch request
+MAX_BATCH_SIZE = 1000
+
+
+def get_batch_items(key):
+    """Read the list under key from the JSON body; returns (items, error)"""
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return None, 'Request body must be a JSON object'
+    items = data.get(key)
+    if not isinstance(items, list) or not items:
+        return None, f'{key} must be a non-empty list'
+    if len(items) > MAX_BATCH_SIZE:
+        return None, f'At most {MAX_BATCH_SIZE} {key} per batch'
+    return items, None
+
+
+def parse_id(value, name):
+    """Coerce a positive integer id that fits SQLite's INTEGER, or raise ValueError"""
+    if isinstance(value, bool):
+        raise ValueError(f'{name} must be an integer')
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be an integer')
+    if value < 1:
+        raise ValueError(f'{name} must be an integer')
+    if value > MAX_SQL_INT:
+        raise ValueError(f'{name} is out of range')
+    return value
+
+
+def parse_amount(value):
+    """Coerce a required amount to a finite float or raise ValueError"""
+    if not value:
+        raise ValueError('Amount is required')
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('Amount must be a number')
+    # float() also takes 'nan' and 'inf', which would poison user_stats
+    if not math.isfinite(amount):
+        raise ValueError('Amount must be a number')
+    return amount
+
+
+def parse_details(item):
+    """
+    Validate an item's optional description and YYYY-MM-DD due date.
+    Returns (description, due_date) or raises ValueError.
+    """
+    description = item.get('description') or ''
+    if not isinstance(description, str):
+        raise ValueError('Description must be a string')
+    due_date = item.get('due_date') or ''
+    if not isinstance(due_date, str):
+        raise ValueError('due_date must be a YYYY-MM-DD date')
+    return description, parse_date(due_date.strip(), 'due_date') or ''
+
+
+def owned_client_ids(conn, user_id, client_ids):
+    """Return which of client_ids belong to the user, in one query"""
+    if not client_ids:
+        return set()
+    placeholders = ','.join('?' * len(client_ids))
+    rows = conn.execute(
+        f'SELECT id FROM clients WHERE user_id = ? AND id IN ({placeholders})',
+        [user_id, *client_ids]
+    )
+    return {row['id'] for row in rows}
+
+
+def owned_invoice_ids(conn, user_id, invoice_ids):
+    """Return which of invoice_ids belong to the user, in one query"""
+    if not invoice_ids:
+        return set()
+    placeholders = ','.join('?' * len(invoice_ids))
+    rows = conn.execute(
+        f'SELECT id FROM invoices WHERE user_id = ? AND id IN ({placeholders})',
+        [user_id, *invoice_ids]
+    )
+    return {row['id'] for row in rows}
+
+
+def batch_response(results):
+    """Summarize per-item results; the request itself always succeeds"""
+    failed = sum(1 for result in results if result['status'] >= 400)
+    return jsonify({
+        'results': results,
+        'succeeded': len(results) - failed,
+        'failed': failed
+    })
+
+
+def write_invoice_batch(user_id, items, parse_item, sql):
+    """
+    Shared flow for the update, status and delete batch routes.
+    parse_item(item) returns (invoice_id, params) or raises ValueError.
+    Ownership of every referenced invoice is checked in one query, then the
+    valid rows are written with a single executemany - all inside one
+    transaction, so the batch costs one commit.
+    """
+    results = []
+    pending = []
+    for index, item in enumerate(items):
+        try:
+            invoice_id, params = parse_item(item)
+        except ValueError as e:
+            results.append({'index': index, 'status': 400, 'error': str(e)})
+            continue
+        results.append(None)  # filled in by write(), which may be retried
+        pending.append((index, invoice_id, params))
+    
+    def write(conn):
+        owned = owned_invoice_ids(conn, user_id, {invoice_id for _, invoice_id, _ in pending})
+        rows = []
+        for index, invoice_id, params in pending:
+            if invoice_id in owned:
+                results[index] = {'index': index, 'id': invoice_id, 'status': 200}
+                rows.append(params)
+            else:
+                results[index] = {
+                    'index': index,
+                    'id': invoice_id,
+                    'status': 404,
+                    'error': 'Invoice not found or unauthorized'
+                }
+        if rows:
+            conn.executemany(sql, rows)
+    
+    run_write(user_id, write, immediate=True)
+    return batch_response(results)
+
+
+@api.route('/api/invoices/batch', methods=['POST'])
+def create_invoices_batch():
+    """Create many invoices in one transaction"""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    items, error = get_batch_items('invoices')
+    if error:
+        return jsonify({'error': error}), 400
+    
+    results = []
+    pending = []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict) or not item.get('client_id') or not item.get('amount'):
+                raise ValueError('Client ID and amount are required')
+            client_id = parse_id(item['client_id'], 'client_id')
+            amount = parse_amount(item['amount'])
+            details = parse_details(item)
+        except ValueError as e:
+            results.append({'index': index, 'status': 400, 'error': str(e)})
+            continue
+        results.append(None)
+        pending.append((index, (client_id, amount, *details)))
+    
+    def write(conn):
+        owned = owned_client_ids(conn, user_id, {values[0] for _, values in pending})
+        created = []
+        for index, values in pending:
+            if values[0] in owned:
+                created.append((index, values))
+            else:
+                results[index] = {'index': index, 'status': 404, 'error': 'Client not found or unauthorized'}
+        
+        if created:
+            conn.executemany(
+                'INSERT INTO invoices (client_id, user_id, amount, description, due_date) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(values[0], user_id, *values[1:]) for _, values in created]
+            )
+            # AUTOINCREMENT ids are allocated consecutively while we hold the
+            # write lock, so the batch's ids end at the table's sequence value
+            last_id = conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'invoices'"
+            ).fetchone()['seq']
+            first_id = last_id - len(created) + 1
+            for offset, (index, _) in enumerate(created):
+                results[index] = {'index': index, 'id': first_id + offset, 'status': 201}
+    
+    run_write(user_id, write, immediate=True)
+    return batch_response(results)
+
+
+@api.route('/api/invoices/batch', methods=['PUT'])
+def update_invoices_batch():
+    """Update amount, description and due date of many invoices at once"""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    items, error = get_batch_items('invoices')
+    if error:
+        return jsonify({'error': error}), 400
     
-    # Verify invoice belongs to user's client
-    invoice = conn.execute('''
-        SELECT invoices.* FROM invoices
+    def parse_item(item):
+        if not isinstance(item, dict):
+            raise ValueError('Each invoice must be an object')
+        invoice_id = parse_id(item.get('id'), 'id')
+        amount = parse_amount(item.get('amount'))
+        return invoice_id, (amount, *parse_details(item), invoice_id)
+    
+    return write_invoice_batch(
+        user_id, items, parse_item,
+        'UPDATE invoices SET amount = ?, description = ?, due_date = ? WHERE id = ?'
+    )
+
+
+@api.route('/api/invoices/status/batch', methods=['PUT'])
+def update_invoice_status_batch():
+    """Set the status of many invoices at once (e.g. month-end mark paid)"""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    items, error = get_batch_items('invoices')
+    if error:
+        return jsonify({'error': error}), 400
+    
+    def parse_item(item):
+        if not isinstance(item, dict):
+            raise ValueError('Each invoice must be an object')
+        invoice_id = parse_id(item.get('id'), 'id')
+        status = item.get('status')
+        if status not in ['paid', 'unpaid']:
+            raise ValueError('Status must be paid or unpaid')
+        return invoice_id, (status, invoice_id)
+    
+    return write_invoice_batch(
+        user_id, items, parse_item,
+        'UPDATE invoices SET status = ? WHERE id = ?'
+    )
+
+
+@api.route('/api/invoices/batch', methods=['DELETE'])
+def delete_invoices_batch():
+    """Delete many invoices at once"""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    items, error = get_batch_items('ids')
+    if error:
+        return jsonify({'error': error}), 400
+    
+    def parse_item(item):
+        invoice_id = parse_id(item, 'id')
+        return invoice_id, (invoice_id,)
+    
+    return write_invoice_batch(
+        user_id, items, parse_item,
+        'DELETE FROM invoices WHERE id = ?'
+    )
+
+
+# ============ IMPORT / EXPORT ROUTES ============
+
+# Valid rows written per import transaction, and the most row errors reported
+IMPORT_CHUNK_SIZE = 1000
+MAX_IMPORT_ERRORS = 1000
+
+EXPORT_QUERIES = {
+    'clients': '''
+        SELECT id, name, email, phone, created_at
+        FROM clients
+        WHERE user_id = ?
+        ORDER BY created_at DESC, id DESC
+    ''',
+    'invoices': '''
+        SELECT
+            invoices.id, invoices.client_id, clients.name AS client_name,
+            invoices.amount, invoices.description, invoices.status,
+            invoices.due_date, invoices.created_at
+        FROM invoices
         JOIN clients ON invoices.client_id = clients.id
-        WHERE invoices.id = ? AND clients.user_id = ?
-    ''', (invoice_id, user_id)).fetchone()
+        WHERE invoices.user_id = ?
+        ORDER BY invoices.created_at DESC, invoices.id DESC
+    ''',
+}
+
+
+@api.route('/api/export/<kind>', methods=['GET'])
+def export_data(kind):
+    """Stream all of the user's clients or invoices as CSV or NDJSON"""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    if not invoice:
-        conn.close()
-        return jsonify({'error': 'Invoice not found or unauthorized'}), 404
+    if kind not in EXPORT_QUERIES:
+        return jsonify({'error': 'Export must be clients or invoices'}), 404
     
-    conn.execute('DELETE FROM invoices WHERE id = ?', (invoice_id,))
-    conn.commit()
-    conn.close()
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
     
-    return jsonify({'message': 'Invoice deleted successfully'})
+    cursor = get_read_db(user_id).execute(EXPORT_QUERIES[kind], (user_id,))
+    if export_format == 'csv':
+        response = stream_csv(cursor)
+    else:
+        response = stream_rows(cursor, ndjson=True)
+    
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{export_format}'
+    return response
 
 
-# ============ STATS ROUTE ============
+def parse_date(value, name, with_time=False):
+    """Validate an optional YYYY-MM-DD (or YYYY-MM-DD HH:MM:SS) value"""
+    if not value:
+        return None
+    formats = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d'] if with_time else ['%Y-%m-%d']
+    for fmt in formats:
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return parsed.strftime(formats[0])
+    raise ValueError(f'{name} must be a YYYY-MM-DD date')
 
-@app.route('/api/stats', methods=['GET'])
-def get_stats():
-    """Get statistics for current user"""
+
+def get_upload_reader():
+    """
+    Return a csv.DictReader over the uploaded CSV - a multipart "file" field
+    or a raw text/csv body. Rows are decoded lazily from the request
+    stream (uploads are spooled to disk by Werkzeug), so memory stays flat.
+    """
+    upload = request.files.get('file')
+    binary = upload.stream if upload else request.stream
+    return csv.DictReader(io.TextIOWrapper(binary, encoding='utf-8-sig', newline=''))
+
+
+def run_import(reader, required, parse_row, write_chunk):
+    """
+    Validate rows from reader one at a time and hand each chunk of
+    IMPORT_CHUNK_SIZE valid rows to write_chunk, which writes it in one
+    transaction and returns a list of (line, error) for rows it rejected.
+    Returns (report, error); only one chunk is held in memory at a time.
+    """
+    report = {'imported': 0, 'failed': 0, 'errors': []}
+    
+    def add_error(line, message):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_IMPORT_ERRORS:
+            report['errors'].append({'line': line, 'error': message})
+    
+    def flush(chunk):
+        rejected = write_chunk(chunk)
+        for line, message in rejected:
+            add_error(line, message)
+        report['imported'] += len(chunk) - len(rejected)
+    
+    try:
+        missing = [column for column in required if column not in (reader.fieldnames or [])]
+        if missing:
+            return None, f"Missing CSV column(s): {', '.join(missing)}"
+        
+        chunk = []
+        for row in reader:
+            line = reader.line_num
+            try:
+                chunk.append((line, parse_row(row)))
+            except ValueError as e:
+                add_error(line, str(e))
+                continue
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+    except (csv.Error, UnicodeDecodeError) as e:
+        # Chunks already committed stay imported; report where parsing stopped
+        report['errors_truncated'] = report['failed'] > len(report['errors'])
+        return report, f'Could not parse CSV near line {reader.line_num}: {e}'
+    
+    report['errors_truncated'] = report['failed'] > len(report['errors'])
+    return report, None
+
+
+def import_response(report, error):
+    if error:
+        body = {'error': error}
+        if report is not None:
+            body['report'] = report
+        return jsonify(body), 400
+    return jsonify(report), 200
+
+
+@api.route('/api/import/clients', methods=['POST'])
+def import_clients():
+    """Bulk import clients from CSV (name, email, phone, created_at)"""
     user_id = get_current_user_id()
     if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = get_db()
+    def parse_row(row):
+        name = (row.get('name') or '').strip()
+        email = (row.get('email') or '').strip()
+        if not name or not email:
+            raise ValueError('Name and email are required')
+        created_at = parse_date((row.get('created_at') or '').strip(), 'created_at', with_time=True)
+        return (user_id, name, email, (row.get('phone') or '').strip(), created_at)
+    
+    def write_chunk(chunk):
+        def write(conn):
+            conn.executemany(
+                'INSERT INTO clients (user_id, name, email, phone, created_at) '
+                'VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+                [values for _, values in chunk]
+            )
+        
+        run_write(user_id, write, immediate=True)
+        return []
+    
+    return import_response(*run_import(get_upload_reader(), ['name', 'email'], parse_row, write_chunk))
+
+
+@api.route('/api/import/invoices', methods=['POST'])
+def import_invoices():
+    """
+    Bulk import invoices from CSV (client_id or client_email, amount,
+    description, status, due_date, created_at)
+    """
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    def parse_row(row):
+        client_id = (row.get('client_id') or '').strip()
+        client_email = (row.get('client_email') or '').strip()
+        if not client_id and not client_email:
+            raise ValueError('Client ID or client email is required')
+        status = (row.get('status') or '').strip() or 'unpaid'
+        if status not in ['paid', 'unpaid']:
+            raise ValueError('Status must be paid or unpaid')
+        return {
+            'client_id': parse_id(client_id, 'client_id') if client_id else None,
+            'client_email': client_email,
+            'amount': parse_amount((row.get('amount') or '').strip()),
+            'description': row.get('description') or '',
+            'status': status,
+            'due_date': parse_date((row.get('due_date') or '').strip(), 'due_date') or '',
+            'created_at': parse_date((row.get('created_at') or '').strip(), 'created_at', with_time=True),
+        }
     
-    # Get stats scoped to current user
-    total_clients = conn.execute(
-        'SELECT COUNT(*) as count FROM clients WHERE user_id = ?',
+    def write_chunk(chunk):
+        def write(conn):
+            # Resolve the chunk's client references with one query each
+            owned = owned_client_ids(
+                conn, user_id, {row['client_id'] for _, row in chunk if row['client_id']}
+            )
+            emails = {row['client_email'] for _, row in chunk if not row['client_id']}
+            by_email = {}
+            if emails:
+                placeholders = ','.join('?' * len(emails))
+                for client in conn.execute(
+                    f'SELECT id, email FROM clients WHERE user_id = ? AND email IN ({placeholders}) '
+                    'ORDER BY id DESC',
+                    [user_id, *emails]
+                ):
+                    by_email[client['email']] = client['id']  # oldest match wins
+            
+            rows = []
+            rejected = []
+            for line, row in chunk:
+                if row['client_id']:
+                    client_id = row['client_id'] if row['client_id'] in owned else None
+                else:
+                    client_id = by_email.get(row['client_email'])
+                if client_id is None:
+                    rejected.append((line, 'Client not found or unauthorized'))
+                    continue
+                rows.append((client_id, user_id, row['amount'], row['description'], row['status'],
+                             row['due_date'], row['created_at']))
+            
+            conn.executemany(
+                'INSERT INTO invoices (client_id, user_id, amount, description, status, due_date, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+                rows
+            )
+            return rejected
+        
+        return run_write(user_id, write, immediate=True)
+    
+    return import_response(*run_import(get_upload_reader(), ['amount'], parse_row, write_chunk))
+
+
+# ============ STATS ROUTE ============
+
+def read_stats(conn, user_id):
+    """Read the user's dashboard totals with a single primary-key lookup"""
+    stats = conn.execute(
+        'SELECT total_clients, total_invoices, paid_total, unpaid_total FROM user_stats WHERE user_id = ?',
         (user_id,)
-    ).fetchone()['count']
+    ).fetchone()
     
-    total_invoices = conn.execute('''
-        SELECT COUNT(*) as count FROM invoices
-        JOIN clients ON invoices.client_id = clients.id
-        WHERE clients.user_id = ?
-    ''', (user_id,)).fetchone()['count']
+    if not stats:
+        return {
+            'total_clients': 0,
+            'total_invoices': 0,
+            'paid_total': 0,
+            'unpaid_total': 0
+        }
     
-    paid_total = conn.execute('''
-        SELECT SUM(amount) as total FROM invoices
-        JOIN clients ON invoices.client_id = clients.id
-        WHERE clients.user_id = ? AND invoices.status = 'paid'
-    ''', (user_id,)).fetchone()['total'] or 0
+    return {
+        'total_clients': stats['total_clients'],
+        'total_invoices': stats['total_invoices'],
+        'paid_total': stats['paid_total'],
+        'unpaid_total': stats['unpaid_total']
+    }
+
+
+@api.route('/api/stats', methods=['GET'])
+@conditional_get
+def get_stats():
+    """Get statistics for current user"""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    unpaid_total = conn.execute('''
-        SELECT SUM(amount) as total FROM invoices
-        JOIN clients ON invoices.client_id = clients.id
-        WHERE clients.user_id = ? AND invoices.status = 'unpaid'
-    ''', (user_id,)).fetchone()['total'] or 0
+    # Backed by the trigger-maintained user_stats rollup
+    return jsonify(read_stats(get_read_db(user_id), user_id))
+
+
+# ============ DASHBOARD ROUTE ============
+
+# Rows shown by the dashboard's recent invoices widget
+RECENT_INVOICES_LIMIT = 5
+
+
+@api.route('/api/dashboard', methods=['GET'])
+@conditional_get
+def get_dashboard():
+    """Stats, recent invoices and client dropdown options in one request"""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    conn.close()
+    conn = get_read_db(user_id)
+    
+    # One read transaction, so all three parts come from the same snapshot
+    conn.execute('BEGIN')
+    try:
+        stats = read_stats(conn, user_id)
+        
+        # Only the columns the widget renders
+        recent_invoices = conn.execute('''
+            SELECT
+                invoices.id,
+                clients.name AS client_name,
+                invoices.description,
+                invoices.amount,
+                invoices.status
+            FROM invoices
+            JOIN clients ON invoices.client_id = clients.id
+            WHERE invoices.user_id = ?
+            ORDER BY invoices.created_at DESC, invoices.id DESC
+            LIMIT ?
+        ''', (user_id, RECENT_INVOICES_LIMIT)).fetchall()
+        
+        # The invoice form's client dropdown needs only id and name
+        client_options = conn.execute(
+            'SELECT id, name FROM clients WHERE user_id = ? ORDER BY created_at DESC, id DESC',
+            (user_id,)
+        ).fetchall()
+    finally:
+        conn.commit()
     
     return jsonify({
-        'total_clients': total_clients,
-        'total_invoices': total_invoices,
-        'paid_total': paid_total,
-        'unpaid_total': unpaid_total
+        'stats': stats,
+        'recent_invoices': [dict(invoice) for invoice in recent_invoices],
+        'client_options': [dict(client) for client in client_options]
     })
 
 
+# ============ SYNC ROUTE ============
+
+# Columns sent per row; the browser joins client_name from its own clients
+SYNC_CLIENT_FIELDS = list(CLIENT_FIELDS)
+SYNC_INVOICE_FIELDS = [name for name in INVOICE_FIELDS if name != 'client_name']
+SYNC_STATS = ('total_clients', 'total_invoices', 'paid_total', 'unpaid_total')
+
+
+@api.route('/api/sync', methods=['GET'])
+def sync():
+    """
+    Rows changed and deleted since ?since= (a version from an earlier sync),
+    plus the stats. With since=0, or a since the server can no longer
+    answer from tombstones, returns every row with reset: true instead.
+    """
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'since must be an integer'}), 400
+    if since < 0:
+        return jsonify({'error': 'since must be 0 or greater'}), 400
+    
+    conn = get_read_db(user_id)
+    clients_query = f'SELECT {select_list(CLIENT_FIELDS, SYNC_CLIENT_FIELDS)} FROM clients WHERE user_id = ?'
+    invoices_query = f'SELECT {select_list(INVOICE_FIELDS, SYNC_INVOICE_FIELDS)} FROM invoices WHERE invoices.user_id = ?'
+    
+    # One read transaction, held until the rows are streamed, so the rows
+    # and the version match
+    conn.execute('BEGIN')
+    try:
+        row = conn.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()
+        version = row['data_version'] if row else 0
+        floor = row['sync_floor'] if row else 0
+        
+        # A since from the future means another database (e.g. a shard move)
+        reset = since == 0 or since < floor or since > version
+        deleted = {'clients': [], 'invoices': []}
+        if reset:
+            clients = conn.execute(clients_query, (user_id,))
+            invoices = conn.execute(invoices_query, (user_id,))
+        else:
+            clients = conn.execute(clients_query + ' AND change_version > ?', (user_id, since))
+            invoices = conn.execute(invoices_query + ' AND invoices.change_version > ?', (user_id, since))
+            tombstones = conn.execute(
+                'SELECT kind, row_id FROM tombstones WHERE user_id = ? AND change_version > ?',
+                (user_id, since)
+            ).fetchall()
+            for tombstone in tombstones:
+                deleted[tombstone['kind'] + 's'].append(tombstone['row_id'])
+    except Exception:
+        conn.commit()
+        raise
+    
+    # A snapshot can hold every row the user has; stream it from the cursors
+    return stream_object(
+        {
+            'version': version,
+            'reset': reset,
+            'deleted': deleted,
+            'stats': {name: row[name] if row else 0 for name in SYNC_STATS}
+        },
+        [('clients', clients), ('invoices', invoices)],
+        done=conn.commit
+    )
+
+
+# ============ APP FACTORY ============
+
+def create_app(config=None):
+    """
+    Build the Flask app. Nothing here opens the database: each process
+    creates its pool on its first request, and only then migrates the
+    schema if PRAGMA user_version is behind. Importing stays cheap, and
+    gunicorn --preload forks its workers before any connection exists.
+    """
+    app = Flask(__name__)
+    
+    # Session configuration - use environment variable in production
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-production')
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
+    
+    # CORS configuration - support both development and production
+    allowed_origins = [
+        'http://localhost:8001',
+        'http://localhost:8000',
+        'http://127.0.0.1:8001',
+        'http://127.0.0.1:8000'
+    ]
+    
+    # Add production frontend URL if it exists
+    frontend_url = os.environ.get('FRONTEND_URL')
+    if frontend_url:
+        allowed_origins.append(frontend_url)
+    
+    CORS(app, 
+         supports_credentials=True, 
+         origins=allowed_origins,
+         allow_headers=['Content-Type', 'If-None-Match'],
+         expose_headers=['ETag'],
+         methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
+    
+    if config:
+        app.config.update(config)
+    # e.g. create_app({'DATABASE': 'other.db'})
+    if 'DATABASE' in app.config:
+        models.DATABASE = app.config['DATABASE']
+    # e.g. create_app({'DB_SHARDS': 4}), see models.SHARDS
+    if 'DB_SHARDS' in app.config:
+        models.SHARDS = app.config['DB_SHARDS']
+    
+    app.before_request(start_request_metrics)
+    app.after_request(capture_response_status)
+    app.teardown_request(finish_request_metrics)
+    app.before_request(start_profiling)
+    app.after_request(add_profile_header)
+    app.teardown_request(finish_profiling)
+    
+    # Pooled connections are handed to each request and returned at teardown
+    app.teardown_appcontext(close_db)
+    
+    app.register_blueprint(api)
+    return app
+
+
+# WSGI entry point (gunicorn app:app)
+app = create_app()
+
+
 if __name__ == '__main__':
     # Use PORT from environment variable (for deployment) or default to 5000
     port = int(os.environ.get('PORT', 5000))
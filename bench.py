@@ -0,0 +1,423 @@
+"""
+bench.py - Load test and benchmark suite for FreelancePay Tracker
+
+Seeds a reproducible dataset of N users x M clients x K invoices with bulk
+inserts, drives every API route through the Flask test client (default),
+a built-in threaded WSGI server (--server) or an already running server
+(--url, e.g. gunicorn), and prints throughput and p50/p95/p99 latency per
+endpoint as JSON.
+
+Usage:
+    python3 bench.py --users 10 --clients 50 --invoices 20 --requests 200
+    python3 bench.py --server --concurrency 8 --output before.json
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import models
+
+BENCH_DATABASE = 'bench_freelance.db'
+BENCH_PASSWORD = 'benchpass'
+BATCH_SIZE = 50   # invoices per batch request
+IMPORT_ROWS = 20  # rows per import request
+
+
+# ============ DATASET ============
+
+def seed(users, clients, invoices, seed=0):
+    """
+    Bulk-load users x clients x invoices into a fresh models.DATABASE.
+    Rows are generated lazily and written with executemany in one
+    transaction; the same seed always produces the same data.
+    """
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(models.DATABASE + suffix):
+            os.remove(models.DATABASE + suffix)
+    models.close_pool()
+    models.init_db()
+
+    rng = random.Random(seed)
+    password = models.hash_password(BENCH_PASSWORD)
+    epoch = datetime(2024, 1, 1)
+
+    def stamp(offset):
+        return (epoch + timedelta(minutes=offset)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def client_rows():
+        for u in range(users):
+            for c in range(clients):
+                yield (u + 1, f'Client {u}-{c}', f'client{u}-{c}@example.com', '', stamp(c))
+
+    def invoice_rows():
+        for client_id in range(1, users * clients + 1):
+            for i in range(invoices):
+                due = epoch + timedelta(days=rng.randrange(365))
+                yield (
+                    client_id,
+                    (client_id - 1) // clients + 1,
+                    round(rng.uniform(10, 5000), 2),
+                    f'Invoice {i}',
+                    rng.choice(('paid', 'unpaid')),
+                    due.strftime('%Y-%m-%d'),
+                    stamp(i),
+                )
+
+    start = time.perf_counter()
+    conn = models.get_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany(
+            'INSERT INTO users (email, password, name) VALUES (?, ?, ?)',
+            ((f'bench{u}@example.com', password, f'Bench User {u}') for u in range(users))
+        )
+        conn.executemany(
+            'INSERT INTO clients (user_id, name, email, phone, created_at) VALUES (?, ?, ?, ?, ?)',
+            client_rows()
+        )
+        conn.executemany(
+            '''INSERT INTO invoices (client_id, user_id, amount, description, status, due_date, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            invoice_rows()
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    return {
+        'users': users,
+        'clients': users * clients,
+        'invoices': users * clients * invoices,
+        'seed_seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+# ============ SESSIONS ============
+
+class TestClientSession:
+    """Requests through Flask's test client (no network, no server)."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, content_type=None):
+        kwargs = {}
+        if isinstance(body, (dict, list)):
+            kwargs['json'] = body
+        elif body is not None:
+            kwargs['data'] = body
+            kwargs['content_type'] = content_type
+        response = self.client.open(path, method=method, **kwargs)
+        data = response.get_data()  # drains streamed bodies
+        response.close()
+        return response.status_code, data
+
+
+class HttpSession:
+    """Requests over HTTP to a running server, keeping the session cookie."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor())
+
+    def request(self, method, path, body=None, content_type=None):
+        headers = {}
+        data = None
+        if isinstance(body, (dict, list)):
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif body is not None:
+            data = body.encode('utf-8')
+            headers['Content-Type'] = content_type
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with self.opener.open(req) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def login(state):
+    """(Re)establish the worker's session as its seeded user."""
+    status, _ = state['session'].request(
+        'POST', '/api/login', {'email': state['email'], 'password': BENCH_PASSWORD}
+    )
+    if status != 200:
+        raise RuntimeError(f"Could not log in as {state['email']} ({status})")
+
+
+# ============ ENDPOINTS ============
+
+def unique(state):
+    """A value no other request of this run has used."""
+    state['counter'] += 1
+    return f"{state['worker']}-{state['counter']}-{time.time_ns()}"
+
+
+def push(key):
+    """after() hook that remembers the id a create request returned."""
+    def after(state, data):
+        state[key].append(json.loads(data)['id'])
+    return after
+
+
+def next_id(state, key):
+    """Cycle through the ids created earlier in the run."""
+    ids = state[key]
+    return ids[state['counter'] % len(ids)] if ids else 0
+
+
+def pop_id(state, key):
+    state['counter'] += 1
+    return state[key].pop() if state[key] else 0
+
+
+def batch_items(state):
+    return [{'client_id': state['client_id'], 'amount': 10 + i} for i in range(BATCH_SIZE)]
+
+
+def push_batch(state, data):
+    state['batches'].append([result['id'] for result in json.loads(data)['results']])
+
+
+def next_batch(state):
+    return state['batches'][state['counter'] % len(state['batches'])] if state['batches'] else []
+
+
+def save_sync_version(state, data):
+    """after() hook that remembers where the snapshot left off."""
+    state['sync_version'] = json.loads(data)['version']
+
+
+def import_clients_csv(state):
+    tag = unique(state)
+    rows = ''.join(f'Imported {tag}-{i},imp{tag}-{i}@example.com\n' for i in range(IMPORT_ROWS))
+    return 'name,email\n' + rows
+
+
+def import_invoices_csv(state):
+    rows = ''.join(f"{state['client_id']},{i + 1}\n" for i in range(IMPORT_ROWS))
+    return 'client_id,amount\n' + rows
+
+
+# (name, expected status, build(state) -> (method, path, body[, content type]),
+#  optional untimed after(state, data)); run in order, so writes that need an
+#  id follow the request that created it.
+ENDPOINTS = [
+    ('GET /api/me', 200, lambda s: ('GET', '/api/me', None), None),
+    ('GET /api/cache/users', 200, lambda s: ('GET', '/api/cache/users', None), None),
+    ('GET /api/stats', 200, lambda s: ('GET', '/api/stats', None), None),
+    ('GET /api/dashboard', 200, lambda s: ('GET', '/api/dashboard', None), None),
+    ('GET /api/clients?limit=50', 200, lambda s: ('GET', '/api/clients?limit=50', None), None),
+    ('GET /api/clients?search=', 200,
+     lambda s: ('GET', '/api/clients?search=Client%201&limit=50', None), None),
+    ('GET /api/clients (full)', 200, lambda s: ('GET', '/api/clients', None), None),
+    ('GET /api/invoices?limit=50', 200, lambda s: ('GET', '/api/invoices?limit=50', None), None),
+    ('GET /api/invoices?status=&sort=amount', 200,
+     lambda s: ('GET', '/api/invoices?status=paid&sort=amount&limit=50', None), None),
+    ('GET /api/invoices?due_from=&due_to=', 200,
+     lambda s: ('GET', '/api/invoices?due_from=2024-03-01&due_to=2024-06-30&limit=50', None), None),
+    ('GET /api/invoices (full)', 200, lambda s: ('GET', '/api/invoices', None), None),
+    ('GET /api/export/invoices?format=csv', 200,
+     lambda s: ('GET', '/api/export/invoices?format=csv', None), None),
+    ('GET /api/export/clients?format=ndjson', 200,
+     lambda s: ('GET', '/api/export/clients?format=ndjson', None), None),
+    ('GET /api/sync (snapshot)', 200, lambda s: ('GET', '/api/sync?since=0', None), save_sync_version),
+    ('POST /api/login', 200,
+     lambda s: ('POST', '/api/login', {'email': s['email'], 'password': BENCH_PASSWORD}), None),
+    ('POST /api/clients', 201,
+     lambda s: ('POST', '/api/clients', {'name': 'Bench', 'email': f'{unique(s)}@example.com'}),
+     push('client_ids')),
+    ('PUT /api/clients/<id>', 200,
+     lambda s: ('PUT', f"/api/clients/{next_id(s, 'client_ids')}",
+                {'name': 'Bench Renamed', 'email': f'{unique(s)}@example.com'}), None),
+    ('POST /api/invoices', 201,
+     lambda s: ('POST', '/api/invoices', {'client_id': s['client_id'], 'amount': 100}),
+     push('invoice_ids')),
+    ('PUT /api/invoices/<id>', 200,
+     lambda s: ('PUT', f"/api/invoices/{next_id(s, 'invoice_ids')}", {'amount': 150}), None),
+    ('PUT /api/invoices/<id>/status', 200,
+     lambda s: ('PUT', f"/api/invoices/{next_id(s, 'invoice_ids')}/status", {'status': 'paid'}), None),
+    ('DELETE /api/invoices/<id>', 200,
+     lambda s: ('DELETE', f"/api/invoices/{pop_id(s, 'invoice_ids')}", None), None),
+    ('DELETE /api/clients/<id>', 200,
+     lambda s: ('DELETE', f"/api/clients/{pop_id(s, 'client_ids')}", None), None),
+    ('POST /api/invoices/batch', 200,
+     lambda s: ('POST', '/api/invoices/batch', {'invoices': batch_items(s)}), push_batch),
+    ('PUT /api/invoices/batch', 200,
+     lambda s: ('PUT', '/api/invoices/batch',
+                {'invoices': [{'id': i, 'amount': 20} for i in next_batch(s)]}), None),
+    ('PUT /api/invoices/status/batch', 200,
+     lambda s: ('PUT', '/api/invoices/status/batch',
+                {'invoices': [{'id': i, 'status': 'paid'} for i in next_batch(s)]}), None),
+    ('DELETE /api/invoices/batch', 200,
+     lambda s: ('DELETE', '/api/invoices/batch',
+                {'ids': s['batches'].pop() if s['batches'] else []}), None),
+    ('POST /api/import/clients', 200,
+     lambda s: ('POST', '/api/import/clients', import_clients_csv(s), 'text/csv'), None),
+    ('POST /api/import/invoices', 200,
+     lambda s: ('POST', '/api/import/invoices', import_invoices_csv(s), 'text/csv'), None),
+    # After the writes above, so there is a delta since the snapshot
+    ('GET /api/sync?since=', 200,
+     lambda s: ('GET', f"/api/sync?since={s['sync_version']}", None), None),
+    ('POST /api/register', 201,
+     lambda s: ('POST', '/api/register',
+                {'email': f'{unique(s)}@example.com', 'password': BENCH_PASSWORD, 'name': 'New'}),
+     lambda s, data: login(s)),
+    ('POST /api/logout', 200, lambda s: ('POST', '/api/logout', None), lambda s, data: login(s)),
+]
+
+
+# ============ RUNNER ============
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def run_endpoint(states, endpoint, requests):
+    """Issue requests calls of one endpoint spread over the workers' states."""
+    name, expected, build, after = endpoint
+    per_worker = [requests // len(states) + (i < requests % len(states)) for i in range(len(states))]
+
+    def work(state, count):
+        timings, errors = [], 0
+        for _ in range(count):
+            method, path, body, *content_type = build(state)
+            start = time.perf_counter()
+            status, data = state['session'].request(method, path, body, *content_type)
+            timings.append(time.perf_counter() - start)
+            if status != expected:
+                errors += 1
+            elif after:
+                after(state, data)
+        return timings, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(states)) as pool:
+        results = list(pool.map(work, states, per_worker))
+    wall = time.perf_counter() - start
+
+    timings = sorted(t for worker_timings, _ in results for t in worker_timings)
+
+    def ms(seconds):
+        return round(seconds * 1000, 3) if seconds is not None else None
+
+    return {
+        'requests': len(timings),
+        'errors': sum(errors for _, errors in results),
+        'throughput_rps': round(len(timings) / wall, 1) if wall else None,
+        'mean_ms': ms(sum(timings) / len(timings)) if timings else None,
+        'p50_ms': ms(percentile(timings, 50)),
+        'p95_ms': ms(percentile(timings, 95)),
+        'p99_ms': ms(percentile(timings, 99)),
+    }
+
+
+def run(users=5, clients=20, invoices=10, requests=100, concurrency=1,
+        server=False, url=None, seed_value=0, database=BENCH_DATABASE, only=None):
+    """Seed the dataset, benchmark every endpoint and return the report."""
+    models.DATABASE = database
+    dataset = seed(users, clients, invoices, seed_value)
+
+    from app import app  # the pool reads models.DATABASE on first use
+
+    httpd = None
+    if server:
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)  # no per-request access log
+        httpd = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{httpd.server_port}'
+
+    states = []
+    for worker in range(concurrency):
+        state = {
+            'worker': worker,
+            'counter': 0,
+            'email': f'bench{worker % users}@example.com',
+            'client_id': (worker % users) * clients + 1,
+            'client_ids': [],
+            'invoice_ids': [],
+            'batches': [],
+            'sync_version': 0,
+            'session': HttpSession(url) if url else TestClientSession(app),
+        }
+        login(state)
+        states.append(state)
+
+    try:
+        results = {}
+        for endpoint in ENDPOINTS:
+            if only and not any(part in endpoint[0] for part in only):
+                continue
+            results[endpoint[0]] = run_endpoint(states, endpoint, requests)
+    finally:
+        if httpd:
+            httpd.shutdown()
+        models.close_pool()
+
+    if server:
+        mode = 'server'
+    elif url:
+        mode = 'external'
+    else:
+        mode = 'test_client'
+
+    return {
+        'config': {
+            'mode': mode,
+            'requests_per_endpoint': requests,
+            'concurrency': concurrency,
+            'seed': seed_value,
+            'pool_size': models.POOL_SIZE,
+        },
+        'dataset': dataset,
+        'endpoints': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the FreelancePay Tracker API')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--clients', type=int, default=20, help='clients per user')
+    parser.add_argument('--invoices', type=int, default=10, help='invoices per client')
+    parser.add_argument('--requests', type=int, default=100, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=1, help='concurrent workers')
+    parser.add_argument('--server', action='store_true', help='serve the app on a local threaded WSGI server')
+    parser.add_argument('--url', help='benchmark an already running server (seeds --database first)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', default=BENCH_DATABASE)
+    parser.add_argument('--only', action='append', help='only endpoints whose name contains this (repeatable)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = run(
+        users=args.users, clients=args.clients, invoices=args.invoices,
+        requests=args.requests, concurrency=args.concurrency,
+        server=args.server, url=args.url, seed_value=args.seed,
+        database=args.database, only=args.only
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+groupcommit.py - Group-commit writer for FreelancePay Tracker
+
+GroupCommitWriter owns one connection and a thread that applies queued
+write functions in shared transactions: it waits up to max_delay seconds
+for more writes (or until max_batch are queued), runs each in its own
+SAVEPOINT, commits once, then hands every caller its own result or error.
+Taking the lock and committing go through an optional retry callable, so
+another process holding the database doesn't fail the whole group.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class GroupCommitWriter:
+    """Single writer thread committing queued writes in groups."""
+
+    def __init__(self, conn, max_batch=64, max_delay=0.002, on_close=None, retry=None):
+        self.conn = conn
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_close = on_close  # called with conn once the thread has stopped
+        # retry(call) re-runs BEGIN or COMMIT while the database is busy
+        self.retry = retry if retry is not None else (lambda call: call())
+        self.commits = 0
+        self.writes = 0
+        self.closed = False
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+        self._thread.start()
+
+    def submit(self, write):
+        """
+        Queue write(conn) and wait for its group to commit. Returns what
+        write returned, or raises what it (or the commit) raised.
+        """
+        if self.closed:
+            raise RuntimeError('Group-commit writer is closed')
+        future = Future()
+        self._queue.put((write, future))
+        return future.result()
+
+    def close(self):
+        """Commit whatever is queued, then stop the thread."""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(None)
+        self._thread.join()
+        if self.on_close is not None:
+            self.on_close(self.conn)
+
+    def _next_batch(self):
+        """Block for one write, then gather more until the window or batch is full."""
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # stop after this batch
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._commit(batch)
+            except Exception as e:
+                # Keep the thread alive; nobody may be left waiting forever
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _commit(self, batch):
+        conn = self.conn
+        try:
+            self.retry(lambda: conn.execute('BEGIN IMMEDIATE'))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        done = []
+        for write, future in batch:
+            # A failing write only undoes its own changes
+            conn.execute('SAVEPOINT grouped_write')
+            try:
+                result = write(conn)
+            except Exception as e:
+                conn.execute('ROLLBACK TO grouped_write')
+                conn.execute('RELEASE grouped_write')
+                future.set_exception(e)
+            else:
+                conn.execute('RELEASE grouped_write')
+                done.append((future, result))
+
+        try:
+            # A busy COMMIT leaves the transaction open, so it can be retried
+            self.retry(conn.commit)
+        except Exception as e:
+            conn.rollback()
+            for future, _ in done:
+                future.set_exception(e)
+            return
+        self.commits += 1
+        self.writes += len(done)
+        for future, result in done:
+            future.set_result(result)
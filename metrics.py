@@ -0,0 +1,109 @@
+"""
+metrics.py - In-process metrics for FreelancePay Tracker
+
+MetricsRegistry holds labelled counters, histograms and scrape-time gauges,
+and renders them in the Prometheus text exposition format.
+"""
+
+import bisect
+import threading
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Observation counts per upper bucket bound, plus a running sum."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Thread-safe store of named metrics, keyed by label values."""
+
+    def __init__(self):
+        self._metrics = {}  # name -> (type, doc, buckets, series)
+        self._gauges = {}   # name -> (doc, fn)
+        self._lock = threading.Lock()
+
+    def counter(self, name, doc):
+        """Declare a counter; series are created on first inc()."""
+        self._metrics[name] = ('counter', doc, None, {})
+
+    def histogram(self, name, doc, buckets=LATENCY_BUCKETS):
+        """Declare a histogram; series are created on first observe()."""
+        self._metrics[name] = ('histogram', doc, tuple(buckets), {})
+
+    def gauge(self, name, doc, fn):
+        """Declare a gauge whose value is read from fn() at render time."""
+        self._gauges[name] = (doc, fn)
+
+    def inc(self, name, labels=(), amount=1):
+        """Add amount to a counter series; labels is a tuple of (key, value)."""
+        series = self._metrics[name][3]
+        with self._lock:
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        """Record one value in a histogram series."""
+        _, _, buckets, series = self._metrics[name]
+        with self._lock:
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(buckets)
+            histogram.observe(value)
+
+    def clear(self):
+        """Drop every recorded series (declarations are kept)."""
+        with self._lock:
+            for _, _, _, series in self._metrics.values():
+                series.clear()
+
+    def render(self):
+        """Return every metric in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for name, (kind, doc, buckets, series) in self._metrics.items():
+                lines.append(f'# HELP {name} {doc}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in series.items():
+                    if kind == 'counter':
+                        lines.append(f'{name}{format_labels(labels)} {value}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), value.counts):
+                        cumulative += count
+                        bucket_labels = format_labels(labels + (('le', format_bound(bound)),))
+                        lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {value.sum}')
+                    lines.append(f'{name}_count{format_labels(labels)} {value.count}')
+        for name, (doc, fn) in self._gauges.items():
+            lines.append(f'# HELP {name} {doc}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {fn()}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_bound(bound):
+    """Bucket bound as Prometheus writes it ('0.5', '1.0', '+Inf')."""
+    return bound if isinstance(bound, str) else repr(float(bound))
+
+
+def format_labels(labels):
+    """Render label pairs as {key="value",...}, escaping the values."""
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
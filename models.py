@@ -4,21 +4,461 @@ models.py - Database models for FreelancePay Tracker
 Handles database operations for users, clients, and invoices.
 """
 
+import os
+import queue
+import random
 import sqlite3
+import threading
+import time
 from datetime import datetime
 import hashlib
 
+from flask import g, has_app_context
+
+from cache import LRUCache
+from groupcommit import GroupCommitWriter
+
 # Database filename - can be overridden for testing
 DATABASE = 'freelance.db'
 
+# Connection pool settings - can be overridden via environment. POOL_SIZE
+# bounds the read-only connections; writes share a single connection
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+# How long SQLite waits on another process's lock before SQLITE_BUSY, and
+# how often a busy write transaction is retried (with jittered backoff)
+BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+BUSY_RETRIES = int(os.environ.get('DB_BUSY_RETRIES', 3))
+BUSY_RETRY_MS = float(os.environ.get('DB_BUSY_RETRY_MS', 50))
+
+# User lookup cache settings - entries are keyed by id and by email
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+
+# Sharding - off unless DB_SHARDS is set. DATABASE then keeps users and the
+# user_shards directory, and new users' clients and invoices go to one of
+# DB_SHARDS files named after it (freelance-shard0.db, ...)
+SHARDS = int(os.environ.get('DB_SHARDS', 0))
+
+# Group commit - off unless DB_GROUP_COMMIT=True. Single-row writes are then
+# queued to one writer thread per database, which commits them together
+# after waiting at most the window (ms) or until max_batch are queued
+GROUP_COMMIT = os.environ.get('DB_GROUP_COMMIT', 'False') == 'True'
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('DB_GROUP_COMMIT_WINDOW_MS', 2))
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('DB_GROUP_COMMIT_MAX_BATCH', 64))
+
+# Delete tombstones older than this many days with `models.py prune-tombstones`;
+# clients that last synced before the newest pruned one get a full snapshot
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 30))
+
+# Slow-query log - off unless SLOW_QUERY_MS is set; logs JSON lines to
+# SLOW_QUERY_LOG (rotated) or to stderr when no file is given
+SLOW_QUERY_MS = os.environ.get('SLOW_QUERY_MS')
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG')
+
+# PRAGMAs applied once to every pooled connection when it is opened
+PRAGMAS = [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -8000),      # ~8 MB page cache per connection
+    ('mmap_size', 67108864),    # 64 MB of memory-mapped I/O
+    ('foreign_keys', 'ON'),
+    ('busy_timeout', BUSY_TIMEOUT_MS),
+]
+
+
+# ============ CONNECTION POOL ============
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that belongs to a ConnectionPool.
+    close() hands it back to the pool instead of closing it.
+    """
+
+    pool = None
+    pinned = False  # True while bound to a Flask app context
+
+    def close(self):
+        if self.pinned:
+            # Released by close_db() at app context teardown
+            return
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            sqlite3.Connection.close(self)
+
+
+# Callables run after each statement as
+# hook(conn, sql, parameters, seconds, many), many being True for executemany.
+# The pool only opens timed connections while at least one is registered,
+# so an empty list costs nothing per statement.
+statement_hooks = []
+
+if SLOW_QUERY_MS:
+    from slowlog import SlowQueryLog
+    statement_hooks.append(SlowQueryLog(float(SLOW_QUERY_MS), SLOW_QUERY_LOG))
+
+
+class TimedConnection(PooledConnection):
+    """Pooled connection that reports every statement to statement_hooks."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in statement_hooks:
+                hook(self, sql, parameters, elapsed, False)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in statement_hooks:
+                hook(self, sql, seq_of_parameters, elapsed, True)
+
+
+class ConnectionPool:
+    """
+    Pooled connections to a single database file. The pool itself hands
+    out the one writer connection, so this process's writes are serialized
+    here instead of contending for SQLite's lock; readers is a pool of up
+    to size query_only connections, which WAL lets run alongside it. With
+    GROUP_COMMIT, writer() opens a second writing connection for its
+    thread, and run_write() sends every write there instead.
+    """
+
+    def __init__(self, database, size=None, timeout=None, readonly=False):
+        self.database = database
+        self.readonly = readonly
+        self.size = (size if size is not None else POOL_SIZE) if readonly else 1
+        self.timeout = timeout if timeout is not None else POOL_TIMEOUT
+        self.pid = os.getpid()  # pools are never shared across fork()
+        self.opened = 0
+        self.closed = False
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self.readers = None if readonly else ConnectionPool(database, size, timeout, readonly=True)
+
+    def _connect(self):
+        """Open a new connection and apply the PRAGMAs once."""
+        # uri=True also accepts "file:...?mode=memory&cache=shared" databases
+        conn = sqlite3.connect(
+            self.database,
+            factory=TimedConnection if statement_hooks else PooledConnection,
+            check_same_thread=False,
+            uri=True
+        )
+        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        for name, value in PRAGMAS:
+            conn.execute(f'PRAGMA {name} = {value}')
+        if self.readonly:
+            conn.execute('PRAGMA query_only = ON')
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        """
+        Take an idle connection, opening a new one while under the size limit.
+        Raises sqlite3.OperationalError if none frees up within the timeout.
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self.opened < self.size
+            if can_open:
+                self.opened += 1
+
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self.opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError('Timed out waiting for a database connection')
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any open transaction."""
+        if conn.in_transaction:
+            conn.rollback()
+        if self.closed:
+            sqlite3.Connection.close(conn)
+            with self._lock:
+                self.opened -= 1
+        else:
+            self._idle.put(conn)
+
+    def writer(self):
+        """This pool's group-commit writer, started on first use with its own connection."""
+        with self._writer_lock:
+            if self._writer is None:
+                # Migrations keep the pool's writer connection; the two
+                # take turns through SQLite's lock and busy_timeout
+                with self._lock:
+                    self.opened += 1
+                self._writer = GroupCommitWriter(
+                    self._connect(),
+                    max_batch=GROUP_COMMIT_MAX_BATCH,
+                    max_delay=GROUP_COMMIT_WINDOW_MS / 1000,
+                    on_close=self.release,
+                    retry=retry_busy
+                )
+            return self._writer
+
+    def close(self):
+        """Close every idle connection; busy ones are closed when released."""
+        self.closed = True
+        if self._writer is not None:
+            self._writer.close()  # drains its queue, then releases its connection
+        if self.readers is not None:
+            self.readers.close()
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            sqlite3.Connection.close(conn)
+            with self._lock:
+                self.opened -= 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns this process's pool for the current DATABASE. A new pool (first
+    use, DATABASE changed, or after fork) first brings the schema up to date.
+    """
+    global _pool
+    pool = _pool
+    if pool is not None and pool.database == DATABASE and pool.pid == os.getpid():
+        return pool
+
+    with _pool_lock:
+        if _pool is not None and _pool.pid != os.getpid():
+            # Inherited from the parent process, which still owns those
+            # connections - drop them without closing
+            _pool = None
+        if _pool is None or _pool.database != DATABASE:
+            if _pool is not None:
+                _pool.close()
+            pool = ConnectionPool(DATABASE)
+            try:
+                ensure_schema(pool)
+            except Exception:
+                pool.close()
+                raise
+            _pool = pool
+            # Cached rows belong to the previous database
+            user_cache.clear()
+        return _pool
+
+
+_shard_pools = {}  # shard number -> ConnectionPool
+
+
+def shard_database(shard):
+    """Filename (or URI) of a shard: DATABASE with -shard<N> before the extension."""
+    path, sep, query = DATABASE.partition('?')
+    root, ext = os.path.splitext(path)
+    return f'{root}-shard{shard}{ext}{sep}{query}'
+
+
+def get_shard_pool(shard):
+    """Returns this process's pool for one shard, migrating it on first use."""
+    database = shard_database(shard)
+    pool = _shard_pools.get(shard)
+    if pool is not None and pool.database == database and pool.pid == os.getpid():
+        return pool
+
+    with _pool_lock:
+        pool = _shard_pools.get(shard)
+        if pool is not None and pool.pid != os.getpid():
+            pool = None  # inherited across fork, see get_pool()
+        elif pool is not None and pool.database != database:
+            pool.close()
+            pool = None
+        if pool is None:
+            pool = ConnectionPool(database)
+            try:
+                ensure_schema(pool)
+            except Exception:
+                pool.close()
+                raise
+            _shard_pools[shard] = pool
+        return pool
+
 
-def get_db():
-    """Creates and returns a database connection."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+def close_pool():
+    """Close the current pools (e.g. before deleting the database files)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        for pool in _shard_pools.values():
+            if pool.pid == os.getpid():
+                pool.close()
+        _shard_pools.clear()
+        user_cache.clear()
+        shard_cache.clear()
+
+
+# user id -> shard number, or None for users whose data is in DATABASE
+shard_cache = LRUCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+_missing = object()
+
+
+def place_user(user_id):
+    """The shard a user is assigned to: their id modulo SHARDS."""
+    return user_id % SHARDS
+
+
+def get_user_shard(user_id):
+    """
+    Returns the shard holding the user's clients and invoices, from the
+    user_shards directory. None means DATABASE itself - sharding is off,
+    or the user predates it and has not been moved yet.
+    """
+    if not SHARDS:
+        return None
+    shard = shard_cache.get(user_id, _missing)
+    if shard is _missing:
+        conn = get_read_db()
+        row = conn.execute(
+            'SELECT shard FROM user_shards WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        conn.close()
+        shard = row['shard'] if row else None
+        shard_cache.set(user_id, shard)
+    return shard
+
+
+def get_shard_db(shard, readonly=False):
+    """
+    A connection to one shard (None for DATABASE): its writer, or a
+    query_only reader. conn.close() returns it.
+    """
+    pool = get_pool() if shard is None else get_shard_pool(shard)
+    return pool.readers.acquire() if readonly else pool.acquire()
+
+
+def get_db(user_id=None, readonly=False):
+    """
+    Returns a pooled database connection - the database's single writer
+    connection, or with readonly=True one of its query_only readers.
+    Pass the user_id whose clients, invoices or stats are read or written:
+    with sharding on, the connection is then to that user's shard, so
+    writes for users on different shards don't share a write lock.
+    Without one it is to DATABASE (users and the shard directory).
+    Inside a Flask app context a reader is reused for the whole request
+    and returned by close_db() at teardown. The writer is never kept for
+    the request: call conn.close() as soon as its transaction ends (or
+    use run_write), so other requests' writes don't wait on this one.
+    """
+    shard = get_user_shard(user_id) if user_id is not None else None
+    if not has_app_context():
+        return get_shard_db(shard, readonly)
+    
+    shard_dbs = g.setdefault('shard_dbs', {})
+    if readonly and shard in shard_dbs:
+        return shard_dbs[shard]
+    
+    start = time.perf_counter()
+    conn = get_shard_db(shard, readonly)
+    g.db_acquire_seconds = g.get('db_acquire_seconds', 0) + time.perf_counter() - start
+    if readonly:
+        conn.pinned = True
+        shard_dbs[shard] = conn
     return conn
 
 
+def get_read_db(user_id=None):
+    """get_db() for code that only reads: a query_only connection."""
+    return get_db(user_id, readonly=True)
+
+
+def close_db(exception=None):
+    """Return the app context's connections to their pools (teardown handler)."""
+    for conn in g.pop('shard_dbs', {}).values():
+        conn.pinned = False
+        conn.close()
+
+
+def is_busy(error):
+    """True for SQLITE_BUSY / SQLITE_LOCKED, i.e. worth retrying."""
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'locked' in str(error) or 'busy' in str(error)
+
+
+def retry_busy(transaction):
+    """
+    Call transaction(), retrying up to BUSY_RETRIES times while it fails
+    with SQLITE_BUSY. Waits are random up to an exponentially growing cap
+    (full jitter), so colliding writers don't retry in lockstep.
+    """
+    for attempt in range(BUSY_RETRIES + 1):
+        try:
+            return transaction()
+        except sqlite3.OperationalError as e:
+            if attempt == BUSY_RETRIES or not is_busy(e):
+                raise
+            time.sleep(random.uniform(0, BUSY_RETRY_MS * 2 ** attempt) / 1000)
+
+
+def run_write(user_id, write, immediate=False):
+    """
+    Run write(conn) as one transaction on the user's database (DATABASE
+    when user_id is None) and return its result; write must not commit.
+    It is retried while the database is busy, so it must be safe to
+    re-run. immediate=True takes the write lock before write's first
+    (possibly read-only) statement, for writes that check then modify.
+    With GROUP_COMMIT it runs on that database's writer thread and shares
+    a commit with other requests' writes, but its result or error still
+    comes back to this caller only.
+    """
+    if GROUP_COMMIT:
+        shard = get_user_shard(user_id) if user_id is not None else None
+        pool = get_pool() if shard is None else get_shard_pool(shard)
+        return pool.writer().submit(write)
+
+    def transaction():
+        conn = get_db(user_id)
+        try:
+            if immediate:
+                conn.execute('BEGIN IMMEDIATE')
+            result = write(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return result
+    return retry_busy(transaction)
+
+
+# ============ PASSWORDS ============
+
 def hash_password(password):
     """
     Hash a password using SHA-256 for secure storage.
@@ -32,13 +472,41 @@ def verify_password(stored_password, provided_password):
     return stored_password == hash_password(provided_password)
 
 
-def init_db():
-    """Initialize database tables with user authentication support."""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Users table - stores account information
-    cursor.execute('''
+# ============ SCHEMA MIGRATIONS ============
+
+# Recomputes every user's stats row from the base tables, in place so
+# columns it doesn't own (data_version) survive a rebuild
+USER_STATS_REBUILD_SQL = '''
+    INSERT INTO user_stats (user_id, total_clients, total_invoices, paid_total, unpaid_total)
+    SELECT
+        users.id,
+        (SELECT COUNT(*) FROM clients WHERE clients.user_id = users.id),
+        (SELECT COUNT(*) FROM invoices
+            JOIN clients ON invoices.client_id = clients.id
+            WHERE clients.user_id = users.id),
+        (SELECT COALESCE(SUM(amount), 0) FROM invoices
+            JOIN clients ON invoices.client_id = clients.id
+            WHERE clients.user_id = users.id AND invoices.status = 'paid'),
+        (SELECT COALESCE(SUM(amount), 0) FROM invoices
+            JOIN clients ON invoices.client_id = clients.id
+            WHERE clients.user_id = users.id AND invoices.status = 'unpaid')
+    FROM users
+    WHERE true
+    ON CONFLICT (user_id) DO UPDATE SET
+        total_clients = excluded.total_clients,
+        total_invoices = excluded.total_invoices,
+        paid_total = excluded.paid_total,
+        unpaid_total = excluded.unpaid_total
+'''
+
+# Each entry is one schema version: a list of statements applied together.
+# PRAGMA user_version records how many have run, so existing databases
+# upgrade in place. Never edit a released migration - append a new one.
+MIGRATIONS = [
+    # 1 - Base tables with user authentication support
+    [
+        # Users table - stores account information
+        '''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             email TEXT UNIQUE NOT NULL,
@@ -46,10 +514,9 @@ def init_db():
             name TEXT NOT NULL,
             created_at TEXT DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    # Clients table - linked to users via user_id
-    cursor.execute('''
+        ''',
+        # Clients table - linked to users via user_id
+        '''
         CREATE TABLE IF NOT EXISTS clients (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
@@ -59,10 +526,9 @@ def init_db():
             created_at TEXT DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
         )
-    ''')
-    
-    # Invoices table - linked to clients via client_id
-    cursor.execute('''
+        ''',
+        # Invoices table - linked to clients via client_id
+        '''
         CREATE TABLE IF NOT EXISTS invoices (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             client_id INTEGER NOT NULL,
@@ -73,56 +539,712 @@ def init_db():
             created_at TEXT DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE CASCADE
         )
-    ''')
-    
-    conn.commit()
-    conn.close()
+        ''',
+    ],
+    # 2 - Indexes matching the hot query shapes
+    [
+        # Client list, client counts and the users -> clients cascade
+        'CREATE INDEX IF NOT EXISTS idx_clients_user_created ON clients (user_id, created_at)',
+        # Invoice joins, status totals and the clients -> invoices cascade
+        'CREATE INDEX IF NOT EXISTS idx_invoices_client_status_created ON invoices (client_id, status, created_at)',
+    ],
+    # 3 - Per-user rollup backing /api/stats, maintained by triggers
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_clients INTEGER NOT NULL DEFAULT 0,
+            total_invoices INTEGER NOT NULL DEFAULT 0,
+            paid_total REAL NOT NULL DEFAULT 0,
+            unpaid_total REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_users_insert_stats
+        AFTER INSERT ON users
+        BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_clients_insert_stats
+        AFTER INSERT ON clients
+        BEGIN
+            UPDATE user_stats SET total_clients = total_clients + 1
+            WHERE user_id = NEW.user_id;
+        END
+        ''',
+        # Remove the client's invoices while the client row still exists,
+        # so the invoice triggers can still resolve the owning user
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_clients_delete_invoices
+        BEFORE DELETE ON clients
+        BEGIN
+            DELETE FROM invoices WHERE client_id = OLD.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_clients_delete_stats
+        AFTER DELETE ON clients
+        BEGIN
+            UPDATE user_stats SET total_clients = total_clients - 1
+            WHERE user_id = OLD.user_id;
+        END
+        ''',
+        # Moving a client to another user moves its invoices' totals too
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_clients_reassign_stats
+        AFTER UPDATE OF user_id ON clients
+        WHEN OLD.user_id IS NOT NEW.user_id
+        BEGIN
+            UPDATE user_stats SET
+                total_clients = total_clients - 1,
+                total_invoices = total_invoices - (SELECT COUNT(*) FROM invoices WHERE client_id = OLD.id),
+                paid_total = paid_total - (SELECT COALESCE(SUM(amount), 0) FROM invoices WHERE client_id = OLD.id AND status = 'paid'),
+                unpaid_total = unpaid_total - (SELECT COALESCE(SUM(amount), 0) FROM invoices WHERE client_id = OLD.id AND status = 'unpaid')
+            WHERE user_id = OLD.user_id;
+            UPDATE user_stats SET
+                total_clients = total_clients + 1,
+                total_invoices = total_invoices + (SELECT COUNT(*) FROM invoices WHERE client_id = NEW.id),
+                paid_total = paid_total + (SELECT COALESCE(SUM(amount), 0) FROM invoices WHERE client_id = NEW.id AND status = 'paid'),
+                unpaid_total = unpaid_total + (SELECT COALESCE(SUM(amount), 0) FROM invoices WHERE client_id = NEW.id AND status = 'unpaid')
+            WHERE user_id = NEW.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_insert_stats
+        AFTER INSERT ON invoices
+        BEGIN
+            UPDATE user_stats SET
+                total_invoices = total_invoices + 1,
+                paid_total = paid_total + (CASE WHEN NEW.status = 'paid' THEN NEW.amount ELSE 0 END),
+                unpaid_total = unpaid_total + (CASE WHEN NEW.status = 'unpaid' THEN NEW.amount ELSE 0 END)
+            WHERE user_id = (SELECT user_id FROM clients WHERE id = NEW.client_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_delete_stats
+        AFTER DELETE ON invoices
+        BEGIN
+            UPDATE user_stats SET
+                total_invoices = total_invoices - 1,
+                paid_total = paid_total - (CASE WHEN OLD.status = 'paid' THEN OLD.amount ELSE 0 END),
+                unpaid_total = unpaid_total - (CASE WHEN OLD.status = 'unpaid' THEN OLD.amount ELSE 0 END)
+            WHERE user_id = (SELECT user_id FROM clients WHERE id = OLD.client_id);
+        END
+        ''',
+        # Covers amount edits, status flips and moving an invoice between clients
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_update_stats
+        AFTER UPDATE OF client_id, amount, status ON invoices
+        BEGIN
+            UPDATE user_stats SET
+                total_invoices = total_invoices - 1,
+                paid_total = paid_total - (CASE WHEN OLD.status = 'paid' THEN OLD.amount ELSE 0 END),
+                unpaid_total = unpaid_total - (CASE WHEN OLD.status = 'unpaid' THEN OLD.amount ELSE 0 END)
+            WHERE user_id = (SELECT user_id FROM clients WHERE id = OLD.client_id);
+            UPDATE user_stats SET
+                total_invoices = total_invoices + 1,
+                paid_total = paid_total + (CASE WHEN NEW.status = 'paid' THEN NEW.amount ELSE 0 END),
+                unpaid_total = unpaid_total + (CASE WHEN NEW.status = 'unpaid' THEN NEW.amount ELSE 0 END)
+            WHERE user_id = (SELECT user_id FROM clients WHERE id = NEW.client_id);
+        END
+        ''',
+        # Backfill from existing data
+        'DELETE FROM user_stats',
+        USER_STATS_REBUILD_SQL,
+    ],
+    # 4 - Due date range filters on the invoice list
+    [
+        'CREATE INDEX IF NOT EXISTS idx_invoices_client_due ON invoices (client_id, due_date)',
+    ],
+    # 5 - Per-user data version for ETags, bumped on every client/invoice write
+    [
+        'ALTER TABLE user_stats ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_clients_insert_version
+        AFTER INSERT ON clients
+        BEGIN
+            UPDATE user_stats SET data_version = data_version + 1
+            WHERE user_id = NEW.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_clients_update_version
+        AFTER UPDATE ON clients
+        BEGIN
+            UPDATE user_stats SET data_version = data_version + 1
+            WHERE user_id IN (OLD.user_id, NEW.user_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_clients_delete_version
+        AFTER DELETE ON clients
+        BEGIN
+            UPDATE user_stats SET data_version = data_version + 1
+            WHERE user_id = OLD.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_insert_version
+        AFTER INSERT ON invoices
+        BEGIN
+            UPDATE user_stats SET data_version = data_version + 1
+            WHERE user_id = (SELECT user_id FROM clients WHERE id = NEW.client_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_update_version
+        AFTER UPDATE ON invoices
+        BEGIN
+            UPDATE user_stats SET data_version = data_version + 1
+            WHERE user_id IN (
+                SELECT user_id FROM clients WHERE id IN (OLD.client_id, NEW.client_id)
+            );
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_delete_version
+        AFTER DELETE ON invoices
+        BEGIN
+            UPDATE user_stats SET data_version = data_version + 1
+            WHERE user_id = (SELECT user_id FROM clients WHERE id = OLD.client_id);
+        END
+        ''',
+    ],
+    # 6 - Invoices carry their owner's user_id, so invoice reads and
+    #     ownership checks are single-table index range scans
+    [
+        'ALTER TABLE invoices ADD COLUMN user_id INTEGER REFERENCES users (id)',
+        '''
+        UPDATE invoices SET user_id = (
+            SELECT user_id FROM clients WHERE clients.id = invoices.client_id
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_invoices_user_status_created ON invoices (user_id, status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_invoices_user_created ON invoices (user_id, created_at)',
+        # Inserts normally supply user_id; correct any that don't match the client
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_insert_user
+        AFTER INSERT ON invoices
+        WHEN NEW.user_id IS NOT (SELECT user_id FROM clients WHERE id = NEW.client_id)
+        BEGIN
+            UPDATE invoices SET user_id = (SELECT user_id FROM clients WHERE id = NEW.client_id)
+            WHERE id = NEW.id;
+        END
+        ''',
+        # Moving an invoice to another client (or editing user_id directly)
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_update_user
+        AFTER UPDATE OF client_id, user_id ON invoices
+        WHEN NEW.user_id IS NOT (SELECT user_id FROM clients WHERE id = NEW.client_id)
+        BEGIN
+            UPDATE invoices SET user_id = (SELECT user_id FROM clients WHERE id = NEW.client_id)
+            WHERE id = NEW.id;
+        END
+        ''',
+        # Reassigning a client to another user moves its invoices too
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_clients_reassign_invoices
+        AFTER UPDATE OF user_id ON clients
+        WHEN NEW.user_id IS NOT OLD.user_id
+        BEGIN
+            UPDATE invoices SET user_id = NEW.user_id WHERE client_id = NEW.id;
+        END
+        ''',
+    ],
+    # 7 - Which shard holds each user's data; only read in DATABASE itself
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS user_shards (
+            user_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+        ''',
+    ],
+    # 8 - Change versions and tombstones for /api/sync: every client and
+    #     invoice write stamps the row with the data_version it bumped to,
+    #     and a delete leaves a tombstone at that version instead
+    [
+        'ALTER TABLE clients ADD COLUMN change_version INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE invoices ADD COLUMN change_version INTEGER NOT NULL DEFAULT 0',
+        # Syncs from below a user's floor get a full snapshot (see prune_tombstones)
+        'ALTER TABLE user_stats ADD COLUMN sync_floor INTEGER NOT NULL DEFAULT 0',
+        '''
+        CREATE TABLE IF NOT EXISTS tombstones (
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL CHECK (kind IN ('client', 'invoice')),
+            row_id INTEGER NOT NULL,
+            change_version INTEGER NOT NULL,
+            deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, kind, row_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_tombstones_user_version ON tombstones (user_id, change_version)',
+        'CREATE INDEX IF NOT EXISTS idx_clients_user_version ON clients (user_id, change_version)',
+        'CREATE INDEX IF NOT EXISTS idx_invoices_user_version ON invoices (user_id, change_version)',
+        # Replaced by the triggers below, which also stamp the row
+        'DROP TRIGGER IF EXISTS trg_clients_insert_version',
+        'DROP TRIGGER IF EXISTS trg_clients_update_version',
+        'DROP TRIGGER IF EXISTS trg_clients_delete_version',
+        'DROP TRIGGER IF EXISTS trg_invoices_insert_version',
+        'DROP TRIGGER IF EXISTS trg_invoices_update_version',
+        'DROP TRIGGER IF EXISTS trg_invoices_delete_version',
+        # Existing rows count as changed at the user's current version
+        '''
+        UPDATE clients SET change_version = COALESCE(
+            (SELECT data_version FROM user_stats WHERE user_stats.user_id = clients.user_id), 0
+        )
+        ''',
+        '''
+        UPDATE invoices SET change_version = COALESCE(
+            (SELECT data_version FROM user_stats WHERE user_stats.user_id = invoices.user_id), 0
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_clients_insert_change
+        AFTER INSERT ON clients
+        BEGIN
+            UPDATE user_stats SET data_version = data_version + 1
+            WHERE user_id = NEW.user_id;
+            UPDATE clients SET change_version = COALESCE(
+                (SELECT data_version FROM user_stats WHERE user_id = NEW.user_id), 0
+            ) WHERE id = NEW.id;
+        END
+        ''',
+        # Skips the stamping UPDATE itself, should recursive_triggers be on
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_clients_update_change
+        AFTER UPDATE ON clients
+        WHEN NEW.change_version = OLD.change_version
+        BEGIN
+            UPDATE user_stats SET data_version = data_version + 1
+            WHERE user_id IN (OLD.user_id, NEW.user_id);
+            UPDATE clients SET change_version = COALESCE(
+                (SELECT data_version FROM user_stats WHERE user_id = NEW.user_id), 0
+            ) WHERE id = NEW.id;
+            -- Handed to another user: gone, as far as the old owner can tell
+            INSERT OR REPLACE INTO tombstones (user_id, kind, row_id, change_version)
+            SELECT OLD.user_id, 'client', OLD.id, data_version FROM user_stats
+            WHERE user_id = OLD.user_id AND OLD.user_id IS NOT NEW.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_clients_delete_change
+        AFTER DELETE ON clients
+        BEGIN
+            UPDATE user_stats SET data_version = data_version + 1
+            WHERE user_id = OLD.user_id;
+            INSERT OR REPLACE INTO tombstones (user_id, kind, row_id, change_version)
+            SELECT OLD.user_id, 'client', OLD.id, data_version FROM user_stats
+            WHERE user_id = OLD.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_insert_change
+        AFTER INSERT ON invoices
+        BEGIN
+            UPDATE user_stats SET data_version = data_version + 1
+            WHERE user_id = NEW.user_id;
+            UPDATE invoices SET change_version = COALESCE(
+                (SELECT data_version FROM user_stats WHERE user_id = NEW.user_id), 0
+            ) WHERE id = NEW.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_update_change
+        AFTER UPDATE ON invoices
+        WHEN NEW.change_version = OLD.change_version
+        BEGIN
+            UPDATE user_stats SET data_version = data_version + 1
+            WHERE user_id IN (OLD.user_id, NEW.user_id);
+            UPDATE invoices SET change_version = COALESCE(
+                (SELECT data_version FROM user_stats WHERE user_id = NEW.user_id), 0
+            ) WHERE id = NEW.id;
+            INSERT OR REPLACE INTO tombstones (user_id, kind, row_id, change_version)
+            SELECT OLD.user_id, 'invoice', OLD.id, data_version FROM user_stats
+            WHERE user_id = OLD.user_id AND OLD.user_id IS NOT NEW.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_delete_change
+        AFTER DELETE ON invoices
+        BEGIN
+            UPDATE user_stats SET data_version = data_version + 1
+            WHERE user_id = OLD.user_id;
+            INSERT OR REPLACE INTO tombstones (user_id, kind, row_id, change_version)
+            SELECT OLD.user_id, 'invoice', OLD.id, data_version FROM user_stats
+            WHERE user_id = OLD.user_id;
+        END
+        ''',
+        # A deleted account's cascaded deletes must not leave tombstones behind
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_users_delete_tombstones
+        AFTER DELETE ON users
+        BEGIN
+            DELETE FROM tombstones WHERE user_id = OLD.id;
+        END
+        ''',
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn):
+    """Read the schema version stored in PRAGMA user_version."""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Apply any pending migrations, each in its own transaction.
+    Returns the list of versions that were applied.
+    """
+    applied = []
+    for version in range(get_schema_version(conn) + 1, SCHEMA_VERSION + 1):
+        # IMMEDIATE takes the write lock up front, so concurrent
+        # processes can't apply the same migration twice
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in MIGRATIONS[version - 1]:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def ensure_schema(pool):
+    """
+    Migrate the pool's database if PRAGMA user_version is behind.
+    Runs once per pool; when the schema is current it costs one PRAGMA read.
+    """
+    conn = pool.acquire()
+    try:
+        if get_schema_version(conn) < SCHEMA_VERSION:
+            migrate(conn)
+    finally:
+        pool.release(conn)
+
+
+def init_db():
+    """Initialize database tables, upgrading an existing database in place."""
+    conn = get_db()
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+    for shard in range(SHARDS):
+        get_shard_pool(shard)  # migrated when the pool is created
     print("Database initialized!")
 
 
+def rebuild_user_stats():
+    """
+    Recompute the user_stats rollup from scratch, in DATABASE and every shard.
+    Returns the ids of users whose stored totals had drifted; their
+    data_version is bumped so cached copies of the old totals go stale.
+    """
+    drifted = []
+    for shard in [None, *range(SHARDS)]:
+        drifted.extend(rebuild_database_stats(get_shard_db(shard)))
+    return drifted
+
+
+def rebuild_database_stats(conn):
+    """Rebuild user_stats in one database and release conn; returns drifted user ids."""
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        before = {row['user_id']: tuple(row) for row in conn.execute('SELECT * FROM user_stats')}
+        conn.execute('DELETE FROM user_stats WHERE user_id NOT IN (SELECT id FROM users)')
+        conn.execute(USER_STATS_REBUILD_SQL)
+        after = {row['user_id']: tuple(row) for row in conn.execute('SELECT * FROM user_stats')}
+        
+        drifted = []
+        for user_id, row in after.items():
+            old = before.get(user_id)
+            # Compare money with a tolerance - float sums drift in the last bits
+            if old is None or any(abs(a - b) > 0.005 for a, b in zip(old, row)):
+                drifted.append(user_id)
+        
+        conn.executemany(
+            'UPDATE user_stats SET data_version = data_version + 1 WHERE user_id = ?',
+            [(user_id,) for user_id in drifted]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    return drifted
+
+
+def get_data_version(conn, user_id):
+    """
+    Returns the user's data version, bumped by triggers on every client or
+    invoice write, or None if the user has no stats row.
+    """
+    row = conn.execute(
+        'SELECT data_version FROM user_stats WHERE user_id = ?',
+        (user_id,)
+    ).fetchone()
+    return row['data_version'] if row else None
+
+
+def prune_tombstones(days=None):
+    """
+    Delete tombstones older than days (default TOMBSTONE_RETENTION_DAYS) in
+    DATABASE and every shard. Returns how many were deleted.
+    """
+    if days is None:
+        days = TOMBSTONE_RETENTION_DAYS
+    return sum(prune_database_tombstones(get_shard_db(shard), days) for shard in [None, *range(SHARDS)])
+
+
+def prune_database_tombstones(conn, days):
+    """
+    Prune one database's tombstones and release conn. Each affected user's
+    sync_floor is raised to the newest pruned version, so /api/sync sends a
+    full snapshot to anyone who could have missed one of them.
+    """
+    cutoff = f'-{int(days)} days'
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('''
+            UPDATE user_stats SET sync_floor = MAX(sync_floor, pruned.version)
+            FROM (
+                SELECT user_id, MAX(change_version) AS version FROM tombstones
+                WHERE deleted_at < datetime('now', ?)
+                GROUP BY user_id
+            ) AS pruned
+            WHERE user_stats.user_id = pruned.user_id
+        ''', (cutoff,))
+        deleted = conn.execute(
+            "DELETE FROM tombstones WHERE deleted_at < datetime('now', ?)",
+            (cutoff,)
+        ).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    return deleted
+
+
+# ============ USERS ============
+
 def create_user(email, password, name):
     """
     Create a new user account.
     Returns user_id if successful, None if email already exists.
     """
-    conn = get_db()
-    try:
-        hashed_pw = hash_password(password)
-        cursor = conn.execute(
+    hashed_pw = hash_password(password)
+    
+    def write(conn):
+        user_id = conn.execute(
             'INSERT INTO users (email, password, name) VALUES (?, ?, ?)',
             (email, hashed_pw, name)
-        )
-        conn.commit()
-        user_id = cursor.lastrowid
-        conn.close()
+        ).lastrowid
+        if SHARDS:
+            conn.execute(
+                'INSERT INTO user_shards (user_id, shard) VALUES (?, ?)',
+                (user_id, place_user(user_id))
+            )
         return user_id
+    
+    try:
+        user_id = run_write(None, write)
     except sqlite3.IntegrityError:
         # Email already exists
-        conn.close()
         return None
+    
+    if SHARDS:
+        try:
+            add_user_to_shard(user_id, place_user(user_id))
+        except Exception:
+            # Don't leave an account whose shard can't hold its clients
+            run_write(None, lambda conn: conn.execute('DELETE FROM users WHERE id = ?', (user_id,)))
+            invalidate_user(user_id, email)
+            raise
+    return user_id
+
+
+def add_user_to_shard(user_id, shard):
+    """
+    Copy a user row from DATABASE into a shard, which keeps its own
+    users table for foreign keys and the user_stats triggers.
+    """
+    conn = get_read_db()
+    user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    conn.close()
+    shard_conn = get_shard_db(shard)
+    try:
+        shard_conn.execute(
+            'INSERT OR IGNORE INTO users (id, email, password, name, created_at) VALUES (?, ?, ?, ?, ?)',
+            (user['id'], user['email'], user['password'], user['name'], user['created_at'])
+        )
+        shard_conn.commit()
+    finally:
+        shard_conn.close()
+
+
+# In-process cache of user rows, so /api/me and login skip the database
+user_cache = LRUCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def cache_user(user):
+    """Store a user row under both its id and its email."""
+    if user is not None:
+        user_cache.set(('id', user['id']), user)
+        user_cache.set(('email', user['email']), user)
+
+
+def invalidate_user(user_id, email=None):
+    """Forget cached rows for a user - call whenever account data changes."""
+    user = user_cache.pop(('id', user_id))
+    emails = {email, user['email'] if user is not None else None}
+    user_cache.delete(*[('email', e) for e in emails if e])
 
 
 def get_user_by_email(email):
     """Find a user by email address."""
-    conn = get_db()
+    user = user_cache.get(('email', email))
+    if user is not None:
+        return user
+    
+    conn = get_read_db()
     user = conn.execute(
         'SELECT * FROM users WHERE email = ?',
         (email,)
     ).fetchone()
     conn.close()
+    cache_user(user)
     return user
 
 
 def get_user_by_id(user_id):
     """Find a user by ID."""
-    conn = get_db()
+    user = user_cache.get(('id', user_id))
+    if user is not None:
+        return user
+    
+    conn = get_read_db()
     user = conn.execute(
         'SELECT * FROM users WHERE id = ?',
         (user_id,)
     ).fetchone()
     conn.close()
+    cache_user(user)
     return user
 
 
+# ============ CLIENTS & INVOICES ============
+# Every write is a single statement with the ownership check in its WHERE
+# clause (or INSERT ... SELECT), so there is no SELECT-then-write round
+# trip. A rowcount of 0 means "not found or not owned". Statements run
+# through run_write(), so they join a group commit when that is on.
+
+def write_touches_row(user_id, sql, parameters):
+    """Run one write statement on the user's database; True if it matched a row."""
+    return run_write(user_id, lambda conn: conn.execute(sql, parameters).rowcount > 0)
+
+
+def insert_client(user_id, name, email, phone):
+    """Create a client for the user and return its id."""
+    def write(conn):
+        return conn.execute(
+            'INSERT INTO clients (user_id, name, email, phone) VALUES (?, ?, ?, ?)',
+            (user_id, name, email, phone)
+        ).lastrowid
+    return run_write(user_id, write)
+
+
+def update_owned_client(user_id, client_id, name, email, phone):
+    """Update a client the user owns. Returns False if not found or not owned."""
+    return write_touches_row(
+        user_id,
+        'UPDATE clients SET name = ?, email = ?, phone = ? WHERE id = ? AND user_id = ?',
+        (name, email, phone, client_id, user_id)
+    )
+
+
+def delete_owned_client(user_id, client_id):
+    """
+    Delete a client the user owns; its invoices go with it (trigger and
+    foreign key cascade). Returns False if not found or not owned.
+    """
+    return write_touches_row(
+        user_id,
+        'DELETE FROM clients WHERE id = ? AND user_id = ?',
+        (client_id, user_id)
+    )
+
+
+def insert_owned_invoice(user_id, client_id, amount, description, due_date):
+    """
+    Create an invoice for one of the user's clients.
+    Returns the new invoice id, or None if the client is not the user's.
+    """
+    def write(conn):
+        cursor = conn.execute('''
+            INSERT INTO invoices (client_id, user_id, amount, description, due_date)
+            SELECT id, user_id, ?, ?, ? FROM clients WHERE id = ? AND user_id = ?
+        ''', (amount, description, due_date, client_id, user_id))
+        return cursor.lastrowid if cursor.rowcount > 0 else None
+    return run_write(user_id, write)
+
+
+def update_owned_invoice(user_id, invoice_id, amount, description, due_date):
+    """Update an invoice the user owns. Returns False if not found or not owned."""
+    return write_touches_row(
+        user_id,
+        'UPDATE invoices SET amount = ?, description = ?, due_date = ? '
+        'WHERE id = ? AND user_id = ?',
+        (amount, description, due_date, invoice_id, user_id)
+    )
+
+
+def set_owned_invoice_status(user_id, invoice_id, status):
+    """Set the status of an invoice the user owns. Returns False if not found or not owned."""
+    return write_touches_row(
+        user_id,
+        'UPDATE invoices SET status = ? WHERE id = ? AND user_id = ?',
+        (status, invoice_id, user_id)
+    )
+
+
+def delete_owned_invoice(user_id, invoice_id):
+    """Delete an invoice the user owns. Returns False if not found or not owned."""
+    return write_touches_row(
+        user_id,
+        'DELETE FROM invoices WHERE id = ? AND user_id = ?',
+        (invoice_id, user_id)
+    )
+
 if __name__ == '__main__':
+    import sys
+    
     init_db()
+    
+    # python3 models.py rebuild-stats - recompute user_stats and report drift
+    if sys.argv[1:] == ['rebuild-stats']:
+        drifted = rebuild_user_stats()
+        print(f"user_stats rebuilt, {len(drifted)} drifted user(s): {drifted}")
+    
+    # python3 models.py prune-tombstones [days] - drop old /api/sync tombstones
+    elif sys.argv[1:2] == ['prune-tombstones']:
+        days = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        print(f"{prune_tombstones(days)} tombstone(s) pruned")
@@ -0,0 +1,208 @@
+"""
+shards.py - Offline shard maintenance for FreelancePay Tracker
+
+Moves users' clients and invoices between DATABASE and its DB_SHARDS shard
+files, e.g. to spread an existing database over shards, or to re-spread
+them after changing DB_SHARDS. Run it with the app stopped.
+
+A move copies the user's rows into the target, points the user_shards
+directory at it, then deletes them from the source, so an interrupted run
+loses nothing and can simply be repeated. The target assigns new client
+and invoice ids; the user's data_version is bumped past both copies so
+cached ETags go stale, and the next /api/sync returns a full snapshot.
+
+Usage:
+    DB_SHARDS=4 python3 shards.py status
+    DB_SHARDS=4 python3 shards.py rebalance     # every user to user_id % 4
+    DB_SHARDS=4 python3 shards.py move 42 3     # or "main" for DATABASE
+"""
+
+import argparse
+import json
+
+import models
+
+CLIENT_COLUMNS = ('user_id', 'name', 'email', 'phone', 'created_at')
+INVOICE_COLUMNS = ('user_id', 'amount', 'description', 'status', 'due_date', 'created_at')
+
+
+def copy_user(source, target, user_id):
+    """
+    Copy a user's rows from source to target in one transaction, replacing
+    any partial copy left by an earlier run. Returns (clients, invoices).
+    """
+    user = source.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    version = models.get_data_version(source, user_id) or 0
+
+    target.execute('BEGIN IMMEDIATE')
+    try:
+        target.execute('DELETE FROM clients WHERE user_id = ?', (user_id,))
+        target.execute(
+            'INSERT OR IGNORE INTO users (id, email, password, name, created_at) VALUES (?, ?, ?, ?, ?)',
+            (user['id'], user['email'], user['password'], user['name'], user['created_at'])
+        )
+
+        client_ids = {}  # source id -> target id
+        for client in source.execute('SELECT * FROM clients WHERE user_id = ? ORDER BY id', (user_id,)):
+            cursor = target.execute(
+                f"INSERT INTO clients ({', '.join(CLIENT_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+                [client[column] for column in CLIENT_COLUMNS]
+            )
+            client_ids[client['id']] = cursor.lastrowid
+
+        invoices = source.execute('SELECT * FROM invoices WHERE user_id = ? ORDER BY id', (user_id,)).fetchall()
+        target.executemany(
+            f"INSERT INTO invoices (client_id, {', '.join(INVOICE_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(client_ids[invoice['client_id']], *[invoice[column] for column in INVOICE_COLUMNS])
+             for invoice in invoices]
+        )
+
+        # The triggers rebuilt the totals; move the version past both copies,
+        # and make /api/sync resend everything, as the ids have changed
+        target.execute('''
+            UPDATE user_stats SET data_version = MAX(data_version, ?) + 1,
+                sync_floor = MAX(data_version, ?) + 1
+            WHERE user_id = ?
+        ''', (version, version, user_id))
+        target.execute('DELETE FROM tombstones WHERE user_id = ?', (user_id,))
+        target.commit()
+    except Exception:
+        target.rollback()
+        raise
+
+    return len(client_ids), len(invoices)
+
+
+def set_user_shard(directory, user_id, shard):
+    """Point the directory (a DATABASE connection) at shard, None for DATABASE."""
+    if shard is None:
+        directory.execute('DELETE FROM user_shards WHERE user_id = ?', (user_id,))
+    else:
+        directory.execute('''
+            INSERT INTO user_shards (user_id, shard) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET shard = excluded.shard
+        ''', (user_id, shard))
+    directory.commit()
+    models.shard_cache.delete(user_id)
+
+
+def delete_user_rows(conn, user_id, keep_user):
+    """Remove a user's clients (and, by trigger, invoices) from one database."""
+    conn.execute('DELETE FROM clients WHERE user_id = ?', (user_id,))
+    if not keep_user:
+        conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
+    conn.commit()
+
+
+def move_user(user_id, shard):
+    """
+    Move a user's data to shard (None for DATABASE).
+    Returns (clients, invoices) moved, or None if it is already there.
+    """
+    current = models.get_user_shard(user_id)
+    if current == shard:
+        return None
+
+    source = models.get_shard_db(current)
+    target = models.get_shard_db(shard)
+    # DATABASE has a single writer connection, which may be source or target
+    directory = source if current is None else target if shard is None else models.get_db()
+    try:
+        moved = copy_user(source, target, user_id)
+        set_user_shard(directory, user_id, shard)
+        # DATABASE keeps every account row; shards only hold copies
+        delete_user_rows(source, user_id, keep_user=current is None)
+    finally:
+        for conn in {source, target, directory}:
+            conn.close()
+    return moved
+
+
+def purge_strays(shard):
+    """
+    Delete rows a shard holds for users the directory places elsewhere,
+    left by a move interrupted after the switch. Returns their user ids.
+    """
+    conn = models.get_shard_db(shard)
+    try:
+        users = [row['user_id'] for row in conn.execute('SELECT DISTINCT user_id FROM clients')]
+        strays = [user_id for user_id in users if models.get_user_shard(user_id) != shard]
+        for user_id in strays:
+            delete_user_rows(conn, user_id, keep_user=shard is None)
+    finally:
+        conn.close()
+    return strays
+
+
+def all_user_ids():
+    """Every account id, from DATABASE."""
+    conn = models.get_read_db()
+    try:
+        return [row['id'] for row in conn.execute('SELECT id FROM users ORDER BY id')]
+    finally:
+        conn.close()
+
+
+def rebalance():
+    """Move every user to place_user(user_id) under the current SHARDS."""
+    report = {'users_moved': 0, 'clients_moved': 0, 'invoices_moved': 0}
+    for user_id in all_user_ids():
+        moved = move_user(user_id, models.place_user(user_id))
+        if moved is not None:
+            report['users_moved'] += 1
+            report['clients_moved'] += moved[0]
+            report['invoices_moved'] += moved[1]
+    report['strays_purged'] = sum(len(purge_strays(shard)) for shard in [None, *range(models.SHARDS)])
+    return report
+
+
+def status():
+    """Users, clients and invoices held by DATABASE and each shard."""
+    placements = [models.get_user_shard(user_id) for user_id in all_user_ids()]
+    report = {}
+    for shard in [None, *range(models.SHARDS)]:
+        conn = models.get_shard_db(shard, readonly=True)
+        try:
+            report['main' if shard is None else shard] = {
+                'users': placements.count(shard),
+                'clients': conn.execute('SELECT COUNT(*) FROM clients').fetchone()[0],
+                'invoices': conn.execute('SELECT COUNT(*) FROM invoices').fetchone()[0],
+            }
+        finally:
+            conn.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline shard maintenance (stop the app first)')
+    parser.add_argument('--database', default=models.DATABASE)
+    parser.add_argument('--shards', type=int, default=models.SHARDS, help='defaults to DB_SHARDS')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help='row counts per database')
+    commands.add_parser('rebalance', help='move every user to user_id %% shards')
+    move = commands.add_parser('move', help='move one user')
+    move.add_argument('user_id', type=int)
+    move.add_argument('shard', help='shard number, or "main"')
+    args = parser.parse_args()
+
+    if args.shards < 1:
+        parser.error('set DB_SHARDS or --shards')
+    models.DATABASE = args.database
+    models.SHARDS = args.shards
+    models.init_db()
+
+    if args.command == 'status':
+        report = status()
+    elif args.command == 'rebalance':
+        report = rebalance()
+    else:
+        shard = None if args.shard == 'main' else int(args.shard)
+        if shard is not None and not 0 <= shard < args.shards:
+            parser.error(f'shard must be main or 0-{args.shards - 1}')
+        clients, invoices = move_user(args.user_id, shard) or (0, 0)
+        report = {'clients_moved': clients, 'invoices_moved': invoices}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+slowlog.py - Slow-query log for FreelancePay Tracker
+
+SlowQueryLog is a models.statement_hooks entry. Statements slower than the
+threshold are written as one JSON object per line, to a rotating file or to
+stderr, with the EXPLAIN QUERY PLAN captured the first time each
+normalized statement is seen.
+"""
+
+import json
+import logging
+import logging.handlers
+import re
+import sqlite3
+import sys
+import threading
+
+from flask import has_request_context, request
+
+# Only these statements have a query plan worth capturing
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """Collapse whitespace and replace literals with ? so equal shapes match."""
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+def parameter_shape(parameters):
+    """Type names of the bound parameters, without their values."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+
+class SlowQueryLog:
+    """Log statements slower than threshold_ms, with their query plans."""
+
+    def __init__(self, threshold_ms, path=None, max_bytes=10 * 1024 * 1024, backups=5,
+                 stream=None):
+        self.threshold = threshold_ms / 1000
+        if path:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups
+            )
+        else:
+            handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.handler = handler
+        self.logger = logging.Logger('slow_queries')
+        self.logger.addHandler(handler)
+        self._explained = set()  # normalized statements already planned
+        self._lock = threading.Lock()
+
+    def __call__(self, conn, sql, parameters, seconds, many=False):
+        if seconds < self.threshold:
+            return
+
+        shape = normalize_sql(sql)
+        entry = {
+            'sql': shape,
+            'duration_ms': round(seconds * 1000, 3),
+            'route': request.url_rule.rule if has_request_context() and request.url_rule else None,
+        }
+        if many:
+            rows = parameters if isinstance(parameters, (list, tuple)) else None
+            entry['rows'] = len(rows) if rows is not None else None
+            entry['params'] = parameter_shape(rows[0]) if rows else None
+        else:
+            rows = [parameters]
+            entry['params'] = parameter_shape(parameters)
+
+        with self._lock:
+            first_sighting = shape not in self._explained
+            self._explained.add(shape)
+        if first_sighting and rows and shape.upper().startswith(EXPLAINABLE):
+            entry['plan'] = self.explain(conn, sql, rows[0])
+
+        self.logger.warning(json.dumps(entry))
+
+    def explain(self, conn, sql, parameters):
+        """Query plan details, run past the timed execute() so no hook fires."""
+        try:
+            plan = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, parameters)
+            return [row[3] for row in plan]
+        except sqlite3.Error as e:
+            return [f'EXPLAIN failed: {e}']
+
+    def close(self):
+        """Flush and close the log file or stream handler."""
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
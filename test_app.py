@@ -6,10 +6,65 @@ Run with: python3 test_app.py
 """
 
 import unittest
+import base64
+import cProfile
+import csv
+import io
 import json
 import os
-from app import app
+import pstats
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import has_request_context
+from app import app, create_app, encode_cursor
+import app as app_module
+import bench
 import models
+import shards
+from cache import LRUCache
+from groupcommit import GroupCommitWriter
+from metrics import MetricsRegistry
+from slowlog import SlowQueryLog, normalize_sql
+
+# Tests run against a shared-cache in-memory database unless TEST_DATABASE=file.
+# Names include the pid, so parallel test processes never share a database.
+TEST_DATABASE_MODE = os.environ.get('TEST_DATABASE', 'memory')
+if TEST_DATABASE_MODE == 'file':
+    TEST_DATABASE = f'test_freelance-{os.getpid()}.db'
+else:
+    TEST_DATABASE = f'file:test_freelance-{os.getpid()}?mode=memory&cache=shared'
+
+_schema_template = None
+
+
+def open_test_database():
+    """
+    Fill the (empty) test database with the migrated schema and return a
+    connection that keeps an in-memory database alive until it is closed.
+    The migrations run once per process into a template that each test
+    copies with the backup API, so tests skip the DDL.
+    """
+    global _schema_template
+    if _schema_template is None:
+        _schema_template = sqlite3.connect(':memory:')
+        models.migrate(_schema_template)
+    keeper = sqlite3.connect(TEST_DATABASE, uri=True)
+    _schema_template.backup(keeper)
+    return keeper
+
+
+def remove_test_database():
+    """Delete the test database files (file mode only)."""
+    if TEST_DATABASE_MODE == 'file':
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(TEST_DATABASE + suffix):
+                os.remove(TEST_DATABASE + suffix)
 
 
 class FreelanceTrackerTestCase(unittest.TestCase):
@@ -17,23 +72,37 @@ class FreelanceTrackerTestCase(unittest.TestCase):
     
     def setUp(self):
         """Set up test environment before each test"""
-        # Use separate test database
-        models.DATABASE = 'test_freelance.db'
+        # Use separate test database, copied from the pre-migrated template
+        models.DATABASE = TEST_DATABASE
+        self.keeper = open_test_database()
         
         app.config['TESTING'] = True
         self.client = app.test_client()
         
-        # Initialize fresh database for each test
+        # Schema is already current, so this only checks the version
         models.init_db()
         
+        # All data routes require a session, so log in as a test user
+        self.client.post(
+            '/api/register',
+            data=json.dumps({
+                'name': 'Test User',
+                'email': 'tester@example.com',
+                'password': 'secret123'
+            }),
+            content_type='application/json'
+        )
+        
         print(f"\n{'='*60}")
         print(f"Running: {self._testMethodName}")
         print(f"{'='*60}")
     
     def tearDown(self):
         """Clean up after each test"""
-        if os.path.exists('test_freelance.db'):
-            os.remove('test_freelance.db')
+        # Closing every connection drops an in-memory database; files are removed
+        models.close_pool()
+        self.keeper.close()
+        remove_test_database()
     
     # ============ STATS ENDPOINT TESTS ============
     
@@ -432,6 +501,2268 @@ class FreelanceTrackerTestCase(unittest.TestCase):
         
         print("✓ Deleting client cascades to invoices (as expected)")
 
+    
+    # ============ CONNECTION POOL TESTS ============
+    
+    def test_pool_follows_database_override(self):
+        """Test the pool points at the overridden test database"""
+        self.assertEqual(models.get_pool().database, TEST_DATABASE)
+        
+        print("✓ Pool uses models.DATABASE override")
+    
+    def test_pool_reuses_connections_across_requests(self):
+        """Test consecutive requests share one pooled connection"""
+        self.client.get('/api/clients')
+        self.client.get('/api/invoices')
+        self.client.get('/api/stats')
+        
+        self.assertEqual(models.get_pool().opened, 1)
+        self.assertEqual(models.get_pool().readers.opened, 1)
+        
+        print("✓ Requests reuse pooled connection")
+    
+    def test_pool_applies_pragmas(self):
+        """Test pooled connections are configured with tuned PRAGMAs"""
+        conn = models.get_db()
+        try:
+            # In-memory databases keep their journal in memory instead of a WAL
+            expected = 'wal' if TEST_DATABASE_MODE == 'file' else 'memory'
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], expected)
+            self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertEqual(conn.execute('PRAGMA foreign_keys').fetchone()[0], 1)
+        finally:
+            conn.close()
+        
+        print("✓ PRAGMAs applied to pooled connections")
+    
+    def test_pool_is_bounded(self):
+        """Test acquiring past the pool size times out"""
+        pool = models.ConnectionPool(TEST_DATABASE, size=1, timeout=0.01)
+        conn = pool.acquire()
+        
+        with self.assertRaises(models.sqlite3.OperationalError):
+            pool.acquire()
+        
+        conn.close()
+        self.assertIs(pool.acquire(), conn)
+        pool.release(conn)
+        pool.close()
+        
+        print("✓ Pool size limit enforced")
+
+    
+    # ============ SCHEMA MIGRATION TESTS ============
+    
+    def test_init_db_sets_schema_version(self):
+        """Test init_db records the latest schema version"""
+        conn = models.get_db()
+        try:
+            self.assertEqual(models.get_schema_version(conn), models.SCHEMA_VERSION)
+            self.assertEqual(models.migrate(conn), [])
+        finally:
+            conn.close()
+        
+        print(f"✓ Schema at version {models.SCHEMA_VERSION}")
+    
+    def test_migrate_upgrades_legacy_database(self):
+        """Test a pre-migration database upgrades in place without data loss"""
+        models.close_pool()
+        self.keeper.close()
+        remove_test_database()
+        
+        # Build a version 0 database the way the old init_db did
+        self.keeper = legacy = sqlite3.connect(TEST_DATABASE, uri=True)
+        for statement in models.MIGRATIONS[0]:
+            legacy.execute(statement)
+        legacy.execute("INSERT INTO users (email, password, name) VALUES ('old@example.com', 'x', 'Old')")
+        legacy.commit()
+        
+        models.init_db()
+        
+        conn = models.get_db()
+        try:
+            self.assertEqual(models.get_schema_version(conn), models.SCHEMA_VERSION)
+            indexes = {row['name'] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"
+            )}
+            self.assertIn('idx_clients_user_created', indexes)
+            self.assertIn('idx_invoices_client_status_created', indexes)
+            self.assertIsNotNone(models.get_user_by_email('old@example.com'))
+        finally:
+            conn.close()
+        
+        print("✓ Legacy database upgraded in place")
+    
+    def test_route_queries_use_indexes(self):
+        """Test every query the routes run is an index search, not a table scan"""
+        statements = []
+        models.close_pool()
+        for conn in (models.get_db(), models.get_read_db()):
+            conn.set_trace_callback(statements.append)
+            conn.close()
+        
+        client_response = self.client.post(
+            '/api/clients',
+            data=json.dumps({'name': 'Plan', 'email': 'plan@example.com'}),
+            content_type='application/json'
+        )
+        client_id = json.loads(client_response.data)['id']
+        invoice_response = self.client.post(
+            '/api/invoices',
+            data=json.dumps({'client_id': client_id, 'amount': 100}),
+            content_type='application/json'
+        )
+        invoice_id = json.loads(invoice_response.data)['id']
+        
+        self.client.get('/api/me')
+        self.client.get('/api/clients')
+        self.client.get('/api/invoices')
+        self.client.get('/api/clients?search=Plan')
+        self.client.get(f'/api/invoices?status=paid&client_id={client_id}')
+        self.client.get('/api/invoices?due_from=2024-01-01&due_to=2024-12-31')
+        self.client.get('/api/invoices?min_amount=10&sort=amount&order=asc')
+        for path in ('/api/clients', '/api/invoices'):
+            page = json.loads(self.client.get(f'{path}?limit=1').data)
+            cursor = encode_cursor(page['items'][0])
+            self.client.get(f'{path}?limit=1&cursor={cursor}')
+        self.client.get('/api/stats')
+        self.client.get('/api/dashboard')
+        self.client.put(
+            f'/api/clients/{client_id}',
+            data=json.dumps({'name': 'Plan', 'email': 'plan@example.com'}),
+            content_type='application/json'
+        )
+        self.client.put(
+            f'/api/invoices/{invoice_id}',
+            data=json.dumps({'amount': 200}),
+            content_type='application/json'
+        )
+        self.client.put(
+            f'/api/invoices/{invoice_id}/status',
+            data=json.dumps({'status': 'paid'}),
+            content_type='application/json'
+        )
+        self.client.delete(f'/api/invoices/{invoice_id}')
+        self.client.delete(f'/api/clients/{client_id}')
+        
+        reader = models.get_read_db()
+        reader.set_trace_callback(None)
+        reader.close()
+        conn = models.get_db()
+        try:
+            conn.set_trace_callback(None)
+            queries = [sql for sql in statements
+                       if sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE'))]
+            self.assertTrue(queries)
+            
+            for sql in queries:
+                for row in conn.execute('EXPLAIN QUERY PLAN ' + sql):
+                    self.assertFalse(
+                        row['detail'].startswith('SCAN'),
+                        f"Full scan in: {sql.strip()} -> {row['detail']}"
+                    )
+        finally:
+            conn.close()
+        
+        print(f"✓ {len(queries)} route queries use indexes")
+
+    
+    # ============ DASHBOARD TESTS ============
+    
+    def test_dashboard_combines_stats_recent_and_options(self):
+        """Test the dashboard returns stats, the latest invoices and client options"""
+        client_id = self._create_client('Dash', 'dash@example.com')
+        for amount in range(1, 8):
+            self.client.post(
+                '/api/invoices',
+                data=json.dumps({'client_id': client_id, 'amount': amount}),
+                content_type='application/json'
+            )
+        
+        response = self.client.get('/api/dashboard')
+        self.assertEqual(response.status_code, 200)
+        dashboard = json.loads(response.data)
+        
+        self.assertEqual(dashboard['stats'], json.loads(self.client.get('/api/stats').data))
+        self.assertEqual(
+            [invoice['amount'] for invoice in dashboard['recent_invoices']],
+            [7, 6, 5, 4, 3]
+        )
+        self.assertEqual(
+            set(dashboard['recent_invoices'][0]),
+            {'id', 'client_name', 'description', 'amount', 'status'}
+        )
+        self.assertEqual(dashboard['client_options'], [{'id': client_id, 'name': 'Dash'}])
+        
+        print("✓ Dashboard combines stats, recent invoices and client options")
+    
+    def test_dashboard_reads_in_one_transaction(self):
+        """Test the dashboard reads everything on one connection inside one transaction"""
+        self._create_client('Dash', 'dash@example.com')
+        statements = []
+        models.close_pool()
+        conn = models.get_read_db()
+        conn.set_trace_callback(statements.append)
+        conn.close()
+        
+        response = self.client.get('/api/dashboard')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(models.get_pool().readers.opened, 1)
+        
+        begin = statements.index('BEGIN')
+        self.assertEqual(statements[-1], 'COMMIT')
+        self.assertEqual(len([sql for sql in statements[begin:] if 'SELECT' in sql]), 3)
+        
+        self.client.post('/api/logout')
+        self.assertEqual(self.client.get('/api/dashboard').status_code, 401)
+        
+        print("✓ Dashboard reads run in a single transaction")
+
+    
+    # ============ STATS ROLLUP TESTS ============
+    
+    def test_stats_rollup_follows_every_write(self):
+        """Test user_stats tracks edits, status flips and deletes without drift"""
+        client_response = self.client.post(
+            '/api/clients',
+            data=json.dumps({'name': 'Rollup', 'email': 'rollup@example.com'}),
+            content_type='application/json'
+        )
+        client_id = json.loads(client_response.data)['id']
+        
+        invoice_ids = []
+        for amount in (100.0, 250.0, 400.0):
+            response = self.client.post(
+                '/api/invoices',
+                data=json.dumps({'client_id': client_id, 'amount': amount}),
+                content_type='application/json'
+            )
+            invoice_ids.append(json.loads(response.data)['id'])
+        
+        self.client.put(
+            f'/api/invoices/{invoice_ids[0]}/status',
+            data=json.dumps({'status': 'paid'}),
+            content_type='application/json'
+        )
+        self.client.put(
+            f'/api/invoices/{invoice_ids[0]}',
+            data=json.dumps({'amount': 150.0}),
+            content_type='application/json'
+        )
+        self.client.delete(f'/api/invoices/{invoice_ids[2]}')
+        
+        stats = json.loads(self.client.get('/api/stats').data)
+        self.assertEqual(stats['total_clients'], 1)
+        self.assertEqual(stats['total_invoices'], 2)
+        self.assertEqual(stats['paid_total'], 150.0)
+        self.assertEqual(stats['unpaid_total'], 250.0)
+        self.assertEqual(models.rebuild_user_stats(), [])
+        
+        # Deleting the client removes its invoices from the rollup too
+        self.client.delete(f'/api/clients/{client_id}')
+        stats = json.loads(self.client.get('/api/stats').data)
+        self.assertEqual(stats['total_clients'], 0)
+        self.assertEqual(stats['total_invoices'], 0)
+        self.assertEqual(stats['paid_total'], 0)
+        self.assertEqual(stats['unpaid_total'], 0)
+        self.assertEqual(models.rebuild_user_stats(), [])
+        
+        print("✓ Stats rollup stays in sync with writes")
+    
+    def test_rebuild_user_stats_repairs_drift(self):
+        """Test rebuild_user_stats reports and fixes a drifted row"""
+        self.client.post(
+            '/api/clients',
+            data=json.dumps({'name': 'Drift', 'email': 'drift@example.com'}),
+            content_type='application/json'
+        )
+        user_id = json.loads(self.client.get('/api/me').data)['id']
+        
+        conn = models.get_db()
+        conn.execute('UPDATE user_stats SET total_clients = 42 WHERE user_id = ?', (user_id,))
+        conn.commit()
+        conn.close()
+        
+        conn = models.get_db()
+        version = models.get_data_version(conn, user_id)
+        conn.close()
+        
+        self.assertEqual(models.rebuild_user_stats(), [user_id])
+        
+        conn = models.get_db()
+        self.assertGreater(models.get_data_version(conn, user_id), version)
+        conn.close()
+        stats = json.loads(self.client.get('/api/stats').data)
+        self.assertEqual(stats['total_clients'], 1)
+        
+        print("✓ Drifted stats detected and rebuilt")
+
+    
+    # ============ PAGINATION TESTS ============
+    
+    def _collect_pages(self, path, limit, query=''):
+        """Follow next_cursor until exhausted, returning every page"""
+        pages = []
+        base = f'{path}?{query}&limit={limit}' if query else f'{path}?limit={limit}'
+        url = base
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = json.loads(response.data)
+            pages.append(page)
+            url = f"{base}&cursor={page['next_cursor']}" if page['next_cursor'] else None
+        return pages
+    
+    def test_clients_keyset_pagination(self):
+        """Test paging through clients returns every row once, newest first"""
+        for i in range(5):
+            self.client.post(
+                '/api/clients',
+                data=json.dumps({'name': f'Client {i}', 'email': f'c{i}@example.com'}),
+                content_type='application/json'
+            )
+        
+        everything = json.loads(self.client.get('/api/clients').data)
+        pages = self._collect_pages('/api/clients', 2)
+        
+        self.assertEqual([len(page['items']) for page in pages], [2, 2, 1])
+        paged = [client for page in pages for client in page['items']]
+        self.assertEqual([c['id'] for c in paged], [c['id'] for c in everything])
+        self.assertEqual(paged[0]['name'], 'Client 4')
+        
+        print("✓ Client pages cover every row exactly once")
+    
+    def test_invoices_keyset_pagination(self):
+        """Test paging through invoices returns every row once"""
+        client_response = self.client.post(
+            '/api/clients',
+            data=json.dumps({'name': 'Pager', 'email': 'pager@example.com'}),
+            content_type='application/json'
+        )
+        client_id = json.loads(client_response.data)['id']
+        for amount in range(1, 5):
+            self.client.post(
+                '/api/invoices',
+                data=json.dumps({'client_id': client_id, 'amount': amount}),
+                content_type='application/json'
+            )
+        
+        pages = self._collect_pages('/api/invoices', 3)
+        
+        self.assertEqual([len(page['items']) for page in pages], [3, 1])
+        amounts = [inv['amount'] for page in pages for inv in page['items']]
+        self.assertEqual(amounts, [4, 3, 2, 1])
+        self.assertEqual(pages[0]['items'][0]['client_name'], 'Pager')
+        
+        print("✓ Invoice pages cover every row exactly once")
+    
+    def test_pagination_rejects_bad_parameters(self):
+        """Test invalid limit or cursor values return 400"""
+        for query in ('limit=0', 'limit=abc', 'limit=100000', 'cursor=not-a-cursor'):
+            response = self.client.get(f'/api/invoices?{query}')
+            self.assertEqual(response.status_code, 400, query)
+        
+        # Well-formed, but the id is past SQLite's 64-bit INTEGER range
+        for key in (['2024-01-01', 10 ** 20], [10 ** 20, 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+            response = self.client.get(f'/api/clients?cursor={cursor}')
+            self.assertEqual(response.status_code, 400, key)
+            self.assertEqual(json.loads(response.data)['error'], 'Invalid cursor')
+        
+        print("✓ Bad pagination parameters rejected")
+
+    
+    # ============ FILTER & SORT TESTS ============
+    
+    def _seed_invoices(self):
+        """Create two clients with a spread of invoices, returning client ids"""
+        client_ids = []
+        for name in ('Acme', 'Globex'):
+            response = self.client.post(
+                '/api/clients',
+                data=json.dumps({'name': name, 'email': f'{name.lower()}@example.com'}),
+                content_type='application/json'
+            )
+            client_ids.append(json.loads(response.data)['id'])
+        
+        rows = [
+            (client_ids[0], 100.0, '2024-01-15', 'paid'),
+            (client_ids[0], 250.0, '2024-02-15', 'unpaid'),
+            (client_ids[1], 400.0, '2024-03-15', 'paid'),
+            (client_ids[1], 50.0, '2024-04-15', 'unpaid'),
+        ]
+        for client_id, amount, due_date, status in rows:
+            response = self.client.post(
+                '/api/invoices',
+                data=json.dumps({'client_id': client_id, 'amount': amount, 'due_date': due_date}),
+                content_type='application/json'
+            )
+            if status == 'paid':
+                invoice_id = json.loads(response.data)['id']
+                self.client.put(
+                    f'/api/invoices/{invoice_id}/status',
+                    data=json.dumps({'status': 'paid'}),
+                    content_type='application/json'
+                )
+        return client_ids
+    
+    def _amounts(self, query):
+        response = self.client.get(f'/api/invoices?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [invoice['amount'] for invoice in json.loads(response.data)]
+    
+    def test_invoice_filters(self):
+        """Test status, client, due date and amount filters run server-side"""
+        client_ids = self._seed_invoices()
+        
+        self.assertEqual(sorted(self._amounts('status=paid')), [100.0, 400.0])
+        self.assertEqual(sorted(self._amounts(f'client_id={client_ids[1]}')), [50.0, 400.0])
+        self.assertEqual(sorted(self._amounts('due_from=2024-02-01&due_to=2024-03-31')), [250.0, 400.0])
+        self.assertEqual(sorted(self._amounts('min_amount=100&max_amount=300')), [100.0, 250.0])
+        self.assertEqual(self._amounts(f'status=unpaid&client_id={client_ids[0]}'), [250.0])
+        
+        print("✓ Invoice filters applied in SQL")
+    
+    def test_invoice_sorting_with_pagination(self):
+        """Test sorted pages keep their order across cursors"""
+        self._seed_invoices()
+        
+        self.assertEqual(self._amounts('sort=amount&order=asc'), [50.0, 100.0, 250.0, 400.0])
+        self.assertEqual(self._amounts('sort=due_date'), [50.0, 400.0, 250.0, 100.0])
+        
+        amounts = []
+        for page in self._collect_pages('/api/invoices', 3, 'sort=amount&order=desc'):
+            amounts.extend(invoice['amount'] for invoice in page['items'])
+        self.assertEqual(amounts, [400.0, 250.0, 100.0, 50.0])
+        
+        print("✓ Sorted invoices paginate correctly")
+    
+    def test_invoice_filters_reject_bad_values(self):
+        """Test invalid filter and sort values return 400"""
+        for query in ('status=overdue', 'client_id=x', f'client_id={10 ** 20}', 'due_from=15/01/2024',
+                      'min_amount=lots', 'sort=description', 'order=sideways'):
+            response = self.client.get(f'/api/invoices?{query}')
+            self.assertEqual(response.status_code, 400, query)
+        
+        print("✓ Bad filter values rejected")
+    
+    def test_client_search(self):
+        """Test ?search= matches name or email and treats wildcards literally"""
+        for name, email in (('Alice Smith', 'alice@example.com'),
+                            ('Bob Jones', 'bob@smith.co'),
+                            ('Carol 100%', 'carol@example.com')):
+            self.client.post(
+                '/api/clients',
+                data=json.dumps({'name': name, 'email': email}),
+                content_type='application/json'
+            )
+        
+        def names(search):
+            response = self.client.get(f'/api/clients?search={search}')
+            return sorted(client['name'] for client in json.loads(response.data))
+        
+        self.assertEqual(names('smith'), ['Alice Smith', 'Bob Jones'])
+        self.assertEqual(names('100%25'), ['Carol 100%'])
+        self.assertEqual(names('_'), [])
+        
+        print("✓ Client search runs server-side")
+
+    
+    # ============ STREAMING TESTS ============
+    
+    def _bulk_clients(self, count):
+        """Insert many clients for the logged-in user directly"""
+        user_id = json.loads(self.client.get('/api/me').data)['id']
+        conn = models.get_db()
+        conn.executemany(
+            'INSERT INTO clients (user_id, name, email) VALUES (?, ?, ?)',
+            [(user_id, f'Bulk {i}', f'bulk{i}@example.com') for i in range(count)]
+        )
+        conn.commit()
+        conn.close()
+    
+    def test_large_list_streams_as_json_array(self):
+        """Test a list bigger than one fetchmany batch streams as valid JSON"""
+        count = app_module.STREAM_BATCH_SIZE * 2 + 7
+        self._bulk_clients(count)
+        
+        response = self.client.get('/api/clients')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'application/json')
+        
+        clients = json.loads(response.data)
+        self.assertEqual(len(clients), count)
+        self.assertEqual(len({client['id'] for client in clients}), count)
+        
+        # The streamed request handed its connection back to the pool
+        pool = models.get_pool().readers
+        self.assertEqual(pool.opened, pool._idle.qsize())
+        
+        print(f"✓ Streamed {count} clients as a JSON array")
+    
+    def test_list_streams_ndjson_on_request(self):
+        """Test NDJSON output via Accept header or ?format=ndjson"""
+        self._bulk_clients(3)
+        
+        for url, headers in (('/api/clients', {'Accept': 'application/x-ndjson'}),
+                             ('/api/clients?format=ndjson', {})):
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            lines = response.data.decode('utf-8').splitlines()
+            self.assertEqual(len(lines), 3)
+            self.assertEqual(json.loads(lines[0])['name'], 'Bulk 2')
+        
+        empty = self.client.get('/api/invoices?format=ndjson')
+        self.assertEqual(empty.data, b'')
+        
+        print("✓ NDJSON streaming works")
+
+    
+    # ============ CONDITIONAL GET TESTS ============
+    
+    def test_etag_returns_304_until_data_changes(self):
+        """Test If-None-Match gets 304 until a write bumps the data version"""
+        first = self.client.get('/api/stats')
+        etag = first.headers['ETag']
+        self.assertTrue(etag)
+        
+        for path in ('/api/stats', '/api/clients', '/api/invoices'):
+            response = self.client.get(path, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304, path)
+            self.assertEqual(response.data, b'')
+        
+        create_response = self.client.post(
+            '/api/clients',
+            data=json.dumps({'name': 'Versioned', 'email': 'v@example.com'}),
+            content_type='application/json'
+        )
+        client_id = json.loads(create_response.data)['id']
+        
+        response = self.client.get('/api/stats', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        
+        # Edits that don't change any totals still bump the version
+        etag = response.headers['ETag']
+        self.client.put(
+            f'/api/clients/{client_id}',
+            data=json.dumps({'name': 'Renamed', 'email': 'v@example.com'}),
+            content_type='application/json'
+        )
+        response = self.client.get('/api/clients', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)[0]['name'], 'Renamed')
+        
+        print("✓ ETag revalidation follows the data version")
+    
+    def test_304_only_reads_data_version(self):
+        """Test a matching If-None-Match runs no query beyond the version lookup"""
+        etag = self.client.get('/api/invoices').headers['ETag']
+        
+        statements = []
+        conn = models.get_read_db()
+        conn.set_trace_callback(statements.append)
+        conn.close()
+        try:
+            response = self.client.get('/api/invoices', headers={'If-None-Match': etag})
+        finally:
+            conn.set_trace_callback(None)
+        
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('data_version', statements[0])
+        
+        print("✓ 304 served from the version lookup alone")
+    
+    def test_other_users_writes_keep_etag_valid(self):
+        """Test one user's writes don't invalidate another user's ETags"""
+        etag = self.client.get('/api/clients').headers['ETag']
+        
+        other = app.test_client()
+        other.post(
+            '/api/register',
+            data=json.dumps({'name': 'Other', 'email': 'other@example.com', 'password': 'secret123'}),
+            content_type='application/json'
+        )
+        other.post(
+            '/api/clients',
+            data=json.dumps({'name': 'Theirs', 'email': 'theirs@example.com'}),
+            content_type='application/json'
+        )
+        
+        response = self.client.get('/api/clients', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        
+        print("✓ ETags are scoped per user")
+
+    
+    # ============ BATCH INVOICE TESTS ============
+    
+    def _create_client(self, name='Batch', email='batch@example.com', client=None):
+        response = (client or self.client).post(
+            '/api/clients',
+            data=json.dumps({'name': name, 'email': email}),
+            content_type='application/json'
+        )
+        return json.loads(response.data)['id']
+    
+    def _other_user_client(self):
+        """Register a second user and return (their test client, a client id)"""
+        other = app.test_client()
+        other.post(
+            '/api/register',
+            data=json.dumps({'name': 'Other', 'email': 'other@example.com', 'password': 'secret123'}),
+            content_type='application/json'
+        )
+        return other, self._create_client('Theirs', 'theirs@example.com', client=other)
+    
+    def test_batch_create_reports_per_item_results(self):
+        """Test batch create inserts valid rows and reports the rest"""
+        client_id = self._create_client()
+        _, foreign_client_id = self._other_user_client()
+        
+        response = self.client.post(
+            '/api/invoices/batch',
+            data=json.dumps({'invoices': [
+                {'client_id': client_id, 'amount': 100, 'description': 'One'},
+                {'client_id': client_id},
+                {'client_id': foreign_client_id, 'amount': 50},
+                {'client_id': client_id, 'amount': '250.5', 'due_date': '2024-06-30'},
+            ]}),
+            content_type='application/json'
+        )
+        data = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in data['results']], [201, 400, 404, 201])
+        self.assertEqual((data['succeeded'], data['failed']), (2, 2))
+        
+        invoices = {inv['id']: inv for inv in json.loads(self.client.get('/api/invoices').data)}
+        self.assertEqual(invoices[data['results'][0]['id']]['description'], 'One')
+        self.assertEqual(invoices[data['results'][3]['id']]['amount'], 250.5)
+        
+        print("✓ Batch create returns per-item results")
+    
+    def test_batch_status_marks_many_paid_in_one_commit(self):
+        """Test 500 invoices are marked paid by one request and one commit"""
+        client_id = self._create_client()
+        created = json.loads(self.client.post(
+            '/api/invoices/batch',
+            data=json.dumps({'invoices': [{'client_id': client_id, 'amount': 10} for _ in range(500)]}),
+            content_type='application/json'
+        ).data)
+        ids = [result['id'] for result in created['results']]
+        self.assertEqual(len(set(ids)), 500)
+        
+        statements = []
+        conn = models.get_db()
+        conn.set_trace_callback(statements.append)
+        conn.close()
+        try:
+            response = self.client.put(
+                '/api/invoices/status/batch',
+                data=json.dumps({'invoices': [{'id': i, 'status': 'paid'} for i in ids]}),
+                content_type='application/json'
+            )
+        finally:
+            conn.set_trace_callback(None)
+        
+        self.assertEqual(json.loads(response.data)['succeeded'], 500)
+        self.assertEqual(sum(1 for sql in statements if sql.startswith('SELECT id FROM invoices WHERE user_id')), 1)
+        self.assertEqual(sum(1 for sql in statements if sql == 'COMMIT'), 1)
+        
+        stats = json.loads(self.client.get('/api/stats').data)
+        self.assertEqual(stats['paid_total'], 5000)
+        self.assertEqual(stats['unpaid_total'], 0)
+        
+        print("✓ 500 invoices marked paid in one transaction")
+    
+    def test_batch_update_and_delete_check_ownership(self):
+        """Test batch update/delete skip invoices the user does not own"""
+        client_id = self._create_client()
+        mine = json.loads(self.client.post(
+            '/api/invoices/batch',
+            data=json.dumps({'invoices': [{'client_id': client_id, 'amount': 10},
+                                          {'client_id': client_id, 'amount': 20}]}),
+            content_type='application/json'
+        ).data)
+        mine_ids = [result['id'] for result in mine['results']]
+        
+        other, foreign_client_id = self._other_user_client()
+        theirs = json.loads(other.post(
+            '/api/invoices',
+            data=json.dumps({'client_id': foreign_client_id, 'amount': 99}),
+            content_type='application/json'
+        ).data)['id']
+        
+        update = json.loads(self.client.put(
+            '/api/invoices/batch',
+            data=json.dumps({'invoices': [
+                {'id': mine_ids[0], 'amount': 15, 'description': 'Edited'},
+                {'id': theirs, 'amount': 1},
+                {'id': mine_ids[1]},
+            ]}),
+            content_type='application/json'
+        ).data)
+        self.assertEqual([r['status'] for r in update['results']], [200, 404, 400])
+        
+        delete = json.loads(self.client.delete(
+            '/api/invoices/batch',
+            data=json.dumps({'ids': [mine_ids[1], theirs, 'x']}),
+            content_type='application/json'
+        ).data)
+        self.assertEqual([r['status'] for r in delete['results']], [200, 404, 400])
+        
+        remaining = json.loads(self.client.get('/api/invoices').data)
+        self.assertEqual([(inv['id'], inv['amount']) for inv in remaining], [(mine_ids[0], 15)])
+        self.assertEqual(len(json.loads(other.get('/api/invoices').data)), 1)
+        
+        print("✓ Batch update/delete enforce ownership")
+    
+    def test_batch_rejects_bad_envelopes(self):
+        """Test empty, missing or oversized batches return 400"""
+        for body in ({}, {'invoices': []}, {'invoices': 'nope'},
+                     {'invoices': [{}] * (app_module.MAX_BATCH_SIZE + 1)},
+                     [{'client_id': 1, 'amount': 5}], 'invoices', 42):
+            response = self.client.post(
+                '/api/invoices/batch',
+                data=json.dumps(body),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+        
+        response = self.client.delete('/api/invoices/batch', json=[1, 2])
+        self.assertEqual(json.loads(response.data)['error'], 'Request body must be a JSON object')
+        
+        print("✓ Bad batch envelopes rejected")
+    
+    def test_batch_rejects_out_of_range_ids(self):
+        """Test ids past SQLite's 64-bit INTEGER range fail per item with 400"""
+        client_id = self._create_client()
+        
+        create = self.client.post('/api/invoices/batch', json={'invoices': [
+            {'client_id': 10 ** 20, 'amount': 5},
+            {'client_id': client_id, 'amount': 5},
+        ]})
+        status = self.client.put('/api/invoices/status/batch', json={'invoices': [
+            {'id': 10 ** 20, 'status': 'paid'},
+        ]})
+        
+        self.assertEqual([r['status'] for r in json.loads(create.data)['results']], [400, 201])
+        self.assertEqual([r['status'] for r in json.loads(status.data)['results']], [400])
+        
+        print("✓ Out-of-range batch ids rejected per item")
+    
+    def test_batch_rejects_non_finite_amounts(self):
+        """Test NaN and infinite amounts fail per item and leave the totals intact"""
+        client_id = self._create_client()
+        invoice_id = json.loads(self.client.post(
+            '/api/invoices', json={'client_id': client_id, 'amount': 10}
+        ).data)['id']
+        
+        create = self.client.post('/api/invoices/batch', json={'invoices': [
+            {'client_id': client_id, 'amount': 'nan'},
+            {'client_id': client_id, 'amount': 'inf'},
+            {'client_id': client_id, 'amount': 5},
+        ]})
+        update = self.client.put('/api/invoices/batch', json={'invoices': [
+            {'id': invoice_id, 'amount': 'NaN'},
+            {'id': invoice_id, 'amount': '-Infinity'},
+        ]})
+        
+        self.assertEqual(create.status_code, 200)
+        self.assertEqual([r['status'] for r in json.loads(create.data)['results']], [400, 400, 201])
+        self.assertEqual([r['status'] for r in json.loads(update.data)['results']], [400, 400])
+        self.assertEqual(json.loads(self.client.get('/api/stats').data)['unpaid_total'], 15)
+        
+        print("✓ Non-finite batch amounts rejected per item")
+    
+    def test_batch_rejects_bad_descriptions_and_due_dates(self):
+        """Test non-string descriptions and bad due dates fail only their item"""
+        client_id = self._create_client()
+        invoice_id = json.loads(self.client.post(
+            '/api/invoices', json={'client_id': client_id, 'amount': 10}
+        ).data)['id']
+        
+        create = self.client.post('/api/invoices/batch', json={'invoices': [
+            {'client_id': client_id, 'amount': 5, 'due_date': ['x']},
+            {'client_id': client_id, 'amount': 5, 'description': {'a': 1}},
+            {'client_id': client_id, 'amount': 5, 'due_date': '30/06/2024'},
+            {'client_id': client_id, 'amount': 5, 'description': 'Ok', 'due_date': '2024-06-30'},
+        ]})
+        update = self.client.put('/api/invoices/batch', json={'invoices': [
+            {'id': invoice_id, 'amount': 7, 'due_date': 20240630},
+            {'id': invoice_id, 'amount': 8, 'description': ['x']},
+        ]})
+        
+        self.assertEqual([r['status'] for r in json.loads(create.data)['results']], [400, 400, 400, 201])
+        self.assertEqual([r['status'] for r in json.loads(update.data)['results']], [400, 400])
+        self.assertEqual(json.loads(self.client.get('/api/stats').data)['unpaid_total'], 15)
+        
+        print("✓ Bad batch descriptions and due dates rejected per item")
+
+    
+    # ============ IMPORT / EXPORT TESTS ============
+    
+    def _upload(self, path, text):
+        return self.client.post(
+            path,
+            data={'file': (io.BytesIO(text.encode('utf-8')), 'upload.csv')},
+            content_type='multipart/form-data'
+        )
+    
+    def test_export_streams_csv_and_ndjson(self):
+        """Test exports stream every row as CSV or NDJSON attachments"""
+        self._bulk_clients(3)
+        
+        response = self.client.get('/api/export/clients')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(response.data.decode('utf-8'))))
+        self.assertEqual([row['name'] for row in rows], ['Bulk 2', 'Bulk 1', 'Bulk 0'])
+        
+        response = self.client.get('/api/export/invoices?format=ndjson')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(response.data, b'')
+        
+        empty = self.client.get('/api/export/invoices')
+        self.assertEqual(empty.data.decode('utf-8').strip(),
+                         'id,client_id,client_name,amount,description,status,due_date,created_at')
+        
+        self.assertEqual(self.client.get('/api/export/users').status_code, 404)
+        self.assertEqual(self.client.get('/api/export/clients?format=xml').status_code, 400)
+        
+        print("✓ Exports stream CSV and NDJSON")
+    
+    def test_import_clients_reports_bad_rows(self):
+        """Test client import inserts valid rows and reports invalid ones by line"""
+        response = self._upload('/api/import/clients', (
+            'name,email,phone,created_at\n'
+            'Imported One,one@example.com,0700000001,2021-03-04\n'
+            ',missing@example.com,,\n'
+            'Imported Two,two@example.com,,2021-13-40\n'
+            'Imported Three,three@example.com,,\n'
+        ))
+        report = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((report['imported'], report['failed']), (2, 2))
+        self.assertEqual([error['line'] for error in report['errors']], [3, 4])
+        
+        clients = {c['name']: c for c in json.loads(self.client.get('/api/clients').data)}
+        self.assertEqual(set(clients), {'Imported One', 'Imported Three'})
+        self.assertEqual(clients['Imported One']['created_at'], '2021-03-04 00:00:00')
+        
+        print("✓ Client import validates each row")
+    
+    def test_import_invoices_in_chunks(self):
+        """Test invoice import resolves clients, checks ownership and commits per chunk"""
+        client_id = self._create_client('Acme', 'acme@example.com')
+        _, foreign_client_id = self._other_user_client()
+        
+        lines = ['client_id,client_email,amount,status,due_date']
+        for i in range(25):
+            lines.append(f'{client_id},,{i + 1},paid,2024-01-{i + 1:02d}')
+        lines.append(',acme@example.com,1000,,')
+        lines.append(f'{foreign_client_id},,5,,')
+        lines.append(f'{client_id},,abc,,')
+        lines.append(f'{client_id},,5,overdue,')
+        
+        original_chunk_size = app_module.IMPORT_CHUNK_SIZE
+        app_module.IMPORT_CHUNK_SIZE = 10
+        try:
+            response = self._upload('/api/import/invoices', '\n'.join(lines) + '\n')
+        finally:
+            app_module.IMPORT_CHUNK_SIZE = original_chunk_size
+        report = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((report['imported'], report['failed']), (26, 3))
+        self.assertEqual(sorted(error['line'] for error in report['errors']), [28, 29, 30])
+        
+        stats = json.loads(self.client.get('/api/stats').data)
+        self.assertEqual(stats['total_invoices'], 26)
+        self.assertEqual(stats['paid_total'], sum(range(1, 26)))
+        self.assertEqual(stats['unpaid_total'], 1000)
+        
+        print("✓ Invoice import handles chunks and bad rows")
+    
+    def test_import_invoices_rejects_non_finite_amounts(self):
+        """Test NaN and infinite amounts are per-line errors, not imported"""
+        self._create_client('Acme', 'acme@example.com')
+        csv_text = 'client_email,amount\n' + ''.join(
+            f'acme@example.com,{amount}\n' for amount in ('nan', 'Infinity', '-inf', '12.5')
+        )
+        
+        response = self._upload('/api/import/invoices', csv_text)
+        report = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((report['imported'], report['failed']), (1, 3))
+        self.assertEqual([(error['line'], error['error']) for error in report['errors']],
+                         [(line, 'Amount must be a number') for line in (2, 3, 4)])
+        self.assertEqual(json.loads(self.client.get('/api/stats').data)['unpaid_total'], 12.5)
+        
+        print("✓ Non-finite import amounts reported per line")
+    
+    def test_import_accepts_raw_csv_body(self):
+        """Test import reads a raw text/csv body and rejects missing columns"""
+        response = self.client.post(
+            '/api/import/clients',
+            data='name,email\nRaw,raw@example.com\n',
+            content_type='text/csv'
+        )
+        self.assertEqual(json.loads(response.data)['imported'], 1)
+        
+        response = self._upload('/api/import/clients', 'name,phone\nNo Email,123\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', json.loads(response.data)['error'])
+        
+        print("✓ Raw CSV bodies import; missing columns rejected")
+
+    
+    # ============ OWNERSHIP-CHECKED WRITE TESTS ============
+    
+    def test_writes_run_a_single_statement(self):
+        """Test each write route runs one statement that includes the ownership check"""
+        client_id = self._create_client()
+        invoice_id = json.loads(self.client.post(
+            '/api/invoices',
+            data=json.dumps({'client_id': client_id, 'amount': 10}),
+            content_type='application/json'
+        ).data)['id']
+        
+        requests = [
+            ('post', '/api/invoices', {'client_id': client_id, 'amount': 20}),
+            ('put', f'/api/invoices/{invoice_id}', {'amount': 30}),
+            ('put', f'/api/invoices/{invoice_id}/status', {'status': 'paid'}),
+            ('delete', f'/api/invoices/{invoice_id}', None),
+            ('put', f'/api/clients/{client_id}', {'name': 'N', 'email': 'n@example.com'}),
+            ('delete', f'/api/clients/{client_id}', None),
+        ]
+        
+        conn = models.get_db()
+        conn.close()
+        for method, path, body in requests:
+            statements = []
+            conn.set_trace_callback(statements.append)
+            try:
+                kwargs = {'data': json.dumps(body), 'content_type': 'application/json'} if body else {}
+                response = getattr(self.client, method)(path, **kwargs)
+            finally:
+                conn.set_trace_callback(None)
+            
+            self.assertIn(response.status_code, (200, 201), path)
+            # Trigger programs re-report the statement that fired them,
+            # so count distinct statements
+            writes = {sql for sql in statements if sql != 'COMMIT' and not sql.startswith('BEGIN')}
+            self.assertEqual(len(writes), 1, f'{method.upper()} {path}: {writes}')
+        
+        print("✓ Every write is a single ownership-checked statement")
+    
+    def test_writes_to_other_users_data_return_404(self):
+        """Test writes aimed at another user's rows change nothing"""
+        other, foreign_client_id = self._other_user_client()
+        foreign_invoice_id = json.loads(other.post(
+            '/api/invoices',
+            data=json.dumps({'client_id': foreign_client_id, 'amount': 77}),
+            content_type='application/json'
+        ).data)['id']
+        
+        attempts = [
+            ('post', '/api/invoices', {'client_id': foreign_client_id, 'amount': 1}),
+            ('put', f'/api/invoices/{foreign_invoice_id}', {'amount': 1}),
+            ('put', f'/api/invoices/{foreign_invoice_id}/status', {'status': 'paid'}),
+            ('delete', f'/api/invoices/{foreign_invoice_id}', None),
+            ('put', f'/api/clients/{foreign_client_id}', {'name': 'Hijack', 'email': 'h@example.com'}),
+            ('delete', f'/api/clients/{foreign_client_id}', None),
+        ]
+        for method, path, body in attempts:
+            kwargs = {'data': json.dumps(body), 'content_type': 'application/json'} if body else {}
+            response = getattr(self.client, method)(path, **kwargs)
+            self.assertEqual(response.status_code, 404, f'{method.upper()} {path}')
+        
+        invoices = json.loads(other.get('/api/invoices').data)
+        self.assertEqual([(inv['amount'], inv['status']) for inv in invoices], [(77, 'unpaid')])
+        self.assertEqual(json.loads(other.get('/api/clients').data)[0]['name'], 'Theirs')
+        
+        print("✓ Cross-user writes rejected with 404")
+
+    
+    # ============ USER CACHE TESTS ============
+    
+    def test_lru_cache_evicts_and_expires(self):
+        """Test LRUCache drops least recently used entries and expired ones"""
+        lru = LRUCache(max_size=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)  # evicts b, the least recently used
+        
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.stats()['evictions'], 1)
+        
+        expiring = LRUCache(max_size=2, ttl=0)
+        expiring.set('a', 1)
+        self.assertIsNone(expiring.get('a'))
+        
+        stats = lru.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        
+        print("✓ LRU cache evicts and expires entries")
+    
+    def test_me_is_served_from_user_cache(self):
+        """Test repeated /api/me calls skip the users table"""
+        self.client.get('/api/me')
+        hits = models.user_cache.hits
+        
+        statements = []
+        conn = models.get_read_db()
+        conn.set_trace_callback(statements.append)
+        conn.close()
+        try:
+            response = self.client.get('/api/me')
+        finally:
+            conn.set_trace_callback(None)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['email'], 'tester@example.com')
+        self.assertEqual(statements, [])
+        self.assertEqual(models.user_cache.hits, hits + 1)
+        
+        stats = json.loads(self.client.get('/api/cache/users').data)
+        self.assertGreaterEqual(stats['hits'], 1)
+        self.assertIn('misses', stats)
+        self.assertEqual(app.test_client().get('/api/cache/users').status_code, 401)
+        
+        print("✓ /api/me served from the user cache")
+    
+    def test_invalidate_user_drops_both_keys(self):
+        """Test invalidation forgets the id and email entries"""
+        user = models.get_user_by_email('tester@example.com')
+        self.assertIsNotNone(models.user_cache.get(('id', user['id'])))
+        
+        models.invalidate_user(user['id'])
+        
+        self.assertIsNone(models.user_cache.get(('id', user['id'])))
+        self.assertIsNone(models.user_cache.get(('email', 'tester@example.com')))
+        
+        print("✓ User cache invalidation clears id and email keys")
+
+    
+    # ============ FIELD PROJECTION TESTS ============
+    
+    def test_clients_fields_projection(self):
+        """Test ?fields= narrows client rows, streamed and paged"""
+        self._bulk_clients(5)
+        
+        streamed = json.loads(self.client.get('/api/clients?fields=id,name').data)
+        self.assertEqual(len(streamed), 5)
+        self.assertTrue(all(set(client) == {'id', 'name'} for client in streamed))
+        
+        # Paging still works when the keyset columns are not requested
+        pages = self._collect_pages('/api/clients', 2, 'fields=name')
+        names = [client['name'] for page in pages for client in page['items']]
+        self.assertEqual(names, [client['name'] for client in streamed])
+        self.assertTrue(all(set(client) == {'name'} for page in pages for client in page['items']))
+        
+        print("✓ Client field projection works streamed and paged")
+    
+    def test_invoices_fields_projection(self):
+        """Test ?fields= narrows invoice rows, including the joined client name"""
+        self._seed_invoices()
+        
+        everything = json.loads(self.client.get('/api/invoices?sort=amount').data)
+        pages = self._collect_pages('/api/invoices', 2, 'sort=amount&fields=client_name,amount')
+        items = [invoice for page in pages for invoice in page['items']]
+        
+        self.assertEqual(
+            items,
+            [{'client_name': i['client_name'], 'amount': i['amount']} for i in everything]
+        )
+        
+        print("✓ Invoice field projection works with sorting and paging")
+    
+    def test_fields_projection_rejects_unknown_names(self):
+        """Test ?fields= only accepts whitelisted column names"""
+        for path in ('/api/clients?fields=password',
+                     '/api/clients?fields=',
+                     '/api/invoices?fields=id,user_id;DROP',
+                     '/api/invoices?fields=id,,amount&limit=5'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 400, path)
+            self.assertIn('fields must be drawn from', json.loads(response.data)['error'])
+        
+        print("✓ Unknown fields rejected")
+    
+    def test_fields_projection_allows_covering_index(self):
+        """Test a projection of indexed columns is answered from the index alone"""
+        self._bulk_clients(3)
+        statements = []
+        models.close_pool()
+        conn = models.get_read_db()
+        conn.set_trace_callback(statements.append)
+        conn.close()
+        
+        self.client.get('/api/clients?fields=id,created_at&limit=2')
+        
+        conn = models.get_read_db()
+        try:
+            conn.set_trace_callback(None)
+            query = next(sql for sql in statements if 'FROM clients' in sql)
+            plan = ' '.join(row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + query))
+            self.assertIn('COVERING INDEX idx_clients_user_created', plan)
+        finally:
+            conn.close()
+        
+        print("✓ Narrow projection uses a covering index")
+    
+    # ============ METRICS TESTS ============
+    
+    def _enable_metrics(self):
+        """Turn metrics on for this test, with freshly timed connections"""
+        app_module.METRICS_ENABLED = True
+        models.statement_hooks.append(app_module.record_statement)
+        app_module.metrics.clear()
+        models.close_pool()
+        
+        def disable():
+            app_module.METRICS_ENABLED = False
+            models.statement_hooks.remove(app_module.record_statement)
+            app_module.metrics.clear()
+        self.addCleanup(disable)
+    
+    def test_metrics_disabled_by_default(self):
+        """Test /metrics is off and connections are untimed unless enabled"""
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        
+        conn = models.get_db()
+        try:
+            self.assertNotIsInstance(conn, models.TimedConnection)
+        finally:
+            conn.close()
+        
+        print("✓ Metrics disabled by default")
+    
+    def test_metrics_record_routes_and_sql(self):
+        """Test /metrics reports per-route requests, latency and SQL totals"""
+        self._enable_metrics()
+        self._create_client()
+        self.client.get('/api/clients')
+        self.client.get('/api/clients')
+        self.client.get('/api/no-such-route')
+        
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        lines = response.data.decode().splitlines()
+        
+        def value(prefix):
+            return float(next(line for line in lines if line.startswith(prefix)).split()[-1])
+        
+        clients = 'method="GET",route="/api/clients"'
+        self.assertEqual(value(f'http_requests_total{{{clients},status="200"}}'), 2)
+        self.assertEqual(value(f'http_requests_total{{method="POST",route="/api/clients",status="201"}}'), 1)
+        self.assertEqual(value('http_requests_total{method="GET",route="unmatched",status="404"}'), 1)
+        self.assertEqual(value(f'http_request_duration_seconds_count{{{clients}}}'), 2)
+        self.assertEqual(value(f'http_request_duration_seconds_bucket{{{clients},le="+Inf"}}'), 2)
+        
+        # Each list request runs the user lookup, version check and select
+        self.assertGreaterEqual(value(f'db_statements_per_request_sum{{{clients}}}'), 4)
+        self.assertGreater(value(f'db_statement_seconds_per_request_sum{{{clients}}}'), 0)
+        self.assertGreaterEqual(value('db_connection_acquire_seconds_count'), 3)
+        self.assertIn('# TYPE user_cache_hit_ratio gauge', lines)
+        
+        print("✓ Metrics record route latency, status codes and SQL")
+    
+    def test_metrics_registry_renders_prometheus_text(self):
+        """Test histogram buckets are cumulative and label values escaped"""
+        registry = MetricsRegistry()
+        registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+        registry.counter('hits_total', 'Hits.')
+        for value in (0.05, 0.1, 0.5, 3):
+            registry.observe('latency_seconds', value, (('route', '/a'),))
+        registry.inc('hits_total', (('path', 'say "hi"\\'),), 2)
+        
+        text = registry.render()
+        
+        self.assertIn('# TYPE latency_seconds histogram', text)
+        self.assertIn('latency_seconds_bucket{route="/a",le="0.1"} 2', text)
+        self.assertIn('latency_seconds_bucket{route="/a",le="1.0"} 3', text)
+        self.assertIn('latency_seconds_bucket{route="/a",le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_count{route="/a"} 4', text)
+        self.assertIn('hits_total{path="say \\"hi\\"\\\\"} 2', text)
+        
+        print("✓ Registry renders Prometheus text format")
+    
+    # ============ SLOW QUERY LOG TESTS ============
+    
+    def _install_slow_log(self, slow_log):
+        """Register a slow-query log for this test, with freshly timed connections"""
+        models.statement_hooks.append(slow_log)
+        models.close_pool()
+        
+        def uninstall():
+            models.statement_hooks.remove(slow_log)
+            slow_log.close()
+        self.addCleanup(uninstall)
+    
+    def test_normalize_sql(self):
+        """Test literals and whitespace are folded out of statement shapes"""
+        self.assertEqual(
+            normalize_sql("SELECT *\n   FROM invoices WHERE status = 'paid' AND amount > 10.5"),
+            'SELECT * FROM invoices WHERE status = ? AND amount > ?'
+        )
+        self.assertEqual(normalize_sql("SELECT 'it''s', ?"), 'SELECT ?, ?')
+        
+        print("✓ SQL normalized to its shape")
+    
+    def test_slow_query_log_records_plan_once_per_shape(self):
+        """Test slow statements are logged as JSON with a plan on first sighting"""
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        path = os.path.join(log_dir, 'slow_queries.log')
+        self._install_slow_log(SlowQueryLog(0, path))
+        
+        self.client.get('/api/invoices?status=paid')
+        self.client.get('/api/invoices?status=unpaid')
+        
+        with open(path) as f:
+            entries = [json.loads(line) for line in f]
+        selects = [entry for entry in entries
+                   if entry['route'] == '/api/invoices' and 'FROM invoices' in entry['sql']]
+        
+        self.assertEqual(len(selects), 2)
+        self.assertEqual(selects[0]['sql'], selects[1]['sql'])
+        self.assertEqual(selects[0]['params'], ['int', 'str'])
+        self.assertGreaterEqual(selects[0]['duration_ms'], 0)
+        self.assertTrue(any(detail.startswith('SEARCH') for detail in selects[0]['plan']))
+        self.assertNotIn('plan', selects[1])
+        
+        print("✓ Slow-query log writes JSON lines with one plan per shape")
+    
+    def test_slow_query_log_skips_fast_statements(self):
+        """Test statements under the threshold are not logged"""
+        stream = io.StringIO()
+        self._install_slow_log(SlowQueryLog(60000, stream=stream))
+        
+        self.client.get('/api/clients')
+        
+        self.assertEqual(stream.getvalue(), '')
+        
+        print("✓ Fast statements not logged")
+    
+    # ============ PROFILING TESTS ============
+    
+    def _configure_profiling(self, secret=None, sample_rate=0):
+        """Point profiling at a temporary directory for this test"""
+        saved = (app_module.PROFILE_DIR, app_module.PROFILE_SECRET, app_module.PROFILE_SAMPLE_RATE)
+        profile_dir = tempfile.mkdtemp()
+        app_module.PROFILE_DIR = profile_dir
+        app_module.PROFILE_SECRET = secret
+        app_module.PROFILE_SAMPLE_RATE = sample_rate
+        
+        def restore():
+            (app_module.PROFILE_DIR, app_module.PROFILE_SECRET,
+             app_module.PROFILE_SAMPLE_RATE) = saved
+            shutil.rmtree(profile_dir)
+        self.addCleanup(restore)
+        return profile_dir
+    
+    def test_profile_header_writes_reports(self):
+        """Test a request with the admin secret writes .prof and a top-N summary"""
+        profile_dir = self._configure_profiling(secret='s3cret')
+        
+        # The list streams; the profile is written once the body is consumed
+        response = self.client.get('/api/clients', headers={'X-Profile': 's3cret'})
+        self.assertEqual(json.loads(response.data), [])
+        profile_id = response.headers['X-Profile-Id']
+        
+        self.assertEqual(
+            sorted(os.listdir(profile_dir)),
+            [profile_id + '.prof', profile_id + '.txt']
+        )
+        stats = pstats.Stats(os.path.join(profile_dir, profile_id + '.prof'))
+        self.assertTrue(any(name == 'get_clients' for _, _, name in stats.stats))
+        with open(os.path.join(profile_dir, profile_id + '.txt')) as f:
+            summary = f.read()
+        self.assertTrue(summary.startswith('GET /api/clients'))
+        self.assertIn('cumulative', summary)
+        
+        print("✓ Profile header writes .prof and summary")
+    
+    def test_unsampled_requests_are_not_profiled(self):
+        """Test wrong or missing secrets leave requests unprofiled"""
+        profile_dir = self._configure_profiling(secret='s3cret')
+        
+        for headers in ({}, {'X-Profile': 'wrong'}):
+            response = self.client.get('/api/clients', headers=headers)
+            self.assertEqual(json.loads(response.data), [])
+            self.assertNotIn('X-Profile-Id', response.headers)
+        
+        app_module.PROFILE_SECRET = None
+        self.client.get('/api/clients', headers={'X-Profile': ''}).get_data()
+        
+        self.assertEqual(os.listdir(profile_dir), [])
+        
+        print("✓ Unsampled requests not profiled")
+    
+    def test_profile_sampling(self):
+        """Test a sample rate of 1 profiles every request without a header"""
+        profile_dir = self._configure_profiling(sample_rate=1)
+        
+        self.client.get('/api/stats')
+        self.client.get('/api/invoices').get_data()
+        
+        self.assertEqual(len([name for name in os.listdir(profile_dir) if name.endswith('.prof')]), 2)
+        
+        print("✓ Sampled requests profiled")
+    
+    def test_overlapping_profiles_are_skipped(self):
+        """Test a request is served unprofiled while another profile is active"""
+        profile_dir = self._configure_profiling(secret='s3cret')
+        headers = {'X-Profile': 's3cret'}
+        
+        # Another request is being profiled
+        with app_module.profile_lock:
+            response = self.client.get('/api/stats', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response.headers)
+        
+        # Another profiling tool holds the interpreter's hooks
+        class BusyProfile(cProfile.Profile):
+            def enable(self):
+                raise ValueError('Another profiling tool is already active')
+        original = cProfile.Profile
+        cProfile.Profile = BusyProfile
+        self.addCleanup(setattr, cProfile, 'Profile', original)
+        response = self.client.get('/api/stats', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response.headers)
+        cProfile.Profile = original
+        
+        # Neither left the lock held
+        self.assertIn('X-Profile-Id', self.client.get('/api/stats', headers=headers).headers)
+        self.assertFalse(app_module.profile_lock.locked())
+        self.assertEqual(len([name for name in os.listdir(profile_dir) if name.endswith('.prof')]), 1)
+        
+        print("✓ Overlapping profiles skipped without failing the request")
+    
+    # ============ BENCHMARK TESTS ============
+    
+    def test_benchmark_runs_every_endpoint(self):
+        """Test the benchmark seeds its dataset and drives every endpoint cleanly"""
+        database = f'test_bench-{os.getpid()}.db'
+        
+        def cleanup():
+            models.close_pool()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(database + suffix):
+                    os.remove(database + suffix)
+            models.DATABASE = TEST_DATABASE
+        self.addCleanup(cleanup)
+        
+        report = bench.run(users=2, clients=3, invoices=4, requests=4, concurrency=2,
+                           database=database)
+        
+        self.assertEqual(report['dataset']['invoices'], 24)
+        self.assertEqual(len(report['endpoints']), len(bench.ENDPOINTS))
+        for name, result in report['endpoints'].items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertEqual(result['requests'], 4, name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'], name)
+        
+        print(f"✓ Benchmark drove {len(report['endpoints'])} endpoints without errors")
+    
+    # ============ QUERY BUDGET TESTS ============
+    
+    # Most SQL statements each route may run in one request, counted at the
+    # connection layer (trigger bodies and commit() are not statements here).
+    # Going over usually means an N+1 query; raise a budget only on purpose.
+    QUERY_BUDGETS = {
+        ('GET', '/metrics'): 0,
+        ('POST', '/api/register'): 1,
+        ('POST', '/api/login'): 1,
+        ('POST', '/api/logout'): 0,
+        ('GET', '/api/me'): 1,
+        ('GET', '/api/cache/users'): 0,
+        ('GET', '/api/clients'): 2,
+        ('POST', '/api/clients'): 1,
+        ('PUT', '/api/clients/<int:client_id>'): 1,
+        ('DELETE', '/api/clients/<int:client_id>'): 1,
+        ('GET', '/api/invoices'): 2,
+        ('POST', '/api/invoices'): 1,
+        ('PUT', '/api/invoices/<int:invoice_id>'): 1,
+        ('PUT', '/api/invoices/<int:invoice_id>/status'): 1,
+        ('DELETE', '/api/invoices/<int:invoice_id>'): 1,
+        ('POST', '/api/invoices/batch'): 4,
+        ('PUT', '/api/invoices/batch'): 3,
+        ('PUT', '/api/invoices/status/batch'): 3,
+        ('DELETE', '/api/invoices/batch'): 3,
+        ('GET', '/api/export/<kind>'): 1,
+        ('POST', '/api/import/clients'): 2,
+        ('POST', '/api/import/invoices'): 3,
+        ('GET', '/api/stats'): 2,
+        ('GET', '/api/dashboard'): 5,
+        ('GET', '/api/sync'): 5,
+    }
+    
+    def _count_queries(self):
+        """
+        Record every statement run during requests as (connection id, sql).
+        Returns the list, filled in as requests are made.
+        """
+        log = []
+        
+        def record(conn, sql, parameters, seconds, many):
+            if has_request_context():
+                log.append((id(conn), sql))
+        
+        models.statement_hooks.append(record)
+        self.addCleanup(models.statement_hooks.remove, record)
+        models.close_pool()
+        # Open the timed reader now, so no request is charged for its PRAGMAs
+        models.get_read_db().close()
+        return log
+    
+    def _within_budget(self, log, method, path, **kwargs):
+        """Make one request and check its statement and connection counts"""
+        log.clear()
+        response = self.client.open(path, method=method, **kwargs)
+        response.get_data()
+        self.assertLess(response.status_code, 500, path)
+        
+        rule, _ = app.url_map.bind('localhost').match(
+            path.split('?')[0], method=method, return_rule=True
+        )
+        key = (method, rule.rule)
+        statements = [sql for _, sql in log]
+        self.assertLessEqual(
+            len(statements), self.QUERY_BUDGETS[key],
+            f'{method} {rule.rule} ran {len(statements)} statements: {statements}'
+        )
+        self.assertLessEqual(len({conn for conn, _ in log}), 1, f'{method} {rule.rule}')
+        return key
+    
+    def test_routes_stay_within_query_budgets(self):
+        """Test every route runs no more statements than its budget, on one connection"""
+        log = self._count_queries()
+        client_id = self._create_client()
+        invoice_id = json.loads(self.client.post(
+            '/api/invoices',
+            data=json.dumps({'client_id': client_id, 'amount': 10}),
+            content_type='application/json'
+        ).data)['id']
+        batch = [{'client_id': client_id, 'amount': n} for n in range(1, 6)]
+        batch_ids = [result['id'] for result in json.loads(self.client.post(
+            '/api/invoices/batch', json={'invoices': batch}
+        ).data)['results']]
+        
+        requests = [
+            ('GET', '/metrics', {}),
+            ('GET', '/api/me', {}),
+            ('GET', '/api/cache/users', {}),
+            ('GET', '/api/stats', {}),
+            ('GET', '/api/dashboard', {}),
+            ('GET', '/api/sync?since=1', {}),
+            ('GET', '/api/clients', {}),
+            ('GET', '/api/clients?limit=2&search=Batch', {}),
+            ('GET', '/api/invoices', {}),
+            ('GET', '/api/invoices?limit=2&status=unpaid&sort=amount', {}),
+            ('GET', '/api/export/invoices?format=csv', {}),
+            ('GET', '/api/export/clients?format=ndjson', {}),
+            ('POST', '/api/clients', {'json': {'name': 'B', 'email': 'b@example.com'}}),
+            ('PUT', f'/api/clients/{client_id}', {'json': {'name': 'C', 'email': 'c@example.com'}}),
+            ('POST', '/api/invoices', {'json': {'client_id': client_id, 'amount': 20}}),
+            ('PUT', f'/api/invoices/{invoice_id}', {'json': {'amount': 30}}),
+            ('PUT', f'/api/invoices/{invoice_id}/status', {'json': {'status': 'paid'}}),
+            ('DELETE', f'/api/invoices/{invoice_id}', {}),
+            ('POST', '/api/invoices/batch', {'json': {'invoices': batch}}),
+            ('PUT', '/api/invoices/batch', {'json': {'invoices': [{'id': i, 'amount': 9} for i in batch_ids]}}),
+            ('PUT', '/api/invoices/status/batch',
+             {'json': {'invoices': [{'id': i, 'status': 'paid'} for i in batch_ids]}}),
+            ('DELETE', '/api/invoices/batch', {'json': {'ids': batch_ids}}),
+            ('POST', '/api/import/clients',
+             {'data': 'name,email\nI1,i1@example.com\nI2,i2@example.com\n', 'content_type': 'text/csv'}),
+            ('POST', '/api/import/invoices',
+             {'data': 'client_email,amount\nc@example.com,5\ni1@example.com,6\n', 'content_type': 'text/csv'}),
+            ('DELETE', f'/api/clients/{client_id}', {}),
+            ('POST', '/api/logout', {}),
+            ('POST', '/api/login', {'json': {'email': 'tester@example.com', 'password': 'secret123'}}),
+            ('POST', '/api/register', {'json': {'email': 'new@example.com', 'password': 'secret123', 'name': 'N'}}),
+        ]
+        checked = {self._within_budget(log, method, path, **kwargs) for method, path, kwargs in requests}
+        
+        # New routes must declare a budget and be exercised here
+        routes = {(method, rule.rule) for rule in app.url_map.iter_rules()
+                  for method in rule.methods - {'HEAD', 'OPTIONS'} if rule.endpoint != 'static'}
+        self.assertEqual(routes, set(self.QUERY_BUDGETS))
+        self.assertEqual(checked, routes)
+        
+        print(f"✓ {len(checked)} routes within their query budgets")
+    
+    def test_query_budget_catches_extra_statements(self):
+        """Test the budget check fails when a route runs an extra query"""
+        log = self._count_queries()
+        original = app_module.read_stats
+        
+        def read_stats_twice(conn, user_id):
+            original(conn, user_id)
+            return original(conn, user_id)
+        app_module.read_stats = read_stats_twice
+        self.addCleanup(setattr, app_module, 'read_stats', original)
+        
+        with self.assertRaises(AssertionError):
+            self._within_budget(log, 'GET', '/api/stats')
+        
+        print("✓ Query budget catches an extra statement")
+    
+    # ============ TEST DATABASE TESTS ============
+    
+    def test_parallel_test_processes_do_not_collide(self):
+        """Test two test processes at once, in file mode, keep separate databases"""
+        tests = [
+            'test_app.FreelanceTrackerTestCase.test_stats_update_after_operations',
+            'test_app.FreelanceTrackerTestCase.test_delete_client_cascades_to_invoices',
+        ]
+        env = dict(os.environ, TEST_DATABASE='file')
+        processes = [
+            subprocess.Popen(
+                [sys.executable, '-m', 'unittest', '-q', *tests],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+            )
+            for _ in range(2)
+        ]
+        for process in processes:
+            _, stderr = process.communicate(timeout=60)
+            self.assertEqual(process.returncode, 0, stderr.decode())
+        
+        print("✓ Parallel test processes use their own databases")
+    
+    # ============ APP FACTORY TESTS ============
+    
+    def _use_database(self, database):
+        """Point models at another database for the rest of this test"""
+        models.close_pool()
+        models.DATABASE = database
+        
+        def restore():
+            models.close_pool()
+            models.DATABASE = TEST_DATABASE
+        self.addCleanup(restore)
+    
+    def test_create_app_does_not_open_the_database(self):
+        """Test building the app leaves the pool to be created by the first request"""
+        models.close_pool()
+        
+        fresh = create_app({'TESTING': True})
+        self.assertIsNone(models._pool)
+        
+        response = fresh.test_client().post('/api/login', json={'email': 'tester@example.com', 'password': 'secret123'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(models._pool)
+        
+        print("✓ create_app defers database work to the first request")
+    
+    def test_first_request_skips_ddl_when_schema_is_current(self):
+        """Test a current database gets a version check but no DDL"""
+        statements = []
+        
+        def record(conn, sql, parameters, seconds, many):
+            statements.append(sql.strip().split()[0].upper())
+        models.statement_hooks.append(record)
+        self.addCleanup(models.statement_hooks.remove, record)
+        models.close_pool()
+        
+        self.client.get('/api/stats')
+        
+        self.assertIn('PRAGMA', statements)
+        self.assertFalse({'CREATE', 'ALTER', 'DROP', 'BEGIN'} & set(statements), statements)
+        
+        print("✓ Current schema costs one version check")
+    
+    def test_first_request_migrates_an_empty_database(self):
+        """Test the schema is created lazily the first time a new database is used"""
+        database = f'file:test_factory-{os.getpid()}?mode=memory&cache=shared'
+        keeper = sqlite3.connect(database, uri=True)
+        self.addCleanup(keeper.close)
+        self._use_database(database)
+        
+        fresh = create_app({'TESTING': True, 'DATABASE': database})
+        self.assertEqual(keeper.execute('PRAGMA user_version').fetchone()[0], 0)
+        
+        response = fresh.test_client().post(
+            '/api/register', json={'email': 'lazy@example.com', 'password': 'secret123', 'name': 'Lazy'}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(keeper.execute('PRAGMA user_version').fetchone()[0], models.SCHEMA_VERSION)
+        
+        print("✓ Empty database migrated on first request")
+    
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork()')
+    def test_forked_worker_gets_its_own_pool(self):
+        """Test a process forked after the pool exists (gunicorn --preload) opens its own"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self._use_database(os.path.join(directory, 'preload.db'))
+        parent_pool = models.get_pool()
+        
+        pid = os.fork()
+        if pid == 0:
+            pool = models.get_pool()
+            os._exit(0 if pool is not parent_pool and pool.pid == os.getpid() else 1)
+        _, status = os.waitpid(pid, 0)
+        
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertIs(models.get_pool(), parent_pool)
+        
+        print("✓ Forked worker opens its own pool")
+    
+    def test_import_to_first_response_time(self):
+        """Test a cold process imports the app and answers its first request quickly"""
+        script = (
+            "import json, time\n"
+            "start = time.perf_counter()\n"
+            "from app import app\n"
+            "imported = time.perf_counter()\n"
+            "status = app.test_client().post('/api/login', json={'email': 'x@example.com', 'password': 'x'}).status_code\n"
+            "done = time.perf_counter()\n"
+            "print(json.dumps({'status': status, 'import': imported - start, 'first_response': done - imported}))\n"
+        )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+        
+        timings = []
+        for _ in range(2):  # empty database, then an existing one
+            output = subprocess.run(
+                [sys.executable, '-c', script], cwd=directory, env=env,
+                capture_output=True, text=True, timeout=60, check=True
+            ).stdout
+            timings.append(json.loads(output.splitlines()[-1]))
+        
+        for timing in timings:
+            self.assertEqual(timing['status'], 401)
+            self.assertLess(timing['import'] + timing['first_response'], 5)
+        
+        cold, warm = timings
+        print(f"✓ Import {warm['import'] * 1000:.0f} ms, first response "
+              f"{cold['first_response'] * 1000:.1f} ms (new db) / {warm['first_response'] * 1000:.1f} ms")
+    
+    # ============ INVOICE OWNER TESTS ============
+    
+    def test_invoice_owner_backfilled_on_upgrade(self):
+        """Test upgrading a version 5 database fills invoices.user_id from clients"""
+        models.close_pool()
+        self.keeper.close()
+        remove_test_database()
+        
+        self.keeper = legacy = sqlite3.connect(TEST_DATABASE, uri=True)
+        for statements in models.MIGRATIONS[:5]:
+            for statement in statements:
+                legacy.execute(statement)
+        legacy.execute('PRAGMA user_version = 5')
+        for user_id in (1, 2):
+            legacy.execute('INSERT INTO users (email, password, name) VALUES (?, ?, ?)',
+                           (f'old{user_id}@example.com', 'x', 'Old'))
+            legacy.execute('INSERT INTO clients (user_id, name, email) VALUES (?, ?, ?)',
+                           (user_id, 'Old', f'client{user_id}@example.com'))
+            legacy.execute('INSERT INTO invoices (client_id, amount) VALUES (?, ?)', (user_id, 10 * user_id))
+        legacy.commit()
+        
+        models.init_db()
+        
+        owners = legacy.execute('SELECT client_id, user_id FROM invoices ORDER BY id').fetchall()
+        self.assertEqual(owners, [(1, 1), (2, 2)])
+        
+        print("✓ Invoice owners backfilled on upgrade")
+    
+    def test_invoice_owner_follows_its_client(self):
+        """Test invoices.user_id stays equal to the owning client's user_id"""
+        client_id = self._create_client()
+        self.client.post('/api/invoices', json={'client_id': client_id, 'amount': 10})
+        self.client.post('/api/invoices/batch', json={'invoices': [{'client_id': client_id, 'amount': 20}]})
+        other, their_client = self._other_user_client()
+        
+        def mismatches():
+            return self.keeper.execute('''
+                SELECT COUNT(*) FROM invoices JOIN clients ON invoices.client_id = clients.id
+                WHERE invoices.user_id IS NOT clients.user_id
+            ''').fetchone()[0]
+        
+        # A writer that leaves user_id out is corrected by trigger
+        self.keeper.execute('INSERT INTO invoices (client_id, amount) VALUES (?, 30)', (client_id,))
+        self.keeper.commit()
+        self.assertEqual(mismatches(), 0)
+        
+        # Handing the client to another user hands over its invoices
+        other_id = self.keeper.execute(
+            "SELECT id FROM users WHERE email = 'other@example.com'"
+        ).fetchone()[0]
+        self.keeper.execute('UPDATE clients SET user_id = ? WHERE id = ?', (other_id, client_id))
+        self.keeper.commit()
+        self.assertEqual(mismatches(), 0)
+        
+        invoices = json.loads(other.get('/api/invoices').data)
+        self.assertEqual(sorted(invoice['amount'] for invoice in invoices), [10, 20, 30])
+        self.assertEqual(json.loads(self.client.get('/api/invoices').data), [])
+        
+        # Moving an invoice to another client moves its owner
+        self.keeper.execute('UPDATE invoices SET client_id = ? WHERE amount = 30', (their_client,))
+        self.keeper.commit()
+        self.assertEqual(mismatches(), 0)
+        
+        print("✓ Invoice owner kept in step with its client")
+    
+    def test_invoice_queries_skip_the_clients_join(self):
+        """Test invoice reads filter on invoices.user_id with an index range scan"""
+        client_id = self._create_client()
+        self.client.post('/api/invoices', json={'client_id': client_id, 'amount': 10})
+        statements = []
+        models.close_pool()
+        conn = models.get_read_db()
+        conn.set_trace_callback(statements.append)
+        conn.close()
+        
+        self.client.get('/api/invoices?fields=id,amount,status')
+        self.client.get('/api/invoices?status=unpaid&limit=10&fields=id,amount')
+        
+        conn = models.get_read_db()
+        try:
+            conn.set_trace_callback(None)
+            queries = [sql for sql in statements if 'FROM invoices' in sql]
+            self.assertEqual(len(queries), 2)
+            for sql in queries:
+                self.assertNotIn('JOIN clients', sql)
+                plan = ' '.join(row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql))
+                self.assertIn('idx_invoices_user_', plan)
+        finally:
+            conn.close()
+        
+        print("✓ Invoice queries use the user_id indexes without a JOIN")
+    
+    # ============ SHARDING TESTS ============
+    
+    def _use_shards(self, count):
+        """Switch to a file database with count shards (0 = unsharded)"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self._use_database(os.path.join(directory, 'main.db'))
+        self._set_shards(count)
+        models.init_db()
+        return directory
+    
+    def _set_shards(self, count):
+        models.close_pool()
+        models.SHARDS = count
+        self.addCleanup(setattr, models, 'SHARDS', 0)
+    
+    def _sharded_user(self, email):
+        """Register a user on the current database and return (test client, user id)"""
+        user = app.test_client()
+        response = user.post('/api/register', json={'email': email, 'password': 'secret123', 'name': email})
+        return user, json.loads(response.data)['user_id']
+    
+    def _add_invoices(self, user, amounts):
+        client_id = self._create_client('Shard', 'shard@example.com', client=user)
+        for amount in amounts:
+            user.post('/api/invoices', json={'client_id': client_id, 'amount': amount})
+    
+    def _counts(self, database):
+        conn = sqlite3.connect(database)
+        try:
+            return tuple(conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                         for table in ('clients', 'invoices'))
+        finally:
+            conn.close()
+    
+    def test_sharded_users_write_to_their_own_shard(self):
+        """Test each user's clients and invoices live only in their shard"""
+        directory = self._use_shards(2)
+        first, first_id = self._sharded_user('one@example.com')
+        second, second_id = self._sharded_user('two@example.com')
+        self._add_invoices(first, [10, 20])
+        self._add_invoices(second, [5])
+        
+        self.assertEqual(self._counts(os.path.join(directory, 'main.db')), (0, 0))
+        self.assertEqual(self._counts(os.path.join(directory, f'main-shard{first_id % 2}.db')), (1, 2))
+        self.assertEqual(self._counts(os.path.join(directory, f'main-shard{second_id % 2}.db')), (1, 1))
+        
+        self.assertEqual(json.loads(first.get('/api/stats').data)['unpaid_total'], 30)
+        self.assertEqual([i['amount'] for i in json.loads(second.get('/api/invoices').data)], [5])
+        self.assertEqual(json.loads(first.get('/api/me').data)['email'], 'one@example.com')
+        
+        print("✓ Users' data written to their own shard")
+    
+    def test_shards_do_not_share_a_write_lock(self):
+        """Test a write lock held on one shard does not block another tenant"""
+        directory = self._use_shards(2)
+        first, first_id = self._sharded_user('one@example.com')
+        second, second_id = self._sharded_user('two@example.com')
+        self.assertNotEqual(first_id % 2, second_id % 2)
+        
+        blocker = sqlite3.connect(os.path.join(directory, f'main-shard{first_id % 2}.db'))
+        self.addCleanup(blocker.close)
+        blocker.execute('BEGIN IMMEDIATE')
+        try:
+            response = second.post('/api/clients', json={'name': 'Free', 'email': 'free@example.com'})
+        finally:
+            blocker.rollback()
+        
+        self.assertEqual(response.status_code, 201)
+        
+        print("✓ Tenants on different shards write in parallel")
+    
+    def test_rebalance_moves_users_into_shards(self):
+        """Test the offline tool spreads an unsharded database and re-spreads shards"""
+        directory = self._use_shards(0)
+        users = [self._sharded_user(f'user{n}@example.com') for n in range(3)]
+        for n, (user, _) in enumerate(users):
+            self._add_invoices(user, [100 * (n + 1), 1])
+        before = [(json.loads(user.get('/api/stats').data), user.get('/api/invoices').headers['ETag'])
+                  for user, _ in users]
+        
+        for count in (2, 3):
+            self._set_shards(count)
+            models.init_db()
+            report = shards.rebalance()
+            
+            self.assertEqual(self._counts(os.path.join(directory, 'main.db')), (0, 0))
+            for (user, user_id), (stats, etag) in zip(users, before):
+                self.assertEqual(models.get_user_shard(user_id), user_id % count)
+                self.assertEqual(json.loads(user.get('/api/stats').data), stats)
+                self.assertNotEqual(user.get('/api/invoices').headers['ETag'], etag)
+        self.assertEqual(report['strays_purged'], 0)
+        self.assertEqual(sum(shards.status()[shard]['invoices'] for shard in range(3)), 6)
+        
+        # Moving back to DATABASE keeps the account and its data
+        user, user_id = users[0]
+        self.assertEqual(shards.move_user(user_id, None), (1, 2))
+        self.assertIsNone(models.get_user_shard(user_id))
+        self.assertEqual(json.loads(user.get('/api/stats').data), before[0][0])
+        
+        print(f"✓ Rebalanced into 2 then 3 shards ({report['users_moved']} users moved last)")
+    
+    # ============ GROUP COMMIT TESTS ============
+    
+    def _writer(self, max_delay):
+        writer = GroupCommitWriter(models.get_db(), max_delay=max_delay, on_close=models.PooledConnection.close)
+        self.addCleanup(writer.close)
+        return writer
+    
+    def _insert_client_write(self, n):
+        def write(conn):
+            return conn.execute(
+                'INSERT INTO clients (user_id, name, email) VALUES (1, ?, ?)',
+                (f'Grouped {n}', f'grouped{n}@example.com')
+            ).lastrowid
+        return write
+    
+    def test_group_commit_batches_concurrent_writes(self):
+        """Test concurrent writes share commits and each caller gets its own result"""
+        writer = self._writer(max_delay=0.05)
+        
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            ids = list(pool.map(lambda n: writer.submit(self._insert_client_write(n)), range(20)))
+        
+        self.assertEqual(len(set(ids)), 20)
+        self.assertEqual(writer.writes, 20)
+        self.assertLess(writer.commits, 20)
+        self.assertEqual(self.keeper.execute('SELECT COUNT(*) FROM clients').fetchone()[0], 20)
+        
+        print(f"✓ 20 writes committed in {writer.commits} group(s)")
+    
+    def test_group_commit_isolates_failing_writes(self):
+        """Test a failing write is rolled back alone and its error reaches only its caller"""
+        writer = self._writer(max_delay=0.05)
+        
+        def duplicate_user(conn):
+            conn.execute("INSERT INTO clients (user_id, name, email) VALUES (1, 'Half', 'half@example.com')")
+            conn.execute("INSERT INTO users (email, password, name) VALUES ('tester@example.com', 'x', 'Dup')")
+        
+        def invalid(conn):
+            raise ValueError('bad write')
+        
+        writes = [self._insert_client_write(n) for n in range(6)] + [duplicate_user, invalid]
+        
+        def attempt(write):
+            try:
+                return writer.submit(write)
+            except Exception as e:
+                return type(e)
+        
+        with ThreadPoolExecutor(max_workers=len(writes)) as pool:
+            results = list(pool.map(attempt, writes))
+        
+        self.assertEqual(results[6:], [sqlite3.IntegrityError, ValueError])
+        self.assertTrue(all(isinstance(result, int) for result in results[:6]))
+        names = {row[0] for row in self.keeper.execute('SELECT name FROM clients')}
+        self.assertEqual(names, {f'Grouped {n}' for n in range(6)})
+        
+        print("✓ Failed writes roll back alone")
+    
+    def test_routes_behave_the_same_under_group_commit(self):
+        """Test write routes return the usual results and errors through the writer"""
+        models.close_pool()
+        models.GROUP_COMMIT = True
+        self.addCleanup(setattr, models, 'GROUP_COMMIT', False)
+        
+        client_id = self._create_client()
+        response = self.client.post('/api/invoices', json={'client_id': client_id, 'amount': 40})
+        self.assertEqual(response.status_code, 201)
+        invoice_id = json.loads(response.data)['id']
+        
+        self.assertEqual(self.client.put(f'/api/invoices/{invoice_id}', json={'amount': 50}).status_code, 200)
+        self.assertEqual(
+            self.client.put(f'/api/invoices/{invoice_id}/status', json={'status': 'paid'}).status_code, 200
+        )
+        self.assertEqual(self.client.delete('/api/invoices/999999').status_code, 404)
+        _, their_client = self._other_user_client()
+        self.assertEqual(
+            self.client.post('/api/invoices', json={'client_id': their_client, 'amount': 1}).status_code, 404
+        )
+        duplicate = self.client.post(
+            '/api/register', json={'email': 'tester@example.com', 'password': 'secret123', 'name': 'Again'}
+        )
+        self.assertEqual(duplicate.status_code, 400)
+        
+        stats = json.loads(self.client.get('/api/stats').data)
+        self.assertEqual((stats['total_clients'], stats['paid_total']), (1, 50))
+        self.assertGreater(models.get_pool().writer().commits, 0)
+        
+        print("✓ Routes unchanged under group commit")
+    
+    # ============ READ/WRITE SPLIT TESTS ============
+    
+    # Request rate and duration of the concurrency stress test
+    STRESS_RPS = float(os.environ.get('STRESS_RPS', 200))
+    STRESS_SECONDS = float(os.environ.get('STRESS_SECONDS', 1.5))
+    
+    def test_reads_use_query_only_connections(self):
+        """Test readers refuse writes and the writer is a single connection"""
+        reader = models.get_read_db()
+        try:
+            self.assertEqual(reader.execute('PRAGMA query_only').fetchone()[0], 1)
+            self.assertEqual(reader.execute('PRAGMA busy_timeout').fetchone()[0], models.BUSY_TIMEOUT_MS)
+            with self.assertRaises(sqlite3.OperationalError):
+                reader.execute("INSERT INTO users (email, password, name) VALUES ('r@example.com', 'x', 'R')")
+        finally:
+            reader.close()
+        
+        pool = models.get_pool()
+        pool.timeout = 0.01
+        writer = pool.acquire()
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                pool.acquire()
+        finally:
+            writer.close()
+        
+        print("✓ Reads on query_only connections, writes on one writer")
+    
+    def test_retry_busy_retries_only_busy_errors(self):
+        """Test busy transactions are retried up to BUSY_RETRIES times"""
+        self.addCleanup(setattr, models, 'BUSY_RETRY_MS', models.BUSY_RETRY_MS)
+        models.BUSY_RETRY_MS = 1
+        attempts = []
+        
+        def busy_twice():
+            attempts.append(1)
+            if len(attempts) <= 2:
+                raise sqlite3.OperationalError('database is locked')
+            return 'done'
+        
+        self.assertEqual(models.retry_busy(busy_twice), 'done')
+        self.assertEqual(len(attempts), 3)
+        
+        def busy_forever():
+            attempts.append(1)
+            raise sqlite3.OperationalError('database is locked')
+        
+        attempts.clear()
+        with self.assertRaises(sqlite3.OperationalError):
+            models.retry_busy(busy_forever)
+        self.assertEqual(len(attempts), models.BUSY_RETRIES + 1)
+        
+        def not_busy():
+            attempts.append(1)
+            raise sqlite3.OperationalError('no such table: nope')
+        
+        attempts.clear()
+        with self.assertRaises(sqlite3.OperationalError):
+            models.retry_busy(not_busy)
+        self.assertEqual(len(attempts), 1)
+        
+        print("✓ Only SQLITE_BUSY is retried")
+    
+    def test_concurrent_load_has_no_lock_errors(self):
+        """Test mixed reads and writes at STRESS_RPS, beside another writing process, never fail"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        database = os.path.join(directory, 'stress.db')
+        self._use_database(database)
+        models.init_db()
+        
+        workers = 8
+        users = [self._sharded_user(f'stress{n}@example.com')[0] for n in range(workers)]
+        for user in users:
+            self._create_client('Stress', 'stress@example.com', client=user)
+        
+        stop = threading.Event()
+        errors = []
+        
+        def other_process():
+            # A second writer outside this process's writer connection
+            conn = sqlite3.connect(database, timeout=5)
+            try:
+                while not stop.is_set():
+                    conn.execute('BEGIN IMMEDIATE')
+                    conn.execute("UPDATE user_stats SET data_version = data_version WHERE user_id = 1")
+                    time.sleep(0.001)
+                    conn.commit()
+                    time.sleep(0.005)
+            finally:
+                conn.close()
+        
+        def worker(user):
+            interval = workers / self.STRESS_RPS
+            client_id = json.loads(user.get('/api/clients').data)[0]['id']
+            done = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < self.STRESS_SECONDS:
+                step = done % 4
+                try:
+                    if step == 0:
+                        response = user.post('/api/invoices', json={'client_id': client_id, 'amount': 1})
+                    elif step == 1:
+                        response = user.get('/api/invoices?limit=20')
+                    elif step == 2:
+                        response = user.put(f'/api/clients/{client_id}', json={'name': 'S', 'email': 's@example.com'})
+                    else:
+                        response = user.get('/api/stats')
+                    if response.status_code >= 500:
+                        errors.append(response.get_data(as_text=True))
+                except Exception as e:
+                    errors.append(repr(e))
+                done += 1
+                # Pace to the target rate
+                time.sleep(max(start + done * interval - time.perf_counter(), 0))
+            return done
+        
+        background = threading.Thread(target=other_process)
+        background.start()
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                counts = list(pool.map(worker, users))
+            elapsed = time.perf_counter() - start
+        finally:
+            stop.set()
+            background.join()
+        
+        # Throughput depends on the machine; only failures and lost writes count
+        self.assertEqual(errors, [])
+        for user, count in zip(users, counts):
+            self.assertGreaterEqual(count, 4)  # every kind of request ran
+            invoices = json.loads(user.get('/api/invoices').data)
+            self.assertEqual(len(invoices), (count + 3) // 4)
+        
+        total = sum(counts)
+        print(f"✓ {total} requests at {total / elapsed:.0f} req/s without lock errors")
+    
+    def test_imports_release_the_writer_between_chunks(self):
+        """Test another user's write goes through while an import is mid-upload"""
+        self.addCleanup(setattr, models, 'POOL_TIMEOUT', models.POOL_TIMEOUT)
+        self.addCleanup(setattr, app_module, 'IMPORT_CHUNK_SIZE', app_module.IMPORT_CHUNK_SIZE)
+        self.addCleanup(setattr, app_module, 'parse_date', app_module.parse_date)
+        models.close_pool()
+        models.POOL_TIMEOUT = 0.2
+        app_module.IMPORT_CHUNK_SIZE = 2
+        other, _ = self._other_user_client()
+        
+        # Parsing row 3 means the first chunk has been written. The other
+        # request runs on its own thread, as it would under a threaded server
+        statuses = []
+        original = app_module.parse_date
+        
+        def other_write():
+            statuses.append(other.post('/api/clients', json={'name': 'M', 'email': 'm@example.com'}).status_code)
+        
+        def parse_date(*args, **kwargs):
+            if not statuses and args[0] == '2024-01-03':
+                thread = threading.Thread(target=other_write)
+                thread.start()
+                thread.join()
+            return original(*args, **kwargs)
+        app_module.parse_date = parse_date
+        
+        rows = ''.join(f'C{n},c{n}@example.com,2024-01-0{n}\n' for n in range(1, 5))
+        report = json.loads(self._upload('/api/import/clients', 'name,email,created_at\n' + rows).data)
+        
+        self.assertEqual(report['imported'], 4)
+        self.assertEqual(statuses, [201])
+        
+        print("✓ Import leaves the writer free between chunks")
+    
+    def test_batch_writes_retry_when_busy(self):
+        """Test batch and import transactions are retried while another process holds the lock"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        database = os.path.join(directory, 'busy.db')
+        self.addCleanup(setattr, models, 'PRAGMAS', models.PRAGMAS)
+        self.addCleanup(setattr, models, 'BUSY_RETRIES', models.BUSY_RETRIES)
+        self.addCleanup(setattr, models, 'BUSY_RETRY_MS', models.BUSY_RETRY_MS)
+        # No SQLite-level waiting, so only retry_busy can get past the lock
+        models.PRAGMAS = [(name, 0 if name == 'busy_timeout' else value) for name, value in models.PRAGMAS]
+        models.BUSY_RETRIES = 20
+        models.BUSY_RETRY_MS = 5
+        self._use_database(database)
+        models.init_db()
+        user, _ = self._sharded_user('busy@example.com')
+        client_id = self._create_client(client=user)
+        
+        blocker = sqlite3.connect(database, check_same_thread=False)
+        self.addCleanup(blocker.close)
+        for method, path, body, content_type in (
+            ('POST', '/api/invoices/batch', json.dumps({'invoices': [{'client_id': client_id, 'amount': 5}]}),
+             'application/json'),
+            ('PUT', '/api/invoices/status/batch', json.dumps({'invoices': [{'id': 1, 'status': 'paid'}]}),
+             'application/json'),
+            ('POST', '/api/import/clients', 'name,email\nI,i@example.com\n', 'text/csv'),
+        ):
+            blocker.execute('BEGIN IMMEDIATE')
+            release = threading.Timer(0.05, blocker.rollback)
+            release.start()
+            response = user.open(path, method=method, data=body, content_type=content_type)
+            release.join()
+            self.assertEqual(response.status_code, 200, path)
+        
+        self.assertEqual(json.loads(user.get('/api/stats').data)['paid_total'], 5)
+        
+        # The group-commit writer retries its BEGIN IMMEDIATE the same way
+        models.close_pool()
+        models.GROUP_COMMIT = True
+        self.addCleanup(setattr, models, 'GROUP_COMMIT', False)
+        blocker.execute('BEGIN IMMEDIATE')
+        release = threading.Timer(0.05, blocker.rollback)
+        release.start()
+        response = user.post('/api/invoices', json={'client_id': client_id, 'amount': 7})
+        release.join()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(models.get_pool().writer().commits, 1)
+        
+        print("✓ Batch, import and grouped writes retried past a busy lock")
+    
+    # ============ SYNC TESTS ============
+    
+    def _sync(self, since, client=None):
+        response = (client or self.client).get(f'/api/sync?since={since}')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+    
+    def test_sync_returns_only_changed_rows(self):
+        """Test /api/sync sends everything once, then only rows changed since"""
+        first = self._create_client('First', 'first@example.com')
+        self._create_client('Second', 'second@example.com')
+        self.client.post('/api/invoices', json={'client_id': first, 'amount': 10})
+        
+        snapshot = self._sync(0)
+        self.assertTrue(snapshot['reset'])
+        self.assertEqual(len(snapshot['clients']), 2)
+        self.assertEqual(len(snapshot['invoices']), 1)
+        self.assertNotIn('client_name', snapshot['invoices'][0])
+        
+        self.client.put(f'/api/clients/{first}', json={'name': 'Renamed', 'email': 'first@example.com'})
+        invoice_id = json.loads(self.client.post(
+            '/api/invoices', json={'client_id': first, 'amount': 20}
+        ).data)['id']
+        
+        delta = self._sync(snapshot['version'])
+        self.assertFalse(delta['reset'])
+        self.assertGreater(delta['version'], snapshot['version'])
+        self.assertEqual([client['name'] for client in delta['clients']], ['Renamed'])
+        self.assertEqual([invoice['id'] for invoice in delta['invoices']], [invoice_id])
+        self.assertEqual(delta['deleted'], {'clients': [], 'invoices': []})
+        self.assertEqual(delta['stats']['unpaid_total'], 30)
+        
+        # Nothing changed, nothing sent
+        unchanged = self._sync(delta['version'])
+        self.assertEqual((unchanged['version'], unchanged['clients'], unchanged['invoices']),
+                         (delta['version'], [], []))
+        
+        print("✓ Sync sends a snapshot, then only changed rows")
+    
+    def test_sync_reports_deletes_as_tombstones(self):
+        """Test deleted rows, including cascaded invoices, come back as tombstones"""
+        client_id = self._create_client()
+        invoice_ids = [json.loads(self.client.post(
+            '/api/invoices', json={'client_id': client_id, 'amount': amount}
+        ).data)['id'] for amount in (10, 20, 30)]
+        other, _ = self._other_user_client()
+        version = self._sync(0)['version']
+        other_version = self._sync(0, client=other)['version']
+        
+        self.client.delete(f'/api/invoices/{invoice_ids[0]}')
+        self.client.delete(f'/api/clients/{client_id}')
+        
+        delta = self._sync(version)
+        self.assertEqual((delta['clients'], delta['invoices']), ([], []))
+        self.assertEqual(delta['deleted']['clients'], [client_id])
+        self.assertEqual(sorted(delta['deleted']['invoices']), invoice_ids)
+        self.assertEqual(delta['stats']['total_invoices'], 0)
+        
+        # Another user's deletes are not reported
+        self.assertEqual(self._sync(other_version, client=other)['deleted'], {'clients': [], 'invoices': []})
+        
+        print("✓ Deletes synced as tombstones")
+    
+    def test_sync_resets_when_since_cannot_be_answered(self):
+        """Test pruned tombstones or an unknown since give a full snapshot"""
+        client_id = self._create_client()
+        self._create_client('Kept', 'kept@example.com')
+        version = self._sync(0)['version']
+        self.client.delete(f'/api/clients/{client_id}')
+        
+        # Prune the tombstone as if it were a month old
+        self.keeper.execute("UPDATE tombstones SET deleted_at = datetime('now', '-31 days')")
+        self.keeper.commit()
+        self.assertEqual(models.prune_tombstones(30), 1)
+        
+        delta = self._sync(version)
+        self.assertTrue(delta['reset'])
+        self.assertEqual([client['name'] for client in delta['clients']], ['Kept'])
+        self.assertFalse(self._sync(delta['version'])['reset'])
+        
+        # A version this database never reached
+        self.assertTrue(self._sync(delta['version'] + 100)['reset'])
+        
+        for since in ('abc', '-1'):
+            self.assertEqual(self.client.get(f'/api/sync?since={since}').status_code, 400)
+        self.assertEqual(app.test_client().get('/api/sync').status_code, 401)
+        
+        print("✓ Sync falls back to a snapshot when it must")
+    
+    def test_sync_snapshot_streams_from_the_cursors(self):
+        """Test a snapshot bigger than one fetchmany batch streams as one valid object"""
+        count = app_module.STREAM_BATCH_SIZE * 2 + 7
+        self._bulk_clients(count)
+        client_id = self._create_client()
+        self.client.post('/api/invoices', json={'client_id': client_id, 'amount': 10})
+        
+        response = self.client.get('/api/sync?since=0')
+        self.assertTrue(response.is_streamed)
+        snapshot = json.loads(response.data)
+        
+        self.assertTrue(snapshot['reset'])
+        self.assertEqual(len({client['id'] for client in snapshot['clients']}), count + 1)
+        self.assertEqual([invoice['amount'] for invoice in snapshot['invoices']], [10])
+        self.assertEqual(snapshot['stats']['total_clients'], count + 1)
+        self.assertEqual(self._sync(snapshot['version'])['clients'], [])
+        
+        print(f"✓ Snapshot of {count + 1} clients streamed")
 
 if __name__ == '__main__':
     """Run all tests with detailed output"""